@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Bulk session codec benchmark
+───────────────────────────────────────────────────────────
+Builds a corpus of random StringSessions (a million by default)
+and times the ways of getting at them: decoding each string on
+its own (telethon's StringSession, and telegram_session.py's
+session_fields), versus packing them once into the fixed-width
+binary format and reading it memory-mapped. Grouping by DC is
+the headline — it is what `check` needs before it can route a
+single request.
+
+    python3 bench/bench_codec.py
+    python3 bench/bench_codec.py --records 200000 --skip-telethon
+───────────────────────────────────────────────────────────
+"""
+
+import argparse, base64, ipaddress, os, struct, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+import telegram_session as ts
+
+
+def corpus(n):
+    """n StringSessions spread over DCs 1–5, a tenth of them on IPv6 addresses."""
+    keys, out = os.urandom(256 * n), []
+    for i in range(n):
+        dc = 1 + i % 5
+        ip, port = (ts.DC_ADDRESSES_V6 if i % 10 == 0 else ts.DC_ADDRESSES)[dc]
+        raw = struct.pack(">B", dc) + ipaddress.ip_address(ip).packed + struct.pack(">H", port) \
+            + keys[i * 256:(i + 1) * 256]
+        out.append("1" + base64.urlsafe_b64encode(raw).decode("ascii"))
+    return out
+
+
+def timed(label, fn, n, results):
+    start = time.perf_counter()
+    value = fn()
+    seconds = time.perf_counter() - start
+    results.append((label, seconds, n / seconds if seconds else float("inf")))
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-string decoding vs the memory-mapped pack.")
+    parser.add_argument("--records", type=int, default=1_000_000, help="sessions in the corpus (default: 1000000)")
+    parser.add_argument("--skip-telethon", action="store_true",
+                        help="leave out telethon's StringSession, the slowest baseline")
+    args = parser.parse_args()
+    n = args.records
+
+    print(f"\n  building {n} session strings …", flush=True)
+    strings = corpus(n)
+    results = []
+
+    def by_dc(dcs):
+        groups = {}
+        for i, dc in enumerate(dcs):
+            groups.setdefault(dc, []).append(i)
+        return groups
+
+    if not args.skip_telethon:
+        from telethon.sessions import StringSession
+        timed("telethon StringSession → group by DC", lambda: by_dc(StringSession(s).dc_id for s in strings),
+              n, results)
+    timed("session_fields() → group by DC", lambda: by_dc(ts.session_fields(s)[0] for s in strings), n, results)
+    timed("session_dc() → group by DC", lambda: by_dc(ts.session_dc(s) for s in strings), n, results)
+
+    with tempfile.TemporaryDirectory(prefix="tg-codec-") as tmp:
+        path = os.path.join(tmp, "corpus.tgsp")
+        timed("strings → pack (one-off)", lambda: ts.write_pack(path, ts.string_records(strings)), n, results)
+
+        def grouped():
+            with ts.SessionPack(path) as pack:
+                return {dc: len(ix) for dc, ix in pack.group_by_dc().items()}
+        groups = timed("open pack → group by DC", grouped, n, results)
+
+        def ids():
+            with ts.SessionPack(path) as pack:
+                return pack.dc_ids().count(2)
+        timed("open pack → dc_ids()", ids, n, results)
+
+        def decode():
+            with ts.SessionPack(path) as pack:
+                return sum(1 for _ in pack.strings())
+        timed("pack → strings", decode, n, results)
+        pack_mb = os.path.getsize(path) / 1e6
+
+    text_mb = sum(len(s) + 1 for s in strings) / 1e6
+    print(f"\n  {'step':<40} {'seconds':>9} {'records/s':>14}")
+    for label, seconds, rate in results:
+        print(f"  {label:<40} {seconds:9.3f} {rate:14,.0f}")
+    print(f"\n  {n} sessions: {text_mb:.1f} MB as text, {pack_mb:.1f} MB packed")
+    print(f"  per DC: {dict(sorted(groups.items()))}\n")
+
+
+if __name__ == "__main__":
+    main()
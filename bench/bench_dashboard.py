@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Batch dashboard benchmark
+───────────────────────────────────────────────────────────
+Puts growing numbers of accounts on telegram_session.py's
+BatchBoard — in flight, parked and finished — and times its
+frames on a fixed-size terminal: microseconds per frame and
+bytes written per frame. Between frames a few accounts change
+phase and a few finish, as in a real run. Both should stay flat
+as the account count grows, since a frame only ever looks at
+the rows that fit on the screen.
+
+    python3 bench/bench_dashboard.py
+    python3 bench/bench_dashboard.py --accounts 100 10000 --frames 500
+───────────────────────────────────────────────────────────
+"""
+
+import argparse, io, os, random, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+import telegram_session as ts
+
+PHASES = ("connect", "send_code", "code_wait", "sign_in", "password")
+
+
+class Terminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def run(n, frames, churn, rng):
+    out   = Terminal()
+    board = ts.BatchBoard(live=True, out=out)
+    jobs  = [ts.Job(1, "a" * 32, f"+4477{i:08d}") for i in range(n)]
+    for job in jobs:
+        board.add(job)
+        job.phase, job.delivery = rng.choice(PHASES), "app"
+    for job in jobs[::10]:
+        board.park(job, time.time() + 60)
+    board.draw()                        # the first frame paints everything
+    waiting = [job for job in jobs if job.phase != "parked"]
+
+    out.seek(0)
+    out.truncate()
+    start = time.perf_counter()
+    for _ in range(frames):
+        for job in rng.sample(waiting, min(churn, len(waiting))):
+            job.phase, job.since = rng.choice(PHASES), time.monotonic()
+        if len(waiting) > churn:
+            for _ in range(churn // 4 or 1):
+                job = waiting.pop()
+                job.session = "done"
+                board.remove(job)
+                print(f"  {job.phone}  signed in", file=board)
+        board.draw()
+    seconds = time.perf_counter() - start
+    return seconds / frames * 1e6, len(out.getvalue()) / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BatchBoard frame cost vs account count.")
+    parser.add_argument("--accounts", type=int, nargs="+", default=[100, 1000, 10000, 100000],
+                        help="account counts to try (default: 100 1000 10000 100000)")
+    parser.add_argument("--frames", type=int, default=200, help="frames timed per count (default: 200)")
+    parser.add_argument("--churn", type=int, default=8,
+                        help="accounts changing phase between frames (default: 8)")
+    parser.add_argument("--size", default="120x40", help="terminal COLUMNSxLINES (default: 120x40)")
+    args = parser.parse_args()
+    os.environ["COLUMNS"], os.environ["LINES"] = args.size.split("x")
+
+    rng = random.Random(1)
+    print(f"\n  {'accounts':>9} {'µs/frame':>10} {'bytes/frame':>12}")
+    for n in args.accounts:
+        micros, written = run(n, args.frames, args.churn, rng)
+        print(f"  {n:>9} {micros:10.0f} {written:12.0f}")
+    print()
+
+
+if __name__ == "__main__":
+    main()
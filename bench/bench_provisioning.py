@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Offline provisioning benchmark
+───────────────────────────────────────────────────────────
+Drives telegram_session.py's batch and check pipelines against
+bench/fake_telegram.py and reports accounts/sec, per-account
+latency (p50 / p90 / p99 / max) and peak RSS. Each scenario runs
+in its own subprocess so peak RSS belongs to that scenario only.
+Nothing touches the network or your ~/.telegram-session.
+
+    python3 bench/bench_provisioning.py
+    python3 bench/bench_provisioning.py --accounts 2000 --concurrency 64
+    python3 bench/bench_provisioning.py --save baseline.json
+    python3 bench/bench_provisioning.py --compare baseline.json
+───────────────────────────────────────────────────────────
+"""
+
+import argparse, asyncio, base64, contextlib, io, json, os, resource, struct, subprocess, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PREFIXES = ("+44", "+1", "+49", "+91", "+55", "+7", "+353", "+86")
+
+
+def scenarios(args):
+    backend = dict(latency=args.latency, jitter=args.latency / 5, handshake=args.handshake,
+                   handshake_cpu=args.handshake_cpu)
+    return {
+        "single": dict(kind="batch", accounts=1, repeat=args.repeat, concurrency=1,
+                       backend=backend),
+        "batch":  dict(kind="batch", accounts=args.accounts, repeat=1, concurrency=args.concurrency,
+                       backend=backend),
+        "faults": dict(kind="batch", accounts=args.accounts, repeat=1, concurrency=args.concurrency,
+                       backend=dict(backend, flood_rate=0.05, flood_seconds=1,
+                                    migrate_rate=0.3, password_rate=0.2)),
+        "pooled": dict(kind="batch", accounts=args.accounts, repeat=1, concurrency=args.concurrency,
+                       backend=backend, key_pool=args.concurrency),
+        "check":  dict(kind="check", accounts=args.accounts, repeat=1, concurrency=args.concurrency,
+                       backend=backend),
+    }
+
+
+def percentiles(samples):
+    s = sorted(samples)
+    q = lambda f: round(s[min(len(s) - 1, int(f * len(s)))], 4) if s else None
+    return {"p50": q(0.50), "p90": q(0.90), "p99": q(0.99), "max": s[-1] if s else None}
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def phone(n):
+    return f"{PREFIXES[n % len(PREFIXES)]}7{n:09d}"
+
+
+# ── Child process: run one scenario, print JSON ──────────
+def run_scenario(config):
+    os.environ["TG_SESSION_HOME"] = tempfile.mkdtemp(prefix="tg-bench-")
+    sys.path.insert(0, HERE)
+    sys.path.insert(0, os.path.join(HERE, ".."))
+    import fake_telegram
+    backend = fake_telegram.FakeBackend(seed=1, **config["backend"])
+    fake_telegram.install(backend)
+    import telegram_session as ts
+
+    latencies, results = [], {"ok": 0, "failed": 0}
+    pooled = {"key_hits": 0, "key_misses": 0, "key_failed": 0}
+
+    async def timed(fn, *a):
+        start = time.perf_counter()
+        try:
+            return await fn(*a)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    if config["kind"] == "batch":
+        real_provision = ts.provision
+        ts.provision = lambda *a: timed(real_provision, *a)
+        source = fake_telegram.FakeCodeSource(backend)
+
+        def done(job):
+            results["ok" if job.session else "failed"] += 1
+
+        def once():
+            jobs = (ts.Job(1, "a" * 32, phone(n)) for n in range(config["accounts"]))
+            # The pool's workers install the fake themselves: under spawn or
+            # forkserver they start without the patch made above.
+            keys = ts.AuthKeyPool(reserve=config["key_pool"], initializer=fake_telegram.install,
+                                  initargs=(backend,)) if config.get("key_pool") else None
+            asyncio.run(ts.run_batch(jobs, source, config["concurrency"], done, keys=keys))
+            if keys:
+                pooled["key_hits"] += keys.hits
+                pooled["key_misses"] += keys.misses
+                pooled["key_failed"] += keys.failed
+    else:
+        real_check = ts.check_session
+        ts.check_session = lambda *a: timed(real_check, *a)
+
+        async def lines():
+            for n in range(config["accounts"]):
+                raw = struct.pack(">B4sH256s", 2, bytes((149, 154, 167, 51)), 443, os.urandom(256))
+                yield n + 1, "1" + base64.urlsafe_b64encode(raw).decode()
+
+        def emit(n, dc, status, detail):
+            results["ok" if status == "ok" else "failed"] += 1
+
+        def once():
+            asyncio.run(ts.run_check(lines(), 1, "a" * 32, emit, config["concurrency"]))
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(config["repeat"]):
+            once()
+    elapsed = time.perf_counter() - start
+
+    total = results["ok"] + results["failed"]
+    return dict(
+        accounts=total, ok=results["ok"], failed=results["failed"],
+        seconds=round(elapsed, 3), per_sec=round(total / elapsed, 2),
+        requests=backend.requests, peak_rss_mb=peak_rss_mb(),
+        **percentiles(latencies), **(pooled if config.get("key_pool") else {}),
+    )
+
+
+# ── Parent: run every scenario, report, compare ──────────
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput / latency benchmark.")
+    parser.add_argument("--accounts", type=int, default=500, help="accounts per batch scenario (default: 500)")
+    parser.add_argument("--concurrency", type=int, default=32, help="accounts in flight (default: 32)")
+    parser.add_argument("--repeat", type=int, default=20, help="runs of the single-account scenario (default: 20)")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake round-trip seconds (default: 0.02)")
+    parser.add_argument("--handshake", type=float, default=0.05, help="fake auth-key handshake seconds (default: 0.05)")
+    parser.add_argument("--handshake-cpu", type=int, default=20000,
+                        help="fake PBKDF2 iterations burnt per handshake, standing in for DH (default: 20000)")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="run only these scenarios")
+    parser.add_argument("--save", metavar="FILE", help="write results as JSON, e.g. a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="fail if worse than this saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed regression vs the baseline, as a fraction (default: 0.15)")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--config", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_scenario(json.loads(args.config))))
+        return
+
+    results = {}
+    print(f"\n  {'scenario':<8} {'accounts':>8} {'ok':>6} {'acct/s':>9} {'p50':>8} {'p99':>8} {'max':>8} {'RSS MB':>7}")
+    for name, config in scenarios(args).items():
+        if args.only and name not in args.only:
+            continue
+        out = subprocess.run([sys.executable, __file__, "--run", name, "--config", json.dumps(config)],
+                             capture_output=True, text=True)
+        if out.returncode:
+            print(out.stderr, file=sys.stderr)
+            sys.exit(f"scenario {name} crashed")
+        r = results[name] = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"  {name:<8} {r['accounts']:>8} {r['ok']:>6} {r['per_sec']:>9.1f} "
+              f"{r['p50']:>7.3f}s {r['p99']:>7.3f}s {r['max']:>7.3f}s {r['peak_rss_mb']:>7.1f}")
+        if "key_hits" in r:
+            print(f"  {'':<8} auth-key pool: {r['key_hits']} ready keys, {r['key_misses']} negotiated")
+            if r["key_failed"]:
+                # The workers are offline too; a failure means one ran without the fake.
+                sys.exit(f"scenario {name}: {r['key_failed']} auth keys failed in the pool's workers")
+    print()
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"  saved to {args.save}\n")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        worse = []
+        for name, r in results.items():
+            b = baseline.get(name)
+            if not b:
+                continue
+            if r["per_sec"] < b["per_sec"] * (1 - args.tolerance):
+                worse.append(f"{name}: {r['per_sec']} acct/s vs {b['per_sec']} baseline")
+            if r["p99"] > b["p99"] * (1 + args.tolerance):
+                worse.append(f"{name}: p99 {r['p99']}s vs {b['p99']}s baseline")
+            if r["peak_rss_mb"] > b["peak_rss_mb"] * (1 + args.tolerance):
+                worse.append(f"{name}: peak RSS {r['peak_rss_mb']} MB vs {b['peak_rss_mb']} MB baseline")
+        if worse:
+            print("  Regressions beyond tolerance:\n    " + "\n    ".join(worse) + "\n")
+            sys.exit(1)
+        print(f"  No regressions beyond {args.tolerance:.0%} of {args.compare}\n")
+
+
+if __name__ == "__main__":
+    main()
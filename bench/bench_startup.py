@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark with an import-time budget
+───────────────────────────────────────────────────────────
+Measures how long `python3 telegram_session.py` takes to show
+its first prompt, how long `import telegram_session` takes, and
+which modules that import pulls in (python -X importtime). Fails
+when a budget is exceeded or when a module that should load
+lazily — telethon — is imported at startup.
+
+    python3 bench/bench_startup.py
+    python3 bench/bench_startup.py --prompt-budget 0.2 --import-budget 0.08
+───────────────────────────────────────────────────────────
+"""
+
+import argparse, os, statistics, subprocess, sys, time
+
+HERE   = os.path.dirname(os.path.abspath(__file__))
+ROOT   = os.path.dirname(HERE)
+SCRIPT = os.path.join(ROOT, "telegram_session.py")
+FIRST_PROMPT = b"Press Enter when you have them ready"
+
+
+def import_profile():
+    """(total seconds, {module: cumulative seconds}) for `import telegram_session`."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import telegram_session"],
+                         cwd=ROOT, capture_output=True, text=True, check=True).stderr
+    modules = {}
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative) / 1e6
+    return modules.get("telegram_session", 0.0), modules
+
+
+def time_to_first_prompt(timeout=10):
+    """Seconds from spawning the interactive script until its first input() prompt is written."""
+    env = dict(os.environ, TERM=os.environ.get("TERM", "dumb"))
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, SCRIPT], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, env=env)
+    seen = b""
+    try:
+        while FIRST_PROMPT not in seen:
+            chunk = os.read(proc.stdout.fileno(), 4096)
+            if not chunk or time.perf_counter() - start > timeout:
+                raise RuntimeError("the script exited or stalled before its first prompt")
+            seen += chunk
+        return time.perf_counter() - start
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start timing with budgets.")
+    parser.add_argument("--runs", type=int, default=10, help="runs to take the median of (default: 10)")
+    parser.add_argument("--prompt-budget", type=float, default=0.25,
+                        help="max median seconds to the first prompt (default: 0.25)")
+    parser.add_argument("--import-budget", type=float, default=0.12,
+                        help="max median seconds for `import telegram_session` (default: 0.12)")
+    parser.add_argument("--forbid", nargs="*", default=["telethon"], metavar="MODULE",
+                        help="modules that must not be imported at startup (default: telethon)")
+    parser.add_argument("--top", type=int, default=8, help="slowest modules to list (default: 8)")
+    args = parser.parse_args()
+
+    # Warm the OS cache and __pycache__ so every measured run is comparable.
+    import_profile()
+    imports, profiles, prompts = [], [], []
+    for _ in range(args.runs):
+        total, modules = import_profile()
+        imports.append(total)
+        profiles.append(modules)
+        prompts.append(time_to_first_prompt())
+
+    import_s, prompt_s = statistics.median(imports), statistics.median(prompts)
+    loaded = profiles[-1]
+    print(f"\n  first prompt         {prompt_s * 1000:7.1f} ms   (budget {args.prompt_budget * 1000:.0f} ms)")
+    print(f"  import (total)       {import_s * 1000:7.1f} ms   (budget {args.import_budget * 1000:.0f} ms)")
+    print("\n  slowest imports at startup (cumulative, last run):")
+    slowest = sorted(((s, m) for m, s in loaded.items() if m != "telegram_session"), reverse=True)
+    for seconds, module in slowest[:args.top]:
+        print(f"    {module:<28} {seconds * 1000:7.1f} ms")
+    print()
+
+    failures = []
+    if prompt_s > args.prompt_budget:
+        failures.append(f"first prompt took {prompt_s * 1000:.1f} ms")
+    if import_s > args.import_budget:
+        failures.append(f"import took {import_s * 1000:.1f} ms")
+    for module in args.forbid:
+        if any(m == module or m.startswith(module + ".") for m in loaded):
+            failures.append(f"{module} is imported at startup")
+    if failures:
+        print("  Over budget:\n    " + "\n    ".join(failures) + "\n")
+        sys.exit(1)
+    print("  Within budget\n")
+
+
+if __name__ == "__main__":
+    main()
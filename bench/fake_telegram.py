@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Fake Telegram backend for offline benchmarks
+───────────────────────────────────────────────────────────
+A stand-in for the slice of telethon's TelegramClient that
+telegram_session.py uses — connect, send_code_request,
+resend_code_request, raw SendCodeRequest, sign_in, the SRP 2FA
+exchange, help.getConfig, _switch_dc (which, like telethon, asks
+for the config first unless the class already holds one),
+session.save, and a signed-in session's get_me and NewMessage
+handler for the login message from 777000 — with configurable
+latency, error injection and every SentCodeType* delivery
+method. No network, no real phone.
+
+    import fake_telegram
+    backend = fake_telegram.FakeBackend(latency=0.05, flood_rate=0.1)
+    fake_telegram.install(backend)      # patches telethon.TelegramClient, blocks the network
+───────────────────────────────────────────────────────────
+"""
+
+import asyncio, datetime, hashlib, os, random, secrets, time
+from types import SimpleNamespace
+
+from telethon import errors, functions, password as srp
+from telethon.crypto import AuthKey
+from telethon.sessions import StringSession
+from telethon.tl import types
+from telethon.tl.types import account, auth
+
+
+# Every delivery method decode_code_type() knows about, plus the newer word
+# and phrase variants that fall through to its "unknown" branch.
+CODE_TYPES = {
+    "app":       lambda: auth.SentCodeTypeApp(length=5),
+    "sms":       lambda: auth.SentCodeTypeSms(length=5),
+    "call":      lambda: auth.SentCodeTypeCall(length=5),
+    "flash":     lambda: auth.SentCodeTypeFlashCall(pattern="+44*****"),
+    "missed":    lambda: auth.SentCodeTypeMissedCall(prefix="+4420", length=5),
+    "email":     lambda: auth.SentCodeTypeEmailCode(email_pattern="j***@example.com", length=6),
+    "setup":     lambda: auth.SentCodeTypeSetUpEmailRequired(),
+    "fragment":  lambda: auth.SentCodeTypeFragmentSms(url="https://fragment.com/number", length=5),
+    "firebase":  lambda: auth.SentCodeTypeFirebaseSms(length=6),
+    "smsword":   lambda: auth.SentCodeTypeSmsWord(),
+    "smsphrase": lambda: auth.SentCodeTypeSmsPhrase(),
+}
+
+# The 2048-bit safe prime Telegram uses for SRP; telethon accepts it with g = 3.
+SRP_PRIME = bytes.fromhex(
+    "c71caeb9c6b1c9048e6c522f70f13f73980d40238e3e21c14934d037563d930f48198a0aa7c14058229493d22530f4db"
+    "fa336f6e0ac925139543aed44cce7c3720fd51f69458705ac68cd4fe6b6b13abdc9746512969328454f18faf8c595f64"
+    "2477fe96bb2a941d5bcd1d4ac8cc49880708fa9b378e3c4f3a9060bee67cf9a4a4a695811051907e162753b56b0f6b41"
+    "0dba74d8a84b2a14b3144e0ef1284754fd17ed950d5965b4b9dd46582db1178d169c6bc465b0d6ff9ca3928fef5b9ae4"
+    "e418fc15e83ebea0f87fa9ff5eed70050ded2849f47bf959d956850ce929851f0d8115f635b105ee2e4e15d04b2454bf"
+    "6f4fadf034b10403119cd8e3b92fcc5b")
+
+DC_ADDRESSES = {1: "149.154.175.53", 2: "149.154.167.51", 3: "149.154.175.100",
+                4: "149.154.167.91", 5: "91.108.56.130"}
+
+
+class FakeBackend:
+    """Server-side behaviour shared by every FakeClient.
+
+    latency / jitter    seconds per request round trip
+    handshake           extra seconds for a connect that negotiates an auth key
+    handshake_cpu       PBKDF2 iterations burnt per handshake, standing in for DH
+    flood_rate          chance a send_code_request raises FloodWaitError
+    flood_seconds       the FloodWait it asks for
+    migrate_rate        share of phones whose home DC isn't the default DC 2
+    password_rate       share of phones with 2FA enabled (password: "hunter2")
+    password_cpu        PBKDF2 iterations per 2FA check, standing in for SRP
+    code_types          delivery methods to cycle through (keys of CODE_TYPES)
+    transport_delay     extra connect seconds per "ConnectionTcpFull/ipv4"-style
+                        label; None makes that transport unreachable
+    app_delay           seconds before an app-delivered code reaches the
+                        phone's other signed-in sessions as a login message
+    """
+    def __init__(self, latency=0.05, jitter=0.01, handshake=0.15, handshake_cpu=0,
+                 flood_rate=0.0, flood_seconds=1, migrate_rate=0.0,
+                 password_rate=0.0, password_cpu=0, code_types=None, transport_delay=None,
+                 app_delay=0.5, seed=None):
+        self.latency       = latency
+        self.jitter        = jitter
+        self.handshake     = handshake
+        self.handshake_cpu = handshake_cpu
+        self.flood_rate    = flood_rate
+        self.flood_seconds = flood_seconds
+        self.migrate_rate  = migrate_rate
+        self.password_rate = password_rate
+        self.password_cpu  = password_cpu
+        self.code_types    = list(code_types or CODE_TYPES)
+        self.transport_delay = dict(transport_delay or {})
+        self.app_delay     = app_delay
+        self.password      = "hunter2"
+        self.rng           = random.Random(seed)
+        self.codes         = {}         # phone_code_hash → (phone, code)
+        self.signed_in     = {}         # auth key bytes → phone, for get_me()
+        self.listeners     = {}         # phone → FakeClients with a login-message handler
+        self.requests      = 0
+        self.config_requests = 0
+        self._next_type    = 0
+        self.srp_algo      = types.PasswordKdfAlgoSHA256SHA256PBKDF2HMACSHA512iter100000SHA256ModPow(
+            salt1=self.rng.randbytes(40), salt2=self.rng.randbytes(16), g=3, p=SRP_PRIME)
+        self.srp_pending   = {}         # srp_id → (b, B) for issued 2FA challenges
+        self._verifier     = None
+
+    def _chance(self, phone, salt):
+        """Stable per-phone coin flip in [0, 1), so retries see the same account."""
+        h = hashlib.sha256(f"{salt}:{phone}".encode()).digest()
+        return int.from_bytes(h[:4], "big") / 2**32
+
+    def home_dc(self, phone):
+        if self._chance(phone, "dc") < self.migrate_rate:
+            return (1, 3, 4, 5)[int(self._chance(phone, "which-dc") * 4)]
+        return 2
+
+    def has_password(self, phone):
+        return self._chance(phone, "2fa") < self.password_rate
+
+    async def rtt(self):
+        self.requests += 1
+        await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+
+    def config(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return types.Config(
+            date=now, expires=now + datetime.timedelta(hours=1), test_mode=False, this_dc=2,
+            dc_options=[types.DcOption(id=dc, ip_address=ip, port=443) for dc, ip in DC_ADDRESSES.items()],
+            dc_txt_domain_name="", chat_size_max=200, megagroup_size_max=200000, forwarded_count_max=100,
+            online_update_period_ms=210000, offline_blur_timeout_ms=5000, offline_idle_timeout_ms=30000,
+            online_cloud_timeout_ms=300000, notify_cloud_delay_ms=30000, notify_default_delay_ms=1500,
+            push_chat_period_ms=60000, push_chat_limit=2, edit_time_limit=172800, revoke_time_limit=172800,
+            revoke_pm_time_limit=172800, rating_e_decay=2419200, stickers_recent_limit=200,
+            channels_read_media_period=604800, call_receive_timeout_ms=20000, call_ring_timeout_ms=90000,
+            call_connect_timeout_ms=30000, call_packet_timeout_ms=10000, me_url_prefix="https://t.me/",
+            caption_length_max=1024, message_length_max=4096, webfile_dc_id=4)
+
+    def burn(self, iterations):
+        if iterations:
+            hashlib.pbkdf2_hmac("sha512", b"fake", b"salt", iterations)
+
+    def issue_code(self, phone):
+        phone_code_hash = secrets.token_hex(8)
+        code = f"{self.rng.randrange(100000):05d}"
+        self.codes[phone_code_hash] = (phone, code)
+        kind = self.code_types[self._next_type % len(self.code_types)]
+        self._next_type += 1
+        if kind == "app":
+            for client in self.listeners.get(phone, ()):
+                client.loop.call_later(self.app_delay, client._login_message, code)
+        return auth.SentCode(
+            type=CODE_TYPES[kind](),
+            phone_code_hash=phone_code_hash,
+            next_type=auth.CodeTypeSms(),
+            timeout=120,
+        )
+
+    def code_for(self, phone_code_hash):
+        return self.codes.get(phone_code_hash, (None, None))[1]
+
+    # ── Server side of the SRP 2FA exchange ───────────────
+    def _srp_terms(self):
+        algo = self.srp_algo
+        p_for_hash = srp.num_bytes_for_hash(algo.p)
+        g_for_hash = srp.big_num_for_hash(algo.g)
+        k = int.from_bytes(srp.sha256(p_for_hash, g_for_hash), "big")
+        return int.from_bytes(algo.p, "big"), p_for_hash, g_for_hash, k
+
+    def password_challenge(self):
+        """account.Password for GetPasswordRequest: B = k·v + g^b (mod p)."""
+        p, _, _, k = self._srp_terms()
+        if self._verifier is None:
+            x = int.from_bytes(srp.compute_hash(self.srp_algo, self.password), "big")
+            self._verifier = pow(self.srp_algo.g, x, p)
+        b = int.from_bytes(os.urandom(256), "big")
+        B = (k * self._verifier + pow(self.srp_algo.g, b, p)) % p
+        srp_id = secrets.randbits(63)
+        self.srp_pending[srp_id] = (b, B)
+        return account.Password(
+            new_algo=types.PasswordKdfAlgoUnknown(),
+            new_secure_algo=types.SecurePasswordKdfAlgoUnknown(),
+            secure_random=b"", has_password=True, current_algo=self.srp_algo,
+            srp_B=B.to_bytes(256, "big"), srp_id=srp_id,
+        )
+
+    def password_matches(self, answer):
+        """Check an InputCheckPasswordSRP's M1 the way the server would."""
+        b, B = self.srp_pending.pop(answer.srp_id, (None, None))
+        if b is None:
+            return False
+        p, p_for_hash, g_for_hash, _ = self._srp_terms()
+        a_for_hash = srp.num_bytes_for_hash(answer.A)
+        b_for_hash = srp.big_num_for_hash(B)
+        u = int.from_bytes(srp.sha256(a_for_hash, b_for_hash), "big")
+        S = pow(int.from_bytes(answer.A, "big") * pow(self._verifier, u, p), b, p)
+        K = srp.sha256(srp.big_num_for_hash(S))
+        m1 = srp.sha256(srp.xor(srp.sha256(p_for_hash), srp.sha256(g_for_hash)),
+                        srp.sha256(self.srp_algo.salt1), srp.sha256(self.srp_algo.salt2),
+                        a_for_hash, b_for_hash, K)
+        return m1 == answer.M1
+
+
+class FakeClient:
+    """Duck-typed TelegramClient talking to a FakeBackend instead of Telegram."""
+    backend = None              # set by install()
+    _config = None              # help.getConfig result, shared by the class as in telethon
+
+    def __init__(self, session, api_id, api_hash, **kwargs):
+        if not api_id or not api_hash:
+            raise ValueError("Your API ID or Hash cannot be empty or None.")
+        self.session   = session if session is not None else StringSession()
+        self.api_id    = api_id
+        self.api_hash  = api_hash
+        self.kwargs    = kwargs
+        self._connected = False
+        self._authorized_phone = None
+        self._pending_password = None
+        self._loop = None
+        self._handlers = []
+
+    @property
+    def loop(self):
+        return self._loop or asyncio.get_event_loop()
+
+    # ── Connection ────────────────────────────────────────
+    async def connect(self):
+        b = self.backend
+        connection = getattr(self.kwargs.get("connection"), "__name__", "ConnectionTcpFull")
+        label = f"{connection}/{'ipv6' if self.kwargs.get('use_ipv6') else 'ipv4'}"
+        extra = b.transport_delay.get(label, 0)
+        if extra is None:
+            raise ConnectionError(f"{label} is unreachable")
+        await asyncio.sleep(extra)
+        if not self.session.server_address:
+            self.session.set_dc(2, DC_ADDRESSES[2], 443)
+        if self.session.auth_key is None:
+            b.burn(b.handshake_cpu)
+            await asyncio.sleep(b.handshake)
+            self.session.auth_key = AuthKey(os.urandom(256))
+        await b.rtt()
+        self._connected = True
+        self._loop = asyncio.get_running_loop()
+
+    def is_connected(self):
+        return self._connected
+
+    async def disconnect(self):
+        self._connected = False
+        for clients in self.backend.listeners.values():
+            if self in clients:
+                clients.remove(self)
+
+    async def _switch_dc(self, new_dc):
+        cls = type(self)
+        if not cls._config:
+            cls._config = await self(functions.help.GetConfigRequest())
+        option = next((dc for dc in cls._config.dc_options if dc.id == new_dc), None)
+        self.session.set_dc(new_dc, option.ip_address if option else DC_ADDRESSES[2], 443)
+        self.session.auth_key = None
+        await self.connect()
+
+    # ── Auth ──────────────────────────────────────────────
+    def _check_dc(self, phone):
+        home = self.backend.home_dc(phone)
+        if self.session.dc_id != home:
+            raise errors.PhoneMigrateError(None, home)
+
+    # Like telethon, the high-level calls build a request and go through
+    # _call(), so anything wrapping _call() sees every RPC.
+    async def send_code_request(self, phone, *, force_sms=False):
+        return await self._call(None, functions.auth.SendCodeRequest(
+            phone, self.api_id, self.api_hash, types.CodeSettings()))
+
+    async def resend_code_request(self, phone, phone_code_hash):
+        return await self._call(None, functions.auth.ResendCodeRequest(phone, phone_code_hash))
+
+    async def sign_in(self, phone=None, code=None, *, password=None, phone_code_hash=None, **kwargs):
+        # As in telethon 1.45: a phone with no code and no password asks for a
+        # new code and returns the SentCode — it does not raise.
+        if phone and not code and not password:
+            return await self.send_code_request(phone)
+        if code:
+            result = await self._call(None, functions.auth.SignInRequest(phone, phone_code_hash, str(code)))
+            return result.user
+        if not password:
+            raise ValueError("You must provide a phone and a code the first time, "
+                             "and a password only if an RPCError was raised before.")
+        b = self.backend
+        await b.rtt()
+        if self._pending_password is None:
+            raise errors.PasswordHashInvalidError(None)
+        b.burn(b.password_cpu)
+        if password != b.password:
+            raise errors.PasswordHashInvalidError(None)
+        self._authorized_phone, self._pending_password = self._pending_password, None
+        b.signed_in[self.session.auth_key.key] = self._authorized_phone
+        return types.User(id=abs(hash(self._authorized_phone)) % 10**10)
+
+    def _sign_in_code(self, phone, code, phone_code_hash):
+        b = self.backend
+        if not code:
+            raise errors.PhoneCodeEmptyError(None)
+        expected_phone, expected = b.codes.get(phone_code_hash, (None, None))
+        if expected is None:
+            raise errors.PhoneCodeExpiredError(None)
+        if str(code) != expected or expected_phone != phone:
+            raise errors.PhoneCodeInvalidError(None)
+        del b.codes[phone_code_hash]
+        if b.has_password(phone):
+            self._pending_password = phone
+            raise errors.SessionPasswordNeededError(None)
+        self._authorized_phone = phone
+        b.signed_in[self.session.auth_key.key] = phone
+        return auth.Authorization(user=types.User(id=abs(hash(phone)) % 10**10))
+
+    async def _on_login(self, user):
+        return user
+
+    # ── Updates, for a session listening for its login code ──
+    def add_event_handler(self, callback, event=None):
+        self._handlers.append(callback)
+
+    async def get_me(self):
+        b = self.backend
+        await b.rtt()
+        phone = b.signed_in.get(self.session.auth_key.key) if self.session.auth_key else None
+        if phone is None:
+            return None
+        if self._handlers:
+            b.listeners.setdefault(phone, []).append(self)
+        return types.User(id=abs(hash(phone)) % 10**10, phone=phone.lstrip("+"))
+
+    def _login_message(self, code):
+        message = types.Message(id=1, peer_id=types.PeerUser(777000), message=(
+            f"Login code: {code}. Do not give this code to anyone, even if they say they are from Telegram!"),
+            date=datetime.datetime.now(datetime.timezone.utc))
+        event = SimpleNamespace(message=message, raw_text=message.message)
+        for handler in self._handlers:
+            asyncio.ensure_future(handler(event))
+
+    async def __call__(self, request, ordered=False):
+        return await self._call(None, request, ordered)
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        from telethon.tl.functions.account import GetPasswordRequest
+        from telethon.tl.functions.auth import CheckPasswordRequest, SendCodeRequest
+        from telethon.tl.functions.users import GetUsersRequest
+        b = self.backend
+        if isinstance(request, functions.help.GetConfigRequest):
+            await b.rtt()
+            b.config_requests += 1
+            return b.config()
+        if isinstance(request, SendCodeRequest):
+            await b.rtt()
+            self._check_dc(request.phone_number)
+            if request.settings.allow_flashcall is False:      # a forced-SMS request
+                sent = b.issue_code(request.phone_number)
+                sent.type = CODE_TYPES["sms"]()
+                return sent
+            if b.rng.random() < b.flood_rate:
+                raise errors.FloodWaitError(None, b.flood_seconds)
+            return b.issue_code(request.phone_number)
+        if isinstance(request, functions.auth.ResendCodeRequest):
+            await b.rtt()
+            if request.phone_code_hash not in b.codes:
+                raise errors.PhoneCodeHashEmptyError(None)
+            sent = b.issue_code(request.phone_number)
+            b.codes[request.phone_code_hash] = b.codes.pop(sent.phone_code_hash)
+            sent.phone_code_hash = request.phone_code_hash
+            return sent
+        if isinstance(request, functions.auth.SignInRequest):
+            await b.rtt()
+            return self._sign_in_code(request.phone_number, request.phone_code, request.phone_code_hash)
+        if isinstance(request, GetPasswordRequest):
+            await b.rtt()
+            return b.password_challenge()
+        if isinstance(request, CheckPasswordRequest):
+            await b.rtt()
+            if self._pending_password is None or not b.password_matches(request.password):
+                raise errors.PasswordHashInvalidError(None)
+            self._authorized_phone, self._pending_password = self._pending_password, None
+            b.signed_in[self.session.auth_key.key] = self._authorized_phone
+            return auth.Authorization(user=types.User(id=abs(hash(self._authorized_phone)) % 10**10))
+        if isinstance(request, GetUsersRequest):
+            await b.rtt()
+            if self.session.auth_key is None:
+                raise errors.AuthKeyUnregisteredError(None)
+            return [types.User(id=int.from_bytes(self.session.auth_key.key[:4], "big"))]
+        await b.rtt()
+        return None
+
+
+class FakeCodeSource:
+    """Batch-mode CodeSource that 'receives' the right code after `delay` seconds."""
+    def __init__(self, backend, delay=0.0):
+        self.backend = backend
+        self.delay   = delay
+        self.arrived = {}
+
+    async def expect(self, phone, api_id, api_hash):
+        pass
+
+    async def code(self, phone, sent):
+        await asyncio.sleep(self.delay)
+        self.arrived[phone] = time.time()
+        return self.backend.code_for(sent.phone_code_hash)
+
+    async def password(self, phone):
+        return self.backend.password
+
+    def delivered(self, phone):
+        return self.arrived.pop(phone, None)
+
+    async def close(self):
+        pass
+
+
+def offline():
+    """Refuse connections to anything but loopback in this process.
+
+    A code path that slips past install() — a worker process started
+    without it, say — then fails loudly instead of quietly dialling a real
+    DC. Unix sockets and localhost (the HTTP code source, the broker) work.
+    """
+    import ipaddress, socket
+    if getattr(socket.socket.connect, "offline", False):
+        return
+    connect = socket.socket.connect
+
+    def guarded(sock, address):
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                local = ipaddress.ip_address(address[0]).is_loopback
+            except ValueError:
+                local = address[0] == "localhost"
+            if not local:
+                raise ConnectionRefusedError(f"fake_telegram.offline() refuses to connect to {address[0]}")
+        return connect(sock, address)
+
+    guarded.offline = True
+    socket.socket.connect = guarded
+
+
+def install(backend):
+    """Point telethon.TelegramClient (async and sync imports) at the fake backend, and go offline().
+
+    Also usable as a process pool's initializer, so that worker processes
+    — which don't inherit the patch under the spawn and forkserver start
+    methods — talk to a copy of the backend too.
+    """
+    import telethon
+    offline()
+    FakeClient.backend = backend
+    telethon.TelegramClient = FakeClient
+    try:
+        import telethon.sync
+        telethon.sync.TelegramClient = FakeClient
+    except ImportError:
+        pass
+    return FakeClient
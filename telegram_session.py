@@ -7,6 +7,16 @@ Only one dependency:   pip install telethon
 """
 
 import os, sys
+import base64, csv, hashlib, heapq, hmac, itertools, json, re, struct, threading, time
+import importlib.util
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+
+# asyncio is imported inside the functions that use it: it is the costliest of
+# the standard modules here, and the interactive walkthrough doesn't need it
+# until after the first prompt.
 
 # ── ANSI colours ──────────────────────────────────────────
 R  = "\033[0m"
@@ -18,26 +28,87 @@ W  = "\033[37;1m"
 B  = "\033[34;1m"
 DIM= "\033[2m"
 
+# ── Machine mode ──────────────────────────────────────────
+# Exit status per class of error, so a pipeline can branch without parsing text.
+EXIT_CODES = {
+    "internal":     1,      # unexpected — the message has the detail
+    "usage":        2,      # bad arguments or input, nothing to resume
+    "network":      3,      # couldn't reach Telegram or the right DC
+    "rejected":     4,      # Telegram refused the number or the API credentials
+    "rate_limited": 5,      # FloodWait and friends — retry_after says how long
+    "code":         6,      # the code was wrong, expired or never arrived
+    "password":     7,      # the 2FA password was wrong
+    "session":      8,      # the auth key or session is broken — start over
+    "dependency":   9,      # telethon is missing
+    "failed":       10,     # batch, check and the like finished, but not everything succeeded
+    "state":        11,     # local state can't be opened — wrong TG_SESSION_PASSPHRASE or a modified file
+    "cancelled":    130,    # Ctrl+C
+}
+ANSI = re.compile(r"\033\[[0-9;]*m")
+
+JSONL   = False             # set by machine_mode()
+_events = None              # the real stdout, once machine_mode() has taken it
+
+def machine_mode():
+    """Switch to JSON Lines: one event per line on stdout, no colour, no prompts.
+
+    Anything still printed the human way goes to stderr, so stdout only ever
+    carries events.
+    """
+    global JSONL, _events, R, G, Y, C, RE, W, B, DIM
+    JSONL, _events = True, sys.stdout
+    R = G = Y = C = RE = W = B = DIM = ""
+    sys.stdout = sys.stderr
+
+def emit(event, **fields):
+    """Write one JSON event and flush it, so a consumer sees it straight away."""
+    _events.write(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, default=str) + "\n")
+    _events.flush()
+
+def plain(text):
+    return ANSI.sub("", text).strip()
+
 # ── Helpers ───────────────────────────────────────────────
 def clear():
-    os.system("cls" if os.name == "nt" else "clear")
+    if sys.stdout.isatty():
+        print("\033[2J\033[H", end="", flush=True)
 
 def step(n, title):
+    if JSONL:
+        return emit("step", step=n, title=title)
     print(f"\n{C}━━━ Step {n}: {title}{R}")
 
-def ok(msg):   print(f"  {G}✓{R}  {msg}")
-def info(msg): print(f"  {B}ℹ{R}  {DIM}{msg}{R}")
-def warn(msg): print(f"  {Y}!{R}  {Y}{msg}{R}")
+def ok(msg):   emit("ok", message=plain(msg))   if JSONL else print(f"  {G}✓{R}  {msg}")
+def info(msg): emit("info", message=plain(msg)) if JSONL else print(f"  {B}ℹ{R}  {DIM}{msg}{R}")
+def warn(msg): emit("warn", message=plain(msg)) if JSONL else print(f"  {Y}!{R}  {Y}{msg}{R}")
+
+def ask(prompt, want):
+    """input() for the walkthrough; in machine mode, announce what's wanted and read a bare stdin line."""
+    if not JSONL:
+        return input(prompt)
+    emit("input", want=want)
+    line = sys.stdin.readline()
+    if not line:
+        fatal(f"stdin closed while waiting for the {want}", error=want)
+    return line.rstrip("\n")
 
-def fatal(msg, fix=None):
+def fatal(msg, fix=None, error="internal", **detail):
+    """Explain what went wrong and how to fix it, then exit with the status for `error`."""
+    if _metrics is not None:        # failed runs count towards the latency stats too
+        _metrics.save()
+    if JSONL:
+        emit("error", error=error, message=plain(msg), fix=plain(fix) if fix else None,
+             exit=EXIT_CODES[error], **detail)
+        sys.exit(EXIT_CODES[error])
     print(f"\n  {RE}✗  ERROR:{R}  {msg}")
     if fix:
         print(f"\n  {Y}→  WHAT TO DO:{R}\n")
         for line in fix.strip().split("\n"):
             print(f"     {line}")
     print()
-    input(f"\n  {DIM}Press Enter to exit…{R}")
-    sys.exit(1)
+    if sys.stdin.isatty():
+        input(f"\n  {DIM}Press Enter to exit…{R}")
+    sys.exit(EXIT_CODES[error])
 
 def banner():
     clear()
@@ -53,16 +124,236 @@ def banner():
 """)
 
 
+# ── Local state (caches, kept between runs) ──────────────
+STATE_DIR = os.environ.get("TG_SESSION_HOME") or os.path.join(os.path.expanduser("~"), ".telegram-session")
+
+def state_path(name):
+    """Path of a file in the state directory, created owner-only on first use."""
+    os.makedirs(STATE_DIR, mode=0o700, exist_ok=True)
+    return os.path.join(STATE_DIR, name)
+
+def load_json(path, default):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+def write_private(path, data):
+    """Write bytes owner-only and atomically, so a crash never leaves half a file."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd  = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def save_json(path, data):
+    write_private(path, json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+
+# ── Encryption at rest ────────────────────────────────────
+# Anything holding an auth key is sealed with AES-256-IGE (telethon ships it)
+# plus an HMAC-SHA256 tag. The key comes from TG_SESSION_PASSPHRASE via scrypt
+# if that is set, otherwise from a random key file next to the state.
+SEAL_MAGIC = b"TGS1"
+
+def _local_key():
+    path = state_path("secret.key")
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    key = os.urandom(32)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:           # another process just made it
+        return _local_key()
+    with open(fd, "wb") as f:
+        f.write(key)
+    return key
+
+def _seal_keys(salt):
+    return _derive_seal_keys(salt, os.environ.get("TG_SESSION_PASSPHRASE"))
+
+@lru_cache(maxsize=64)
+def _derive_seal_keys(salt, passphrase):
+    # Cached, so files sharing a salt (the session store's rows) pay for scrypt once.
+    if passphrase:
+        master = hashlib.scrypt(passphrase.encode("utf-8"), salt=salt, n=2**14, r=8, p=1, dklen=32)
+    else:
+        master = hmac.new(_local_key(), salt, hashlib.sha256).digest()
+    return (hmac.new(master, b"enc", hashlib.sha256).digest(),
+            hmac.new(master, b"mac", hashlib.sha256).digest())
+
+def seal(data, salt=None):
+    """Encrypt and authenticate bytes for storage on disk; a fresh salt unless one is given."""
+    from telethon.crypto import AES
+    salt, iv = salt or os.urandom(16), os.urandom(32)
+    enc, mac = _seal_keys(salt)
+    blob = SEAL_MAGIC + salt + iv + AES.encrypt_ige(struct.pack(">I", len(data)) + data, enc, iv)
+    return blob + hmac.new(mac, blob, hashlib.sha256).digest()
+
+class SealError(ValueError):
+    """A sealed blob can't be opened: not sealed, the wrong key, or modified since."""
+
+
+def unseal(blob):
+    """Reverse seal(); raises SealError on a wrong key or a modified file."""
+    from telethon.crypto import AES
+    if blob[:4] != SEAL_MAGIC or len(blob) < 4 + 16 + 32 + 16 + 32:
+        raise SealError("not a sealed file")
+    salt, iv, body, tag = blob[4:20], blob[20:52], blob[52:-32], blob[-32:]
+    enc, mac = _seal_keys(salt)
+    if not hmac.compare_digest(tag, hmac.new(mac, blob[:-32], hashlib.sha256).digest()):
+        raise SealError("wrong key, or the file was modified")
+    plain = AES.decrypt_ige(body, enc, iv)
+    return plain[4:4 + struct.unpack(">I", plain[:4])[0]]
+
+
+# ── Latency metrics ───────────────────────────────────────
+# Histogram bucket bounds in seconds. code_wait is human- or gateway-bound,
+# hence the long tail.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+RECENT_SAMPLES  = 1000      # per phase, for exact p50 / p99 in the JSON report
+
+class Metrics:
+    """Per-phase latency histograms, accumulated across runs.
+
+    Phases are timed with time.monotonic(): connect, send_code, migrate,
+    code_wait (request sent → code in hand), sign_in and password, plus
+    password_cpu (CPU seconds spent on the 2FA maths). code_wait_<method>
+    splits code_wait by delivery method (app, sms, call, …), and
+    code_submit_<method> is the time from a code reaching a CodeSource to
+    sign_in being sent, where the source knows when it arrived. Totals live
+    in metrics.json in the state directory, and every save() also refreshes
+    metrics.prom there for a node-exporter textfile collector.
+    """
+    def __init__(self, path=None):
+        self.path = path or state_path("metrics.json")
+        data = load_json(self.path, {})
+        same_buckets = data.get("buckets") == list(LATENCY_BUCKETS)
+        self.phases = data.get("phases", {}) if same_buckets else {}
+        self.run    = {}        # this run's seconds per phase, for the readout
+        self.cpu    = {}        # this run's process CPU seconds per phase, for --profile
+        self.notes  = {}        # this run's non-timing facts, e.g. the transport used
+        self._open  = {}
+
+    def observe(self, phase, seconds, failed=False, cpu=None):
+        p = self.phases.setdefault(phase, {
+            "count": 0, "sum": 0.0, "errors": 0,
+            "buckets": [0] * len(LATENCY_BUCKETS), "recent": [],
+        })
+        p["count"] += 1
+        p["sum"]   += seconds
+        p["errors"] += failed
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                p["buckets"][i] += 1
+                break
+        p["recent"].append(round(seconds, 4))
+        del p["recent"][:-RECENT_SAMPLES]
+        self.run[phase] = self.run.get(phase, 0.0) + seconds
+        if cpu is not None:
+            self.cpu[phase] = self.cpu.get(phase, 0.0) + cpu
+
+    @contextmanager
+    def time(self, phase):
+        # CPU is process-wide, so phases overlapping across batch jobs share it.
+        start, cpu, failed = time.monotonic(), time.process_time(), True
+        try:
+            yield
+            failed = False
+        finally:
+            self.observe(phase, time.monotonic() - start, failed, time.process_time() - cpu)
+
+    def start(self, phase):
+        """Open a phase whose end is observed somewhere else, e.g. code_wait."""
+        self._open[phase] = (time.monotonic(), time.process_time())
+
+    def stop(self, phase):
+        """Observe an open phase; return its seconds, or None if it was never started."""
+        opened = self._open.pop(phase, None)
+        if opened is not None:
+            seconds = time.monotonic() - opened[0]
+            self.observe(phase, seconds, cpu=time.process_time() - opened[1])
+            return seconds
+
+    def note(self, key, value):
+        self.notes[key] = value
+
+    def readout(self):
+        return "  ·  ".join([f"{k} {v:.2f}s" for k, v in self.run.items()] +
+                            [f"{k} {v}" for k, v in self.notes.items()])
+
+    def report(self):
+        phases = {}
+        for name, p in sorted(self.phases.items()):
+            recent = sorted(p["recent"])
+            def q(f):
+                return recent[min(len(recent) - 1, int(f * len(recent)))] if recent else None
+            phases[name] = {
+                "count": p["count"], "errors": p["errors"],
+                "mean":  round(p["sum"] / p["count"], 4) if p["count"] else None,
+                "p50":   q(0.50), "p90": q(0.90), "p99": q(0.99),
+                "max":   recent[-1] if recent else None,
+            }
+        return {"generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "phases": phases}
+
+    def prometheus(self):
+        name  = "telegram_session_phase_seconds"
+        lines = [f"# HELP {name} Time spent in each phase of session provisioning.",
+                 f"# TYPE {name} histogram"]
+        for phase, p in sorted(self.phases.items()):
+            total = 0
+            for bound, n in zip(LATENCY_BUCKETS, p["buckets"]):
+                total += n
+                lines.append(f'{name}_bucket{{phase="{phase}",le="{bound}"}} {total}')
+            lines.append(f'{name}_bucket{{phase="{phase}",le="+Inf"}} {p["count"]}')
+            lines.append(f'{name}_sum{{phase="{phase}"}} {p["sum"]:.6f}')
+            lines.append(f'{name}_count{{phase="{phase}"}} {p["count"]}')
+        lines += ["# HELP telegram_session_phase_errors_total Phases that ended in an error.",
+                  "# TYPE telegram_session_phase_errors_total counter"]
+        lines += [f'telegram_session_phase_errors_total{{phase="{phase}"}} {p["errors"]}'
+                  for phase, p in sorted(self.phases.items())]
+        return "\n".join(lines) + "\n"
+
+    def save(self):
+        save_json(self.path, {"buckets": list(LATENCY_BUCKETS), "phases": self.phases})
+        write_private(state_path("metrics.prom"), self.prometheus().encode("utf-8"))
+
+
+_metrics = None
+
+def metrics():
+    """The process-wide Metrics, loaded on first use."""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
+
+
 # ── Step 0: check the one dependency ─────────────────────
+def telethon_version():
+    """telethon's version without importing it (importing telethon takes ~0.3s); None if missing."""
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        return version("telethon")
+    except PackageNotFoundError:
+        # Importable but not installed as a distribution, e.g. a checkout on sys.path
+        return "unknown version" if importlib.util.find_spec("telethon") else None
+
+
 def check_telethon():
     step(0, "Checking dependencies")
-    try:
-        import telethon
-        ok(f"telethon {telethon.__version__} found")
-    except ImportError:
+    version = telethon_version()
+    if version:
+        ok(f"telethon {version} found")
+    else:
         fatal(
             "telethon is not installed.",
-            "Open a terminal / command prompt and run:\n\n          pip install telethon\n\n     Then run this script again."
+            "Open a terminal / command prompt and run:\n\n          pip install telethon\n\n     Then run this script again.",
+            error="dependency"
         )
 
 
@@ -85,16 +376,22 @@ def get_api_credentials():
 
     api_id_str = input(f"  {Y}App api_id   (numbers only): {R}").strip()
     api_hash   = input(f"  {Y}App api_hash (32 characters): {R}").strip()
+    return check_credentials(api_id_str, api_hash)
+
 
+def check_credentials(api_id_str, api_hash):
+    """Validate an api_id / api_hash pair the way Telegram will; return (int api_id, api_hash)."""
     if not api_id_str.isdigit():
         fatal(
             f"API ID should be all numbers — you entered: '{api_id_str}'",
-            "Go back to https://my.telegram.org/apps\nThe api_id is the short number, e.g.  1234567"
+            "Go back to https://my.telegram.org/apps\nThe api_id is the short number, e.g.  1234567",
+            error="usage"
         )
     if len(api_hash) != 32:
         fatal(
             f"API Hash should be exactly 32 characters — yours is {len(api_hash)}.",
-            "Go back to https://my.telegram.org/apps\nCopy the full api_hash — it looks like:  a1b2c3d4e5f6a1b2c3d4e5f6a1b2c3d4"
+            "Go back to https://my.telegram.org/apps\nCopy the full api_hash — it looks like:  a1b2c3d4e5f6a1b2c3d4e5f6a1b2c3d4",
+            error="usage"
         )
 
     ok(f"API ID:    {api_id_str}")
@@ -109,20 +406,955 @@ def get_phone():
     info("UK example:  +447712345678    US example:  +12025550123")
 
     phone = input(f"\n  {Y}Phone number: {R}").strip()
+    return check_phone(phone)
 
+
+def check_phone(phone):
     if not phone.startswith("+"):
         fatal(
             f"Phone number must start with + and your country code — you entered: '{phone}'",
-            "Examples:\n  +447712345678  (UK — starts with +44)\n  +12025550123   (US — starts with +1)\n  +353871234567  (Ireland — starts with +353)"
+            "Examples:\n  +447712345678  (UK — starts with +44)\n  +12025550123   (US — starts with +1)\n  +353871234567  (Ireland — starts with +353)",
+            error="usage"
         )
     return phone
 
 
+# ── Data-centre routing ──────────────────────────────────
+# Production DC addresses, so a client can be pointed at the right DC
+# before it connects instead of being redirected after its first request.
+DC_ADDRESSES = {
+    1: ("149.154.175.53",  443),
+    2: ("149.154.167.51",  443),
+    3: ("149.154.175.100", 443),
+    4: ("149.154.167.91",  443),
+    5: ("91.108.56.130",   443),
+}
+DC_ADDRESSES_V6 = {
+    1: ("2001:b28:f23d:f001::a", 443),
+    2: ("2001:67c:4e8:f002::a",  443),
+    3: ("2001:b28:f23d:f003::a", 443),
+    4: ("2001:67c:4e8:f004::a",  443),
+    5: ("2001:b28:f23f:f005::a", 443),
+}
+
+def dc_address(dc, family="ipv4"):
+    """Where to reach `dc`: from the cached server config if there is one, else the built-in table."""
+    return config_cache().address(dc, family) or (DC_ADDRESSES_V6 if family == "ipv6" else DC_ADDRESSES)[dc]
+
+# Two-digit country calling codes; everything else starting with 1 or 7 is
+# one digit and the rest are three (E.164 codes are prefix-free).
+_CC2 = set("20 27 30 31 32 33 34 36 39 40 41 43 44 45 46 47 48 49 51 52 53 54 55 56 "
+           "57 58 60 61 62 63 64 65 66 81 82 84 86 90 91 92 93 94 95 98".split())
+
+def phone_prefix(phone):
+    """Country calling code of an international number, e.g. '+44'."""
+    digits = phone.lstrip("+")
+    if digits[:1] in ("1", "7"):
+        return "+" + digits[:1]
+    return "+" + (digits[:2] if digits[:2] in _CC2 else digits[:3])
+
+
+def switch_dc(client, dc):
+    """Move a connected client to another DC, where a fresh auth key is negotiated."""
+    import asyncio
+    result = client._switch_dc(dc)
+    if asyncio.iscoroutine(result):
+        client.loop.run_until_complete(result)
+
+
+class DcCache:
+    """Country prefix → home DC, learned from where code requests end up.
+
+    Kept as JSON in the state directory. Entries older than `ttl` seconds are
+    evicted, so a prefix is relearned if Telegram moves it. Hit and miss
+    counts are cumulative across runs.
+    """
+    def __init__(self, path=None, ttl=30 * 86400):
+        self.path = path or state_path("dc_cache.json")
+        self.ttl  = ttl
+        data = load_json(self.path, {})
+        now  = time.time()
+        self.entries = {k: v for k, v in data.get("entries", {}).items()
+                        if now - v.get("at", 0) < ttl}
+        self.hits   = data.get("hits", 0)
+        self.misses = data.get("misses", 0)
+
+    def lookup(self, phone):
+        prefix = phone_prefix(phone)
+        entry  = self.entries.get(prefix)
+        if entry and time.time() - entry["at"] >= self.ttl:
+            del self.entries[prefix]
+            entry = None
+        if entry and entry["dc"] in DC_ADDRESSES:
+            self.hits += 1
+            return entry["dc"]
+        self.misses += 1
+        return None
+
+    def learn(self, phone, dc):
+        self.entries[phone_prefix(phone)] = {"dc": dc, "at": time.time()}
+
+    def save(self):
+        save_json(self.path, {"entries": self.entries, "hits": self.hits, "misses": self.misses})
+
+
+# help.getConfig is what telethon asks for the first time a client changes DC;
+# its dc_options table is the current address list for every DC.
+CONFIG_TTL     = 3600           # older than this, use it but fetch a fresh one alongside
+CONFIG_MAX_AGE = 7 * 86400      # older than this, don't use it at all
+
+class ConfigCache:
+    """The last help.getConfig result, kept between runs with a TTL.
+
+    Stored as the raw TL bytes with the layer they were serialised under, plus
+    a plain per-DC address table that dc_address() reads without importing
+    telethon. prime() hands the config to telethon, so a DC switch skips its
+    GetConfigRequest round trip and pre-routing uses the current addresses
+    rather than the built-in ones. Past `ttl` (or the config's own `expires`)
+    the cache is still used, but a fresh config is fetched in the background
+    over the already-connected client. A cache past `max_age`, from another
+    layer or that doesn't parse is ignored.
+    """
+    def __init__(self, path=None, ttl=CONFIG_TTL, max_age=CONFIG_MAX_AGE):
+        self.path = path or state_path("config.json")
+        data = load_json(self.path, {})
+        age  = time.time() - data.get("fetched_at", 0)
+        self.data    = data if 0 <= age < max_age and self._valid(data.get("addresses")) else {}
+        self.stale   = not self.data or age >= ttl or time.time() >= self.data.get("expires", 0)
+        self.outcome = None         # hit, stale or miss, once a client has been primed
+        self.task    = None
+        self.refreshed = False
+
+    @staticmethod
+    def _valid(addresses):
+        import ipaddress
+        try:
+            for family, table in addresses.items():
+                for dc, (ip, port) in table.items():
+                    if family not in ("ipv4", "ipv6") or int(dc) not in DC_ADDRESSES or not 0 < port < 65536:
+                        return False
+                    ipaddress.ip_address(ip)
+            return bool(addresses.get("ipv4"))
+        except (AttributeError, TypeError, ValueError):
+            return False
+
+    def age(self):
+        return time.time() - self.data["fetched_at"] if self.data else None
+
+    def address(self, dc, family="ipv4"):
+        entry = self.data.get("addresses", {}).get(family, {}).get(str(dc)) if self.data else None
+        return tuple(entry) if entry else None
+
+    def config(self):
+        """The cached Config as a telethon object, or None if there is none or it doesn't parse."""
+        from telethon.extensions import BinaryReader
+        from telethon.tl import types
+        from telethon.tl.alltlobjects import LAYER
+        if not self.data or self.data.get("layer") != LAYER:
+            return None
+        try:
+            config = BinaryReader(base64.b64decode(self.data["config"])).tgread_object()
+        except Exception:
+            return None
+        return config if isinstance(config, types.Config) and config.dc_options else None
+
+    def prime(self, client, refresh=True):
+        """Seed a client's config from the cache; if stale, refresh it in the background on this loop."""
+        import asyncio
+        cls = type(getattr(client, "_traced", client))     # the client under a TracedClient
+        if self.outcome is None:
+            config = self.config()
+            if config is not None and cls._config is None:
+                cls._config = config
+            self.stale   = self.stale or config is None
+            self.outcome = "miss" if config is None else "stale" if self.stale else "hit"
+            metrics().note("config_cache", self.outcome)
+        if refresh and self.stale and self.task is None:
+            self.task = asyncio.ensure_future(self.refresh(client))
+
+    async def refresh(self, client):
+        from telethon import functions
+        from telethon.tl import types
+        try:
+            with metrics().time("config_refresh"):
+                config = await client(functions.help.GetConfigRequest())
+        except Exception:
+            self.task = None        # e.g. the client disconnected first; the next one retries
+            return
+        if isinstance(config, types.Config) and config.dc_options:
+            type(client)._config = config
+            self.learn(config)
+
+    def learn(self, config):
+        from telethon.tl.alltlobjects import LAYER
+        if config.test_mode:
+            return
+        addresses = {"ipv4": {}, "ipv6": {}}
+        for option in config.dc_options:
+            if option.media_only or option.cdn or option.tcpo_only or option.id not in DC_ADDRESSES:
+                continue
+            addresses["ipv6" if option.ipv6 else "ipv4"].setdefault(str(option.id), [option.ip_address, option.port])
+        if not self._valid(addresses):
+            return
+        self.data  = {"layer": LAYER, "fetched_at": time.time(), "expires": config.expires.timestamp(),
+                      "addresses": addresses, "config": base64.b64encode(bytes(config)).decode("ascii")}
+        self.stale = False
+        self.refreshed = True
+        save_json(self.path, self.data)
+
+
+_config_cache = None
+
+def config_cache():
+    """The process-wide ConfigCache, loaded on first use."""
+    global _config_cache
+    if _config_cache is None:
+        _config_cache = ConfigCache()
+    return _config_cache
+
+
+# ── Transport racing ─────────────────────────────────────
+# telethon's MTProto transports, by the names used on the command line and in
+# transports.json.
+TRANSPORTS = {
+    "full":         "ConnectionTcpFull",
+    "abridged":     "ConnectionTcpAbridged",
+    "intermediate": "ConnectionTcpIntermediate",
+    "obfuscated":   "ConnectionTcpObfuscated",
+}
+RACE_STAGGER = 0.25         # seconds before the next candidate joins the race
+
+def transport_kwargs(transport, family):
+    """TelegramClient keyword arguments for a (transport, family) pair."""
+    from telethon.network import connection
+    return {"connection": getattr(connection, TRANSPORTS[transport]), "use_ipv6": family == "ipv6"}
+
+def race_candidates():
+    """Every (transport, family) pair, alternating families as happy eyeballs does."""
+    return [(t, f) for t in TRANSPORTS for f in ("ipv4", "ipv6")]
+
+def network_id():
+    """A short label for the network we're on: the local address outbound traffic uses, hashed."""
+    import socket
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.connect(DC_ADDRESSES[2])      # UDP connect() only picks a route; nothing is sent
+            local = probe.getsockname()[0]
+    except OSError:
+        local = "offline"
+    return hashlib.sha256(local.encode("utf-8")).hexdigest()[:12]
+
+
+class TransportCache:
+    """The (transport, family) that last won a race, per network, in transports.json.
+
+    Entries expire after `ttl` seconds so a network that changes behaviour
+    is re-learned; until then connect_transport() uses the winner alone.
+    """
+    def __init__(self, path=None, ttl=7 * 86400):
+        self.path    = path or state_path("transports.json")
+        self.ttl     = ttl
+        self.entries = load_json(self.path, {})
+        self.network = network_id()
+
+    def winner(self):
+        entry = self.entries.get(self.network)
+        if entry and time.time() - entry["at"] < self.ttl:
+            return entry["transport"], entry["family"]
+        return None
+
+    def learn(self, transport, family, seconds):
+        self.entries[self.network] = {"transport": transport, "family": family,
+                                      "seconds": round(seconds, 3), "at": time.time()}
+        save_json(self.path, self.entries)
+
+    def client_kwargs(self):
+        """Keyword arguments for clients that don't race: the remembered winner, or telethon's default."""
+        return transport_kwargs(*self.winner()) if self.winner() else {}
+
+    def family(self):
+        return self.winner()[1] if self.winner() else "ipv4"
+
+
+_transports = None
+
+def transports():
+    """The process-wide TransportCache, loaded on first use."""
+    global _transports
+    if _transports is None:
+        _transports = TransportCache()
+    return _transports
+
+
+async def race_transports(api_id, api_hash, dc=2, candidates=None, stagger=RACE_STAGGER, **client_kwargs):
+    """Connect over several (transport, family) pairs at once; keep the first to finish its handshake.
+
+    Candidates join `stagger` seconds apart, or straight away when the one
+    before fails. The first connect() to complete wins and the others are
+    cancelled and disconnected. Returns (client, transport, family, seconds).
+    """
+    import asyncio
+    from telethon import TelegramClient
+    from telethon.sessions import StringSession
+
+    started, clients, errors = time.monotonic(), {}, []
+    queue, running, winner = list(candidates or race_candidates()), set(), None
+
+    async def attempt(transport, family):
+        client = TelegramClient(StringSession(), api_id, api_hash,
+                                **transport_kwargs(transport, family), **client_kwargs)
+        client.session.set_dc(dc, *dc_address(dc, family))
+        clients[transport, family] = client
+        await client.connect()
+        return transport, family
+
+    try:
+        while winner is None and (queue or running):
+            if queue:
+                running.add(asyncio.ensure_future(attempt(*queue.pop(0))))
+            done, running = await asyncio.wait(running, timeout=stagger if queue else None,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = winner or task.result()
+                else:
+                    errors.append(task.exception())
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        for pair, client in clients.items():
+            if pair != winner:
+                await client.disconnect()
+    if winner is None:
+        raise errors[-1] if errors else ConnectionError("no transport to race")
+    return clients[winner], *winner, time.monotonic() - started
+
+
+async def connect_transport(api_id, api_hash, cache, dc=2, **client_kwargs):
+    """Connect with `cache`'s winner alone while it is fresh; race the rest on a miss or when it fails.
+
+    The winner gets a single attempt, so a network that has started blocking
+    it costs one connect timeout rather than telethon's retries. Only a race
+    updates the cache, so a winner that keeps working is still re-raced once
+    its entry expires. Returns (client, transport, family, seconds) as
+    race_transports() does.
+    """
+    import asyncio
+    winner = cache.winner()
+    if winner:
+        try:
+            return await race_transports(api_id, api_hash, dc, [winner],
+                                         **{**client_kwargs, "connection_retries": 0})
+        except (OSError, asyncio.TimeoutError):
+            pass
+    client, transport, family, seconds = await race_transports(
+        api_id, api_hash, dc, [pair for pair in race_candidates() if pair != winner], **client_kwargs)
+    cache.learn(transport, family, seconds)
+    return client, transport, family, seconds
+
+
+async def probe_transports(api_id, api_hash, dc=2, timeout=10):
+    """Connect over every candidate at once and time each; [(seconds or None, transport, family, error)]."""
+    import asyncio
+    from telethon import TelegramClient
+    from telethon.sessions import StringSession
+
+    async def probe(transport, family):
+        client = TelegramClient(StringSession(), api_id, api_hash, receive_updates=False,
+                                **transport_kwargs(transport, family))
+        client.session.set_dc(dc, *dc_address(dc, family))
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(client.connect(), timeout)
+            return time.monotonic() - started, transport, family, ""
+        except Exception as e:
+            return None, transport, family, type(e).__name__
+        finally:
+            await client.disconnect()
+
+    return await asyncio.gather(*(probe(*pair) for pair in race_candidates()))
+
+
+# ── Pre-negotiated auth keys ─────────────────────────────
+def generate_auth_key(dc, api_id, api_hash):
+    """Negotiate a fresh, not-yet-authorised auth key with `dc`. Runs in a pool worker."""
+    import asyncio
+    async def negotiate():
+        from telethon import TelegramClient
+        from telethon.sessions import StringSession
+        client = TelegramClient(StringSession(), api_id, api_hash, receive_updates=False)
+        client.session.set_dc(dc, *dc_address(dc))
+        try:
+            await client.connect()
+            return client.session.auth_key.key
+        finally:
+            await client.disconnect()
+    return asyncio.run(negotiate())
+
+
+class AuthKeyPool:
+    """A bounded reserve of pre-negotiated auth keys per api_id and DC, refilled by worker processes.
+
+    The Diffie-Hellman exchange behind a new auth key is CPU-heavy in pure
+    Python and costs extra round trips, so batch jobs take a ready key and
+    connect without one. Worker processes top each (api_id, DC) back up to
+    `reserve` keys as they are taken, each negotiated under the api_id that
+    will sign in with it. A job that finds the reserve empty waits for a
+    key a worker is already making, if no other job has claimed it. Keys
+    older than `ttl` seconds are dropped rather than handed out. Keys left
+    over at the end are sealed into the state directory so the next run
+    starts warm; each key is handed out only once. `initializer` and
+    `initargs` are passed to the worker pool.
+    """
+    def __init__(self, reserve=4, ttl=3600, workers=None, path=None, initializer=None, initargs=()):
+        from concurrent.futures import ProcessPoolExecutor
+        self.reserve  = reserve
+        self.ttl      = ttl
+        self.path     = path or state_path("auth_keys.bin")
+        self.hashes   = {}          # api_id → api_hash, for the workers
+        self.keys     = {}          # (api_id, dc) → deque of (created_at, key bytes)
+        self.pending  = {}          # (api_id, dc) → keys being negotiated right now
+        self.waiters  = {}          # (api_id, dc) → deque of futures, jobs waiting for the next key
+        self.hits = self.misses = self.generated = self.expired = self.failed = 0
+        self.workers  = workers or min(reserve, os.cpu_count() or 1)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=initializer, initargs=initargs)
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = json.loads(unseal(f.read()))
+        except (FileNotFoundError, ValueError):
+            return
+        os.remove(self.path)
+        now = time.time()
+        for api_id, dcs in data.items():
+            for dc, entries in dcs.items():
+                fresh = [(at, base64.b64decode(key)) for at, key in entries if now - at < self.ttl]
+                self.keys.setdefault((int(api_id), int(dc)), deque()).extend(fresh)
+
+    def save(self):
+        now  = time.time()
+        data = {}
+        for (api_id, dc), q in self.keys.items():
+            entries = [(at, base64.b64encode(key).decode()) for at, key in q if now - at < self.ttl]
+            if entries:
+                data.setdefault(api_id, {})[dc] = entries
+        if data:
+            write_private(self.path, seal(json.dumps(data).encode("utf-8")))
+
+    def warm(self, api_id, api_hash, dcs):
+        self.hashes[api_id] = api_hash
+        for dc in dcs:
+            self._refill((api_id, dc))
+
+    def _refill(self, slot):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        api_id, dc = slot
+        missing = self.reserve - len(self.keys.get(slot, ())) - self.pending.get(slot, 0)
+        for _ in range(missing):
+            self.pending[slot] = self.pending.get(slot, 0) + 1
+            future = loop.run_in_executor(self._pool, generate_auth_key, dc, api_id, self.hashes[api_id])
+            future.add_done_callback(lambda f, slot=slot: self._landed(slot, f))
+
+    def _landed(self, slot, future):
+        self.pending[slot] -= 1
+        # Drop jobs that were cancelled while they waited.
+        waiters = self.waiters[slot] = deque(w for w in self.waiters.get(slot, ()) if not w.done())
+        if future.cancelled() or future.exception() is not None:
+            self.failed += not future.cancelled()
+            # Nothing left in flight for the jobs still waiting: let them negotiate their own.
+            while len(waiters) > self.pending[slot]:
+                waiters.pop().set_result(None)
+            return
+        self.generated += 1
+        if waiters:
+            waiters.popleft().set_result(future.result())
+            self._refill(slot)
+        else:
+            self.keys.setdefault(slot, deque()).append((time.time(), future.result()))
+
+    async def take(self, api_id, api_hash, dc):
+        """A key for `dc` made under `api_id`: a ready one, else one a worker is finishing, else None.
+
+        On None the caller negotiates its own.
+        """
+        import asyncio
+        slot = api_id, dc
+        self.hashes[api_id] = api_hash
+        q, now = self.keys.get(slot), time.time()
+        while q and now - q[0][0] >= self.ttl:
+            q.popleft()
+            self.expired += 1
+        key = q.popleft()[1] if q else None
+        self._refill(slot)
+        # Wait only for a key a worker is making right now and no one else is
+        # waiting on; one still queued behind it would arrive later than a
+        # handshake of our own.
+        if key is None and len(self.waiters.get(slot, ())) < min(self.pending.get(slot, 0), self.workers):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.setdefault(slot, deque()).append(waiter)
+            key = await waiter
+        if key:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return key
+
+    def close(self):
+        self.save()
+        for waiter in (w for waiters in self.waiters.values() for w in waiters):
+            if not waiter.done():
+                waiter.set_result(None)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ── FloodWait scheduling ─────────────────────────────────
+# Longest FloodWait the interactive flow sits out on its own; anything longer
+# still tells the operator to come back later.
+INTERACTIVE_MAX_WAIT = 300
+
+class FloodScheduler:
+    """FloodWait penalties per phone and per api_id, and the jobs parked behind them.
+
+    A penalised job goes into a heap keyed by the moment its window ends, so
+    batch workers keep serving other accounts and pick it back up once the
+    window has passed. A FloodWait always penalises the phone; when a second
+    phone on the same api_id is hit while the first penalty is still running,
+    the api_id is penalised too. Penalties are persisted in the state
+    directory, so a restart honours them instead of burning the budget again.
+    """
+    def __init__(self, path=None):
+        self.path = path or state_path("flood_waits.json")
+        data = load_json(self.path, {})
+        now  = time.time()
+        self.until  = {k: v for k, v in data.get("until", {}).items() if v > now}
+        self.owner  = data.get("owner", {})     # phone → api_id it was penalised under
+        self.parked = []                        # heap of (ready_at, seq, job, parked_at)
+        self._seq   = 0
+        self.penalties       = 0
+        self.peak_parked     = 0
+        self.blocked_seconds = 0.0              # summed over every job that sat parked
+
+    def blocked_until(self, phone, api_id):
+        return max(self.until.get(f"phone:{phone}", 0), self.until.get(f"api_id:{api_id}", 0))
+
+    def penalise(self, phone, api_id, seconds):
+        """Record a FloodWait and return the epoch time it ends for this phone."""
+        now   = time.time()
+        until = now + seconds
+        key   = f"phone:{phone}"
+        self.until[key] = max(self.until.get(key, 0), until)
+        # The api_id only gets the shorter of the overlapping windows, so one
+        # number with a day-long ban doesn't stall every other account.
+        shared = [v for k, v in self.until.items()
+                  if k.startswith("phone:") and k != key and v > now and self.owner.get(k[6:]) == api_id]
+        if shared:
+            api = f"api_id:{api_id}"
+            self.until[api] = max(self.until.get(api, 0), min(until, max(shared)))
+        self.owner[phone] = api_id
+        self.penalties += 1
+        self.save()
+        return until
+
+    def park(self, job, until):
+        heapq.heappush(self.parked, (until, self._seq, job, time.time()))
+        self._seq += 1
+        self.peak_parked = max(self.peak_parked, len(self.parked))
+
+    def pop_ready(self):
+        """Return a parked job whose window has passed, or None.
+
+        The caller should still check blocked_until(): the phone or api_id
+        may have been penalised again while the job was parked.
+        """
+        now = time.time()
+        if not self.parked or self.parked[0][0] > now:
+            return None
+        _, _, job, parked_at = heapq.heappop(self.parked)
+        self.blocked_seconds += now - parked_at
+        return job
+
+    def next_ready(self):
+        return self.parked[0][0] if self.parked else None
+
+    def stats(self):
+        now = time.time()
+        return {
+            "parked":          len(self.parked),
+            "peak_parked":     self.peak_parked,
+            "penalties":       self.penalties,
+            "blocked_seconds": round(self.blocked_seconds, 1),
+            "active_windows":  sum(1 for v in self.until.values() if v > now),
+        }
+
+    def save(self):
+        now   = time.time()
+        until = {k: v for k, v in self.until.items() if v > now}
+        owner = {p: a for p, a in self.owner.items() if f"phone:{p}" in until}
+        save_json(self.path, {"until": until, "owner": owner})
+
+
+def wait_out(seconds, why):
+    """Count a FloodWait down on one line, then return so the caller can retry."""
+    if JSONL:
+        emit("waiting", seconds=round(seconds, 1), reason=why)
+        time.sleep(seconds)
+        return
+    end = time.monotonic() + seconds
+    while (left := end - time.monotonic()) > 0:
+        print(f"\r  {Y}…{R}  {why} — retrying in {int(left) + 1}s  ", end="", flush=True)
+        time.sleep(min(1, left))
+    print()
+
+
+# ── Adaptive code delivery ────────────────────────────────
+# The three ways to ask for a code, as in the resend menu: the default
+# request (app first), the default followed at once by a resend via
+# next_type, and a raw SendCodeRequest that rules out app delivery.
+DELIVERY_STRATEGIES = {"default": "default request", "resend": "resend via next_type",
+                       "sms": "forced SMS"}
+DELIVERY_HALF_LIFE  = 14 * 86400    # an observation counts half as much after this long
+DELIVERY_MIN_WEIGHT = 2.5           # about three recent observations before a strategy is trusted
+DELIVERY_MISS       = 300           # seconds charged for a code that never arrived or expired
+DELIVERY_EXPLORE    = 0.05          # share of batch accounts that try a strategy still short of data
+
+class DeliveryStats:
+    """Time-to-code per country prefix, strategy and delivery method, decayed over time.
+
+    Each cell is keyed "prefix strategy method" (e.g. "+44 sms sms") and holds
+    [weight, seconds, misses, updated at]. On every update the old sums are
+    scaled by 0.5 ** (age / half_life), so the estimates follow Telegram when
+    it changes how a country's codes are delivered. Cells that have decayed
+    to almost nothing are dropped on save. Every observation also goes into
+    the "*" prefix, which is used for countries without enough data yet.
+    """
+    def __init__(self, path=None, half_life=DELIVERY_HALF_LIFE):
+        self.path      = path or state_path("delivery.json")
+        self.half_life = half_life
+        self.cells     = load_json(self.path, {}).get("cells", {})
+
+    def _decayed(self, cell, now):
+        weight, seconds, misses, at = cell
+        f = 0.5 ** (max(0.0, now - at) / self.half_life)
+        return weight * f, seconds * f, misses * f
+
+    def record(self, phone, strategy, sent_type, seconds, delivered):
+        """One code request: how long until the code was in hand, and whether it signed in."""
+        now    = time.time()
+        method = code_method(sent_type)
+        cost   = seconds if delivered else max(seconds, DELIVERY_MISS)
+        for prefix in (phone_prefix(phone), "*"):
+            key = f"{prefix} {strategy} {method}"
+            weight, total, misses = self._decayed(self.cells.get(key, (0, 0, 0, now)), now)
+            self.cells[key] = [round(weight + 1, 4), round(total + cost, 3),
+                               round(misses + (not delivered), 4), int(now)]
+
+    def expected(self, prefix):
+        """{strategy: (expected seconds to code, decayed weight)} across delivery methods."""
+        now, sums = time.time(), {}
+        for key, cell in self.cells.items():
+            p, strategy, _ = key.split(" ")
+            if p != prefix:
+                continue
+            weight, total, _ = self._decayed(cell, now)
+            w, t = sums.get(strategy, (0.0, 0.0))
+            sums[strategy] = (w + weight, t + total)
+        return {s: (t / w, w) for s, (w, t) in sums.items() if w > 0}
+
+    def choose(self, phone, explore=0.0):
+        """(strategy, reason) with the lowest expected time-to-code; ("default", None) without data.
+
+        With probability `explore`, a strategy the prefix has too little data
+        on is picked instead, so the alternatives keep being measured.
+        """
+        if explore:
+            import random
+            seen = self.expected(phone_prefix(phone))
+            untried = [s for s in DELIVERY_STRATEGIES if seen.get(s, (0, 0))[1] < DELIVERY_MIN_WEIGHT]
+            if untried and random.random() < explore:
+                return random.choice(untried), None
+        for prefix in (phone_prefix(phone), "*"):
+            known = {s: v for s, v in self.expected(prefix).items()
+                     if v[1] >= DELIVERY_MIN_WEIGHT and s in DELIVERY_STRATEGIES}
+            if not known:
+                continue
+            best = min(known, key=lambda s: known[s][0])
+            where = f"{prefix} numbers" if prefix != "*" else "all numbers"
+            others = ", ".join(f"{DELIVERY_STRATEGIES[s]} ~{v[0]:.1f}s" for s, v in known.items() if s != best)
+            return best, (f"Code delivery: {DELIVERY_STRATEGIES[best]}, ~{known[best][0]:.1f}s to the code "
+                          f"for {where}" + (f" (vs {others})" if others else ""))
+        return "default", None
+
+    def save(self):
+        now = time.time()
+        self.cells = {k: c for k, c in self.cells.items() if self._decayed(c, now)[0] >= 0.05}
+        save_json(self.path, {"half_life": self.half_life, "cells": self.cells})
+
+
+_delivery = None
+
+def delivery_stats():
+    """The process-wide DeliveryStats, loaded on first use."""
+    global _delivery
+    if _delivery is None:
+        _delivery = DeliveryStats()
+    return _delivery
+
+
+def forced_sms_request(phone, api_id, api_hash):
+    """A raw SendCodeRequest that opts out of every delivery method but SMS.
+
+    CodeSettings lost its allow_app flag in later layers (passing it is a
+    TypeError on current telethon), so this clears every opt-in that remains.
+    """
+    from telethon.tl.functions.auth import SendCodeRequest
+    from telethon.tl.types import CodeSettings
+    return SendCodeRequest(phone_number=phone, api_id=int(api_id), api_hash=api_hash,
+                           settings=CodeSettings(allow_flashcall=False, current_number=False,
+                                                 allow_missed_call=False, allow_firebase=False))
+
+
+# ── Resumable sign-in ────────────────────────────────────
+# Wrong codes are retried on the same connection this many times before
+# giving up — Telegram allows a handful per phone_code_hash.
+MAX_CODE_TRIES     = 5
+MAX_PASSWORD_TRIES = 3
+
+class Checkpoint:
+    """Encrypted record of a sign-in that is waiting for its code.
+
+    Holds the not-yet-authorised auth key (as a session string) and the
+    phone_code_hash. It is written as soon as the code is requested and
+    removed when sign-in ends, so after Ctrl-C or a crash `resume` carries on
+    with the same key and hash: no new handshake and no new code request.
+    """
+    def __init__(self, phone):
+        self.phone = phone
+        self.path  = state_path(f"pending-{phone.lstrip('+')}.bin")
+
+    def save(self, api_id, api_hash, session, phone_code_hash, stage="code"):
+        write_private(self.path, seal(json.dumps({
+            "phone": self.phone, "api_id": api_id, "api_hash": api_hash,
+            "session": session, "phone_code_hash": phone_code_hash,
+            "stage": stage, "saved_at": time.time(),
+        }).encode("utf-8")))
+
+    def advance(self, stage):
+        """Record that sign-in got past the code, so resume goes straight to `stage`."""
+        try:
+            state = self.load()
+        except (FileNotFoundError, ValueError):
+            return
+        self.save(state["api_id"], state["api_hash"], state["session"],
+                  state["phone_code_hash"], stage)
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            return json.loads(unseal(f.read()))
+
+    def drop(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def pending():
+        """Phone numbers with a sign-in waiting to be resumed."""
+        return sorted("+" + name[len("pending-"):-len(".bin")]
+                      for name in os.listdir(state_path(""))
+                      if name.startswith("pending-") and name.endswith(".bin"))
+
+
+# ── Speculative connect while the phone prompt is open ───
+class BackgroundClient:
+    """An async TelegramClient connecting on its own loop thread, with blocking calls.
+
+    telethon.sync drives a client from the main thread's event loop, and that
+    loop sits idle while input() blocks. So the client lives on a private loop
+    thread where the telethon import and the TCP + auth-key handshake run during
+    the phone prompt;
+    every later call is marshalled onto that loop and waited for, so
+    generate_session() uses it exactly like a telethon.sync client.
+    """
+    def __init__(self, api_id, api_hash):
+        import asyncio
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        self.handshake  = None
+        self.transport  = None
+        self.cpu        = None      # CPU seconds the loop thread spent importing + connecting
+        self._started   = time.monotonic()
+        self._ready     = None
+        self._client    = None
+        self._connected = asyncio.run_coroutine_threadsafe(self._connect(api_id, api_hash), self._loop)
+
+    async def _connect(self, api_id, api_hash):
+        # connect_transport() imports telethon here too, so that overlaps the prompt as well.
+        cpu = time.thread_time()
+        self._client, transport, family, self.handshake = await connect_transport(
+            api_id, api_hash, transports())
+        self._ready = time.monotonic()
+        self.cpu    = time.thread_time() - cpu
+        self.transport = f"{transport}/{family}"
+        metrics().note("transport", self.transport)
+        config_cache().prime(self._client)
+
+    async def _invoke(self, name, args, kwargs):
+        import asyncio
+        result = getattr(self._client, name)(*args, **kwargs)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    def _run(self, coro):
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def connect(self):
+        """Wait for the background import + handshake; return seconds of it hidden behind the prompt."""
+        waiting = time.monotonic()
+        self._connected.result()
+        return (self._ready - self._started) - (time.monotonic() - waiting)
+
+    def disconnect(self):
+        self._run(self._invoke("disconnect", (), {}))
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def __call__(self, request):
+        return self._run(self._invoke("__call__", (request,), {}))
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        return lambda *args, **kwargs: self._run(self._invoke(name, args, kwargs))
+
+
+# ── 2FA password check off the calling thread ────────────
+def srp_answer(salt1, salt2, g, p, srp_B, password, pw_hash=None):
+    """The SRP answer to a 2FA challenge, as telethon.password.compute_check() builds it.
+
+    Plain bytes and ints in and out, so it can run in a worker process. Most
+    of the cost is the PBKDF2 behind the password hash (100000 rounds of
+    SHA-512); pass the `pw_hash` from an earlier call to skip it. Returns
+    (A, M1, pw_hash, cpu_seconds).
+    """
+    from telethon.password import (
+        compute_hash, check_prime_and_good, is_good_large, is_good_mod_exp_first,
+        num_bytes_for_hash, big_num_for_hash, sha256, xor,
+    )
+    from telethon.tl.types import PasswordKdfAlgoSHA256SHA256PBKDF2HMACSHA512iter100000SHA256ModPow as Algo
+
+    started = time.thread_time()
+    if pw_hash is None:
+        pw_hash = compute_hash(Algo(salt1, salt2, g, p), password)
+    check_prime_and_good(p, g)
+    p_int, B = int.from_bytes(p, "big"), int.from_bytes(srp_B, "big")
+    if not is_good_large(B, p_int):
+        raise ValueError("bad srp_B in the 2FA challenge")
+
+    x = int.from_bytes(pw_hash, "big")
+    p_for_hash = num_bytes_for_hash(p)
+    g_for_hash = big_num_for_hash(g)
+    b_for_hash = num_bytes_for_hash(srp_B)
+    k   = int.from_bytes(sha256(p_for_hash, g_for_hash), "big")
+    g_b = (B - k * pow(g, x, p_int)) % p_int
+    if not is_good_mod_exp_first(g_b, p_int):
+        raise ValueError("bad g_b in the 2FA challenge")
+    while True:
+        a = int.from_bytes(os.urandom(256), "big")
+        A = pow(g, a, p_int)
+        if not is_good_mod_exp_first(A, p_int):
+            continue
+        a_for_hash = big_num_for_hash(A)
+        u = int.from_bytes(sha256(a_for_hash, b_for_hash), "big")
+        if u > 0:
+            break
+    K  = sha256(big_num_for_hash(pow(g_b, a + u * x, p_int)))
+    M1 = sha256(xor(sha256(p_for_hash), sha256(g_for_hash)), sha256(salt1), sha256(salt2),
+                a_for_hash, b_for_hash, K)
+    return bytes(a_for_hash), bytes(M1), pw_hash, time.thread_time() - started
+
+
+class PasswordChecker:
+    """2FA sign-in with the SRP maths on an executor instead of the calling thread.
+
+    telethon's sign_in(password=) runs the PBKDF2 and the modular
+    exponentiation inline, which would stall every other account sharing the
+    event loop. Here they run on `executor`: a thread pool by default, worker
+    processes in batch mode. The password hash depends only on the account's
+    salts and the password, so it is cached per (phone, salts, password)
+    until forget(phone) and a retried attempt skips the PBKDF2. CPU seconds
+    per check are recorded as the password_cpu metric.
+    """
+    def __init__(self, executor=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor   = executor or ThreadPoolExecutor(os.cpu_count() or 1, thread_name_prefix="srp")
+        self.hashes     = {}        # (phone, salt1, salt2, password digest) → password hash
+        self.checks     = 0
+        self.cache_hits = 0
+        self.cpu        = 0.0
+
+    def _submit(self, phone, challenge, password):
+        from telethon.tl.types import PasswordKdfAlgoSHA256SHA256PBKDF2HMACSHA512iter100000SHA256ModPow as Algo
+        algo = challenge.current_algo
+        if not isinstance(algo, Algo):
+            raise ValueError(f"unsupported password algorithm {type(algo).__name__}")
+        key    = (phone, algo.salt1, algo.salt2, hashlib.sha256(password.encode("utf-8")).digest())
+        cached = self.hashes.get(key)
+        self.cache_hits += cached is not None
+        return key, self.executor.submit(srp_answer, algo.salt1, algo.salt2, algo.g, algo.p,
+                                         challenge.srp_B, password, cached)
+
+    def _answer(self, challenge, key, result):
+        from telethon.tl.types import InputCheckPasswordSRP
+        a_for_hash, m1, self.hashes[key], cpu = result
+        self.checks += 1
+        self.cpu    += cpu
+        metrics().observe("password_cpu", cpu)
+        return InputCheckPasswordSRP(challenge.srp_id, a_for_hash, m1)
+
+    def check(self, client, phone, password):
+        """Blocking 2FA sign-in for a telethon.sync or BackgroundClient."""
+        import asyncio
+        from telethon.tl.functions.account import GetPasswordRequest
+        from telethon.tl.functions.auth import CheckPasswordRequest
+        challenge   = client(GetPasswordRequest())
+        key, future = self._submit(phone, challenge, password)
+        result = client(CheckPasswordRequest(self._answer(challenge, key, future.result())))
+        login  = client._on_login(result.user)
+        if asyncio.iscoroutine(login):
+            client.loop.run_until_complete(login)
+        return result.user
+
+    async def check_async(self, client, phone, password):
+        """check() for an async client; the event loop keeps running meanwhile."""
+        import asyncio
+        from telethon.tl.functions.account import GetPasswordRequest
+        from telethon.tl.functions.auth import CheckPasswordRequest
+        challenge   = await client(GetPasswordRequest())
+        key, future = self._submit(phone, challenge, password)
+        answer = self._answer(challenge, key, await asyncio.wrap_future(future))
+        result = await client(CheckPasswordRequest(answer))
+        await client._on_login(result.user)
+        return result.user
+
+    def forget(self, phone):
+        for key in [k for k in self.hashes if k[0] == phone]:
+            del self.hashes[key]
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
 # ── Step 3: generate the session string ──────────────────
 def decode_code_type(t, phone):
     """Return a human-readable description of a SentCodeType* object."""
-    # Import every known type — older telethon versions may not have them all
-    import telethon.tl.types as tlt
+    # Dispatch on the class name — older telethon versions may not have every type
     name  = type(t).__name__
 
     if   name == "SentCodeTypeApp":
@@ -194,6 +1426,13 @@ def decode_code_type(t, phone):
 
 def dump_sent(sent, phone):
     """Print every field Telegram returned in the SentCode response."""
+    if JSONL:
+        fields = lambda t: {k: v for k, v in vars(t).items() if not k.startswith("_")} if t else None
+        return emit("code_sent", phone=phone, phone_code_hash=getattr(sent, "phone_code_hash", None),
+                    timeout=getattr(sent, "timeout", None), delivery=code_method(sent.type),
+                    type=type(sent.type).__name__, type_fields=fields(sent.type),
+                    next_type=type(sent.next_type).__name__ if sent.next_type else None,
+                    next_type_fields=fields(sent.next_type))
     print(f"\n  {C}── Telegram response (full debug dump) ──────────────────{R}")
 
     # phone_code_hash
@@ -225,20 +1464,18 @@ def dump_sent(sent, phone):
     print(f"  {C}─────────────────────────────────────────────────────────{R}\n")
 
 
-def generate_session(phone, api_id, api_hash):
+def generate_session(phone, api_id, api_hash, client=None, codes=None):
+    """Sign in and return the session string.
+
+    Pass a BackgroundClient as `client` to reuse a connection that was
+    started while the earlier prompts were still open, and a code source
+    spec as `codes` to take the code from it rather than TG_SESSION_CODES.
+    """
     step(3, "Generating your session string")
 
-    from telethon.sync import TelegramClient
-    from telethon.sessions import StringSession
     from telethon.errors import (
         PhoneNumberInvalidError,
         PhoneNumberBannedError,
-        PhoneCodeInvalidError,
-        PhoneCodeExpiredError,
-        PhoneCodeEmptyError,
-        PhoneCodeHashEmptyError,
-        SessionPasswordNeededError,
-        PasswordHashInvalidError,
         FloodWaitError,
         FloodPremiumWaitError,
         ApiIdInvalidError,
@@ -256,285 +1493,592 @@ def generate_session(phone, api_id, api_hash):
     )
 
     # ── Connect ───────────────────────────────────────────
-    info("Connecting to Telegram …")
-    client = TelegramClient(StringSession(), api_id, api_hash)
+    dcs  = DcCache()
+    home = dcs.lookup(phone)
+    if client is None:
+        # telethon.sync wraps every client method on import; only this path needs it.
+        from telethon.sync import TelegramClient
+        from telethon.sessions import StringSession
+        info("Connecting to Telegram …")
+        client = TelegramClient(StringSession(), api_id, api_hash, **transports().client_kwargs())
+        if home:
+            client.session.set_dc(home, *dc_address(home, transports().family()))
+    else:
+        info("Finishing the connection started in the background …")
+    if TRACE:
+        client = TRACE.attach(client, phone, api_id)
+    started, cpu = time.monotonic(), time.process_time()
     try:
-        client.connect()
+        saved = client.connect()
     except Exception as e:
+        metrics().observe("connect", time.monotonic() - started, failed=True)
         fatal(
             f"Could not connect to Telegram.\n     Detail: {type(e).__name__}: {e}",
             "Things to try:\n"
             "  • Check you have an internet connection\n"
             "  • If you use a VPN, try turning it off\n"
-            "  • Wait a minute and try again"
+            "  • Wait a minute and try again",
+            error="network"
         )
+    if saved is not None:
+        metrics().observe("connect", client.handshake, cpu=client.cpu)
+    else:
+        metrics().observe("connect", time.monotonic() - started, cpu=time.process_time() - cpu)
     ok("Connected to Telegram")
+    if saved is None:
+        config_cache().prime(client, refresh=False)     # a BackgroundClient primed itself
+    if saved is not None:
+        info(f"Handshake over {client.transport} won the transport race in {client.handshake:.2f}s — "
+             f"{max(saved, 0):.2f}s of the set-up overlapped the phone prompt")
+    if home and home != client.session.dc_id:
+        info(f"{phone_prefix(phone)} numbers have lived on DC {home} before — moving there now …")
+        try:
+            with metrics().time("migrate"):
+                switch_dc(client, home)
+        except Exception as e:
+            warn(f"Could not pre-connect to DC {home} ({type(e).__name__}) — Telegram will redirect instead")
+    if home:
+        info(f"DC cache hit for {phone_prefix(phone)} → DC {home}  ({dcs.hits} hits / {dcs.misses} misses)")
+    if config_cache().outcome in ("hit", "stale"):
+        info(f"Server config and DC addresses from cache, {config_cache().age() / 60:.0f} min old"
+             + (" — refreshing it in the background" if config_cache().task else ""))
 
     # ── Request sign-in code ──────────────────────────────
-    info(f"Requesting sign-in code for {phone} …")
-    try:
-        sent = client.send_code_request(phone)
-
-    except PhoneNumberInvalidError:
-        client.disconnect()
-        fatal(
-            f"Telegram says the phone number is invalid: {phone}",
-            "Re-run and enter a valid number with the + and country code.\n"
-            "Example: +447712345678"
-        )
-    except PhoneNumberBannedError:
-        client.disconnect()
-        fatal(
-            "This phone number has been banned by Telegram.",
-            "You'll need to use a different phone number."
-        )
-    except PhoneNumberUnoccupiedError:
-        client.disconnect()
-        fatal(
-            "There is no Telegram account registered to this phone number.",
-            "Install the Telegram app, create an account with this number, then re-run."
-        )
-    except PhoneNumberFloodError:
-        client.disconnect()
-        fatal(
-            "This phone number has been used too many times for code requests today.",
-            "Wait 24 hours before trying again with this number."
-        )
-    except ApiIdInvalidError:
-        client.disconnect()
-        fatal(
-            "Your API ID or Hash was rejected by Telegram as invalid.",
-            "Go back to https://my.telegram.org/apps, copy them again carefully, and re-run."
-        )
-    except ApiIdPublishedFloodError:
-        client.disconnect()
-        fatal(
-            "This API ID has been flagged by Telegram (too many users or publicly leaked).",
-            "Create a new app at https://my.telegram.org/apps and use the new API ID and Hash."
-        )
-    except AuthRestartError:
-        client.disconnect()
-        fatal(
-            "Telegram asked for an auth restart — the session state is broken.",
-            "Re-run the script from scratch."
-        )
-    except (NetworkMigrateError, PhoneMigrateError, UserMigrateError) as e:
-        client.disconnect()
-        fatal(
-            f"Telegram redirected the request to a different data centre ({type(e).__name__}).\n"
-            f"     Detail: {e}",
-            "Re-run the script — Telethon should handle this automatically on retry."
-        )
-    except (AuthKeyUnregisteredError, AuthKeyInvalidError):
-        client.disconnect()
-        fatal(
-            "The auth key is invalid or unregistered — the session is corrupt.",
-            "Re-run the script — a fresh session will be created."
-        )
-    except (SessionExpiredError, SessionRevokedError) as e:
-        client.disconnect()
-        fatal(
-            f"The session was {type(e).__name__.replace('Error','').lower()}.",
-            "Re-run the script — a fresh session will be created."
-        )
-    except FloodWaitError as e:
-        client.disconnect()
-        mins = e.seconds // 60 + 1
-        fatal(
-            f"Too many code requests — Telegram is blocking you for {e.seconds}s ({mins} min).",
-            f"Wait {mins} minutes, then re-run the script."
-        )
-    except FloodPremiumWaitError as e:
-        client.disconnect()
-        fatal(
-            f"Telegram Premium flood wait: {e.seconds}s.",
-            f"Wait {e.seconds // 60 + 1} minutes, then re-run."
-        )
-    except Exception as e:
+    floods  = FloodScheduler()
+    blocked = floods.blocked_until(phone, api_id) - time.time()
+    if blocked > INTERACTIVE_MAX_WAIT:
         client.disconnect()
+        mins = int(blocked) // 60 + 1
         fatal(
-            f"Unexpected error requesting the code.\n     Detail: {type(e).__name__}: {e}",
-            "Check your API ID and Hash are correct, then re-run."
+            f"Telegram is still rate-limiting this number or API ID from an earlier run ({int(blocked)}s left).",
+            f"Wait {mins} minutes, then re-run the script — asking now would only extend the block.",
+            error="rate_limited", retry_after=int(blocked)
         )
+    elif blocked > 0:
+        wait_out(blocked, "Waiting out a FloodWait from an earlier run")
 
-    # ── Show full Telegram response ───────────────────────
-    dump_sent(sent, phone)
+    source = interactive_code_source(codes)
+    if source:
+        source.expect(phone, api_id, api_hash)
+    strategy, why = delivery_stats().choose(phone)
+    if why:
+        info(why)
+    info(f"Requesting sign-in code for {phone} …")
+    migrations = 0
+    while True:
+        try:
+            with metrics().time("send_code"):
+                if strategy == "sms":
+                    sent = client(forced_sms_request(phone, api_id, api_hash))
+                else:
+                    sent = client.send_code_request(phone)
+            break
 
-    # ── Tell user exactly where to look ──────────────────
-    print(f"  {W}Where your code was sent:{R}\n")
-    print(f"     {decode_code_type(sent.type, phone)}\n")
+        except PhoneNumberInvalidError:
+            client.disconnect()
+            fatal(
+                f"Telegram says the phone number is invalid: {phone}",
+                "Re-run and enter a valid number with the + and country code.\n"
+                "Example: +447712345678",
+                error="rejected"
+            )
+        except PhoneNumberBannedError:
+            client.disconnect()
+            fatal(
+                "This phone number has been banned by Telegram.",
+                "You'll need to use a different phone number.",
+                error="rejected"
+            )
+        except PhoneNumberUnoccupiedError:
+            client.disconnect()
+            fatal(
+                "There is no Telegram account registered to this phone number.",
+                "Install the Telegram app, create an account with this number, then re-run.",
+                error="rejected"
+            )
+        except PhoneNumberFloodError:
+            client.disconnect()
+            fatal(
+                "This phone number has been used too many times for code requests today.",
+                "Wait 24 hours before trying again with this number.",
+                error="rate_limited"
+            )
+        except ApiIdInvalidError:
+            client.disconnect()
+            fatal(
+                "Your API ID or Hash was rejected by Telegram as invalid.",
+                "Go back to https://my.telegram.org/apps, copy them again carefully, and re-run.",
+                error="rejected"
+            )
+        except ApiIdPublishedFloodError:
+            client.disconnect()
+            fatal(
+                "This API ID has been flagged by Telegram (too many users or publicly leaked).",
+                "Create a new app at https://my.telegram.org/apps and use the new API ID and Hash.",
+                error="rejected"
+            )
+        except AuthRestartError:
+            client.disconnect()
+            fatal(
+                "Telegram asked for an auth restart — the session state is broken.",
+                "Re-run the script from scratch.",
+                error="session"
+            )
+        except (NetworkMigrateError, PhoneMigrateError, UserMigrateError) as e:
+            if migrations >= 2:
+                client.disconnect()
+                fatal(
+                    f"Telegram keeps redirecting the request between data centres ({type(e).__name__}).\n"
+                    f"     Detail: {e}",
+                    "Wait a minute and re-run the script.",
+                    error="network"
+                )
+            migrations += 1
+            dc = e.new_dc
+            info(f"Telegram says this number lives on DC {dc} — following the redirect …")
+            try:
+                with metrics().time("migrate"):
+                    switch_dc(client, dc)
+            except Exception as e:
+                client.disconnect()
+                fatal(
+                    f"Could not connect to DC {dc}.\n"
+                    f"     Detail: {type(e).__name__}: {e}",
+                    "Wait a minute and re-run the script.",
+                    error="network"
+                )
+        except (AuthKeyUnregisteredError, AuthKeyInvalidError):
+            client.disconnect()
+            fatal(
+                "The auth key is invalid or unregistered — the session is corrupt.",
+                "Re-run the script — a fresh session will be created.",
+                error="session"
+            )
+        except (SessionExpiredError, SessionRevokedError) as e:
+            client.disconnect()
+            fatal(
+                f"The session was {type(e).__name__.replace('Error','').lower()}.",
+                "Re-run the script — a fresh session will be created.",
+                error="session"
+            )
+        except FloodWaitError as e:
+            floods.penalise(phone, api_id, e.seconds)
+            if e.seconds <= INTERACTIVE_MAX_WAIT:
+                wait_out(e.seconds, f"Telegram asked us to wait {e.seconds}s")
+                continue
+            client.disconnect()
+            mins = e.seconds // 60 + 1
+            fatal(
+                f"Too many code requests — Telegram is blocking you for {e.seconds}s ({mins} min).",
+                f"Wait {mins} minutes, then re-run the script.",
+                error="rate_limited", retry_after=e.seconds
+            )
+        except FloodPremiumWaitError as e:
+            floods.penalise(phone, api_id, e.seconds)
+            if e.seconds <= INTERACTIVE_MAX_WAIT:
+                wait_out(e.seconds, f"Telegram Premium flood wait of {e.seconds}s")
+                continue
+            client.disconnect()
+            fatal(
+                f"Telegram Premium flood wait: {e.seconds}s.",
+                f"Wait {e.seconds // 60 + 1} minutes, then re-run.",
+                error="rate_limited", retry_after=e.seconds
+            )
+        except Exception as e:
+            client.disconnect()
+            fatal(
+                f"Unexpected error requesting the code.\n     Detail: {type(e).__name__}: {e}",
+                "Check your API ID and Hash are correct, then re-run.",
+                error="internal"
+            )
 
-    timeout = getattr(sent, "timeout", None)
-    if timeout:
-        warn(f"Code expires in {timeout} seconds ({timeout // 60}m {timeout % 60}s) — enter it quickly!")
-    else:
-        warn("Enter the code quickly — codes expire after a few minutes.")
+    # ── Checkpoint, so a crash from here on doesn't cost a new code ──
+    checkpoint = Checkpoint(phone)
+    checkpoint.save(api_id, api_hash, client.session.save(), sent.phone_code_hash)
+    info(f"Progress saved — if this window closes, run:  python3 telegram_session.py resume {phone}")
 
-    # ── Fallback delivery info ────────────────────────────
-    if sent.next_type is not None:
-        next_name = type(sent.next_type).__name__.replace("SentCodeType", "")
-        print(f"\n  {DIM}If it doesn't arrive, you can request a resend via: {next_name}{R}")
-    else:
-        print(f"\n  {DIM}No alternative delivery method available for this number.{R}")
+    dcs.learn(phone, client.session.dc_id)
+    dcs.save()
+    if migrations:
+        ok(f"Now on DC {client.session.dc_id} — remembered for other {phone_prefix(phone)} numbers")
+
+    # ── Show full Telegram response ───────────────────────
+    dump_sent(sent, phone)
+
+    # ── Tell user exactly where to look ──────────────────
+    if not JSONL:
+        print(f"  {W}Where your code was sent:{R}\n")
+        print(f"     {decode_code_type(sent.type, phone)}\n")
+
+        timeout = getattr(sent, "timeout", None)
+        if timeout:
+            warn(f"Code expires in {timeout} seconds ({timeout // 60}m {timeout % 60}s) — enter it quickly!")
+        else:
+            warn("Enter the code quickly — codes expire after a few minutes.")
+
+        # ── Fallback delivery info ────────────────────────────
+        if sent.next_type is not None:
+            next_name = type(sent.next_type).__name__.replace("SentCodeType", "")
+            print(f"\n  {DIM}If it doesn't arrive, you can request a resend via: {next_name}{R}")
+        else:
+            print(f"\n  {DIM}No alternative delivery method available for this number.{R}")
 
     # ── Resend option ─────────────────────────────────────
-    print(f"""
-    {G}[1]{R}  I have the code — let me enter it now
-    {G}[2]{R}  It didn't arrive — resend via a different method
-    {G}[3]{R}  {Y}Force SMS{R} — bypass app delivery, send code as a text message instead
+    # With a code source the code is already on its way in — don't stop to ask,
+    # and when past runs say resending at once is quickest, just do it.
+    resend_choice = "2" if strategy == "resend" else "1"
+    if not source and not JSONL and strategy != "resend":
+        usual = {s: f"  {DIM}(usually ~{v[0]:.0f}s for {phone_prefix(phone)}){R}"
+                 for s, v in delivery_stats().expected(phone_prefix(phone)).items()}
+        print(f"""
+    {G}[1]{R}  I have the code — let me enter it now{usual.get(strategy, "")}
+    {G}[2]{R}  It didn't arrive — resend via a different method{usual.get("resend", "")}
+    {G}[3]{R}  {Y}Force SMS{R} — bypass app delivery, send code as a text message instead{usual.get("sms", "")}
 """)
-    resend_choice = input(f"  {Y}Enter 1, 2 or 3 (default 1): {R}").strip()
+        resend_choice = input(f"  {Y}Enter 1, 2 or 3 (default 1): {R}").strip()
 
     if resend_choice == "2":
         if sent.next_type is not None:
+            strategy = "resend"
             info("Requesting resend …")
             try:
                 sent = client.resend_code_request(phone, sent.phone_code_hash)
+                checkpoint.save(api_id, api_hash, client.session.save(), sent.phone_code_hash)
                 print()
                 ok(f"Code resent.  New method: {type(sent.type).__name__.replace('SentCodeType','')}")
                 print(f"\n     {decode_code_type(sent.type, phone)}\n")
                 dump_sent(sent, phone)
             except FloodWaitError as e:
+                floods.penalise(phone, api_id, e.seconds)
                 fatal(
                     f"Telegram is rate-limiting resend — wait {e.seconds}s.",
-                    f"Re-run the script in {e.seconds // 60 + 1} minutes."
+                    f"Re-run the script in {e.seconds // 60 + 1} minutes.",
+                    error="rate_limited", retry_after=e.seconds
                 )
             except Exception as e:
                 fatal(
                     f"Resend failed.\n     Detail: {type(e).__name__}: {e}",
-                    "Re-run the script and try again."
+                    "Re-run the script and try again.",
+                    error="internal"
                 )
+        elif strategy == "resend":
+            strategy = "default"        # nothing to resend to; keep the code already sent
         else:
             print()
             warn("No standard resend available — try option 3 to force SMS instead.")
 
     if resend_choice == "3":
-        # ── Force SMS via raw SendCodeRequest with allow_app=False ───────────
-        from telethon.tl.functions.auth import SendCodeRequest
-        from telethon.tl.types import CodeSettings
-
+        # ── Force SMS via raw SendCodeRequest, every other method opted out ──
         info("Requesting code via forced SMS (bypassing app notification) …")
         try:
-            sent = client(SendCodeRequest(
-                phone_number=phone,
-                api_id=api_id,
-                api_hash=api_hash,
-                settings=CodeSettings(
-                    allow_flashcall=False,
-                    current_number=False,
-                    allow_app=False,
-                    allow_missed_call=False,
-                )
-            ))
+            sent = client(forced_sms_request(phone, api_id, api_hash))
+            checkpoint.save(api_id, api_hash, client.session.save(), sent.phone_code_hash)
+            strategy = "sms"
             print()
             ok(f"Request sent.  Delivery method: {type(sent.type).__name__.replace('SentCodeType','')}")
             print(f"\n     {decode_code_type(sent.type, phone)}\n")
             dump_sent(sent, phone)
         except FloodWaitError as e:
+            floods.penalise(phone, api_id, e.seconds)
             fatal(
                 f"Rate limited — wait {e.seconds}s.",
-                f"Re-run the script in {e.seconds // 60 + 1} minutes."
+                f"Re-run the script in {e.seconds // 60 + 1} minutes.",
+                error="rate_limited", retry_after=e.seconds
             )
         except Exception as e:
             fatal(
                 f"Force SMS request failed.\n     Detail: {type(e).__name__}: {e}",
                 "Telegram may not support SMS for this number.\n"
-                "Try logging into https://my.telegram.org in a browser to get a code there instead."
+                "Try logging into https://my.telegram.org in a browser to get a code there instead.",
+                error="internal"
             )
 
-    # ── Enter code ────────────────────────────────────────
-    code = input(f"\n  {Y}Enter the code: {R}").strip()
+    metrics().start("code_wait")
+    return finish_sign_in(client, phone, api_id, sent.phone_code_hash, checkpoint, source=source, sent=sent,
+                          strategy=strategy)
 
-    # ── Sign in ───────────────────────────────────────────
-    try:
-        client.sign_in(phone, code, phone_code_hash=sent.phone_code_hash)
 
-    except PhoneCodeInvalidError:
-        client.disconnect()
-        fatal(
-            "That code is wrong.",
-            "Re-run the script and type the code exactly — no spaces, no dots."
-        )
-    except PhoneCodeExpiredError:
-        client.disconnect()
-        fatal(
-            "That code has expired.",
-            "Re-run the script and enter the code as soon as it arrives."
-        )
-    except PhoneCodeEmptyError:
-        client.disconnect()
-        fatal(
-            "You submitted an empty code.",
-            "Re-run and type the digits from your Telegram app."
-        )
-    except PhoneCodeHashEmptyError:
-        client.disconnect()
-        fatal(
-            "Internal error — phone code hash is missing.",
-            "Re-run the script from scratch."
-        )
-    except SessionPasswordNeededError:
-        # ── 2FA ──────────────────────────────────────────
-        print()
-        ok("This account has Two-Factor Authentication (2FA) enabled.")
-        info("Enter the cloud password you set in Telegram → Settings → Privacy → Two-Step Verification.")
-        pw = input(f"\n  {Y}2FA password: {R}")
-        try:
-            client.sign_in(password=pw)
-        except PasswordHashInvalidError:
+def finish_sign_in(client, phone, api_id, phone_code_hash, checkpoint, stage="code", source=None, sent=None,
+                   strategy=None):
+    """Ask for the code (and 2FA password) until sign-in succeeds; return the session string.
+
+    Wrong or empty codes are retried on the same connection and hash, so a
+    typo never costs a new code request. An empty code never reaches
+    telethon, whose sign_in() would take it as a request for a new code.
+    Used by generate_session() and by `resume`, which arrives here with a
+    reconnected client. With a code `source` the first code is taken from
+    it and submitted as it arrives; if none comes, or it is wrong, the
+    prompt takes over. When the `strategy` that sent the code is known, its
+    time-to-code and outcome feed DeliveryStats.
+    """
+    from telethon.errors import (
+        PhoneCodeInvalidError,
+        PhoneCodeExpiredError,
+        PhoneCodeHashEmptyError,
+        SessionPasswordNeededError,
+        FloodWaitError,
+        AuthRestartError,
+        AuthKeyUnregisteredError,
+        AuthKeyInvalidError,
+    )
+    from telethon.tl import types
+    floods = FloodScheduler()
+    tries  = 0
+    asked  = False          # the source has had its turn; a non-scripted one gets only one
+    first_wait = None
+
+    def learn(delivered):
+        if strategy and sent is not None and first_wait is not None:
+            delivery_stats().record(phone, strategy, sent.type, first_wait, delivered)
+            delivery_stats().save()
+
+    if stage == "password":
+        user = sign_in_2fa(client, phone, api_id, floods, source)
+
+    while stage == "code":
+        # ── Enter code ────────────────────────────────────────
+        code = None
+        if source and (not asked or source.scripted):
+            asked = True
+            info(f"Waiting for the code from {source.spec} …")
+            code = source.code(phone, sent)
+            if code:
+                ok(f"Code received from {source.spec}")
+            else:
+                warn(f"No code arrived from {source.spec} — type it instead.")
+        code = (code or ask(f"\n  {Y}Enter the code: {R}", "code")).strip()
+        if not code:
+            warn("You submitted an empty code — type the digits from your Telegram app.")
+            continue
+        waited = metrics().stop("code_wait")
+        if sent is not None and waited is not None:
+            observe_code(source, phone, sent, waited, code)
+            first_wait = waited
+
+        # ── Sign in ───────────────────────────────────────────
+        try:
+            with metrics().time("sign_in"):
+                user = client.sign_in(phone, code, phone_code_hash=phone_code_hash)
+            if not isinstance(user, types.User):
+                raise TypeError(f"sign_in() returned {type(user).__name__}, not the signed-in user")
+            learn(True)
+            break
+
+        except PhoneCodeInvalidError:
+            tries += 1
+            if tries >= MAX_CODE_TRIES:
+                checkpoint.drop()
+                client.disconnect()
+                fatal(
+                    f"That code is wrong — {tries} wrong codes in a row.",
+                    "Re-run the script to get a new code, and type it exactly — no spaces, no dots.",
+                    error="code"
+                )
+            warn(f"That code is wrong — type it exactly, no spaces, no dots.  "
+                 f"({MAX_CODE_TRIES - tries} tries left)")
+        except PhoneCodeExpiredError:
+            learn(False)
+            checkpoint.drop()
+            client.disconnect()
+            fatal(
+                "That code has expired.",
+                "Re-run the script and enter the code as soon as it arrives.",
+                error="code"
+            )
+        except PhoneCodeHashEmptyError:
+            checkpoint.drop()
+            client.disconnect()
+            fatal(
+                "Internal error — phone code hash is missing.",
+                "Re-run the script from scratch.",
+                error="internal"
+            )
+        except SessionPasswordNeededError:
+            learn(True)
+            checkpoint.advance("password")
+            user = sign_in_2fa(client, phone, api_id, floods, source)
+            break
+
+        except FloodWaitError as e:
+            floods.penalise(phone, api_id, e.seconds)
+            client.disconnect()
+            fatal(
+                f"Rate limited — Telegram says wait {e.seconds}s.",
+                f"Run  python3 telegram_session.py resume  in {e.seconds // 60 + 1} minutes.",
+                error="rate_limited", retry_after=e.seconds
+            )
+        except AuthRestartError:
+            checkpoint.drop()
+            client.disconnect()
+            fatal(
+                "Telegram requested an auth restart during sign-in.",
+                "Re-run the script from scratch.",
+                error="session"
+            )
+        except (AuthKeyUnregisteredError, AuthKeyInvalidError) as e:
+            checkpoint.drop()
+            client.disconnect()
+            fatal(
+                f"Auth key error during sign-in: {type(e).__name__}",
+                "Re-run the script — a new session will be created.",
+                error="session"
+            )
+        except Exception as e:
             client.disconnect()
             fatal(
-                "Wrong 2FA password.",
-                "Re-run and enter the correct password.\n"
-                "If you've forgotten it: Telegram → Settings → Privacy and Security → Two-Step Verification → Forgot password"
+                f"Sign-in failed.\n     Detail: {type(e).__name__}: {e}",
+                "Run  python3 telegram_session.py resume  to try again with the same code request.\n"
+                "If it keeps failing, double-check your API ID and Hash.",
+                error="internal"
             )
+
+    checkpoint.drop()
+    if source:
+        source.close()
+    ok("Signed in successfully!")
+    info(f"Timings: {metrics().readout()}")
+    metrics().save()
+    session_string = client.session.save()
+    client.disconnect()
+    keep_session(phone, api_id, session_string, getattr(user, "id", None))
+    return session_string
+
+
+def sign_in_2fa(client, phone, api_id, floods, source=None):
+    """Ask for the cloud password until it is accepted (or give up after three tries); return the user.
+
+    A scripted `source` answers instead of the prompt; any other source is
+    asked first and the prompt takes over if it has no password.
+    """
+    from telethon.errors import PasswordHashInvalidError, FloodWaitError
+
+    print()
+    ok("This account has Two-Factor Authentication (2FA) enabled.")
+    info("Enter the cloud password you set in Telegram → Settings → Privacy → Two-Step Verification.")
+    checker  = PasswordChecker()
+    pw_tries = 0
+    while True:
+        pw = source.password(phone) if source and (not pw_tries or source.scripted) else None
+        pw = pw or ask(f"\n  {Y}2FA password: {R}", "password")
+        try:
+            with metrics().time("password"):
+                user = checker.check(client, phone, pw)
+            break
+        except PasswordHashInvalidError:
+            pw_tries += 1
+            if pw_tries >= MAX_PASSWORD_TRIES:
+                client.disconnect()
+                fatal(
+                    "Wrong 2FA password.",
+                    "Run  python3 telegram_session.py resume  and enter the correct password.\n"
+                    "If you've forgotten it: Telegram → Settings → Privacy and Security → Two-Step Verification → Forgot password",
+                    error="password"
+                )
+            warn("Wrong 2FA password — try again.")
         except FloodWaitError as e:
+            floods.penalise(phone, api_id, e.seconds)
             client.disconnect()
             fatal(
                 f"Too many 2FA attempts — wait {e.seconds}s.",
-                f"Re-run the script in {e.seconds // 60 + 1} minutes."
+                f"Run  python3 telegram_session.py resume  in {e.seconds // 60 + 1} minutes.",
+                error="rate_limited", retry_after=e.seconds
             )
         except Exception as e:
             client.disconnect()
             fatal(
                 f"2FA sign-in failed.\n     Detail: {type(e).__name__}: {e}",
-                "Check your password and try again."
+                "Check your password and try again.",
+                error="password"
             )
-        ok("2FA verified")
+    checker.close()
+    ok(f"2FA verified  {DIM}({checker.cpu:.2f}s CPU on the password check){R}")
+    return user
 
-    except FloodWaitError as e:
-        client.disconnect()
+
+# ── Resume an interrupted sign-in ─────────────────────────
+def resume_main(args):
+    banner()
+    check_telethon()
+    step(3, "Resuming your sign-in")
+
+    phones = Checkpoint.pending()
+    phone  = args.phone or (phones[0] if len(phones) == 1 else None)
+    if not phones:
         fatal(
-            f"Rate limited — Telegram says wait {e.seconds}s.",
-            f"Re-run the script in {e.seconds // 60 + 1} minutes."
+            "There is no interrupted sign-in to resume.",
+            "Run  python3 telegram_session.py  to start a new one.",
+            error="usage"
         )
-    except AuthRestartError:
-        client.disconnect()
+    if phone is None:
         fatal(
-            "Telegram requested an auth restart during sign-in.",
-            "Re-run the script from scratch."
+            f"{len(phones)} sign-ins are waiting — say which one to resume.",
+            "\n".join(f"python3 telegram_session.py resume {p}" for p in phones),
+            error="usage"
         )
-    except (AuthKeyUnregisteredError, AuthKeyInvalidError) as e:
-        client.disconnect()
+
+    checkpoint = Checkpoint(phone)
+    try:
+        state = checkpoint.load()
+    except FileNotFoundError:
+        fatal(
+            f"There is no interrupted sign-in for {phone}.",
+            "Waiting sign-ins: " + (", ".join(phones) or "none"),
+            error="usage"
+        )
+    except ValueError as e:
         fatal(
-            f"Auth key error during sign-in: {type(e).__name__}",
-            "Re-run the script — a new session will be created."
+            f"The saved sign-in for {phone} can't be decrypted ({e}).",
+            "If you set TG_SESSION_PASSPHRASE when it was saved, set it to the same value.\n"
+            f"Otherwise delete {checkpoint.path} and start again.",
+            error="usage"
         )
+
+    age = int(time.time() - state["saved_at"])
+    if state.get("stage") == "password":
+        info(f"The code for {phone} was already accepted {age // 60}m {age % 60}s ago — "
+             "only the 2FA password is left")
+    else:
+        info(f"Code for {phone} was requested {age // 60}m {age % 60}s ago — "
+             "continuing with the same auth key and code hash")
+
+    from telethon.sync import TelegramClient
+    from telethon.sessions import StringSession
+    try:
+        client = TelegramClient(StringSession(state["session"]), state["api_id"], state["api_hash"],
+                                **transports().client_kwargs())
+        with metrics().time("connect"):
+            client.connect()
     except Exception as e:
-        client.disconnect()
         fatal(
-            f"Sign-in failed.\n     Detail: {type(e).__name__}: {e}",
-            "Re-run the script. If it keeps failing, double-check your API ID and Hash."
+            f"Could not connect to Telegram.\n     Detail: {type(e).__name__}: {e}",
+            "Check your internet connection, then run this again — your progress is still saved.",
+            error="network"
         )
+    ok("Reconnected — no new handshake or code request needed")
 
-    ok("Signed in successfully!")
-    session_string = client.session.save()
-    client.disconnect()
-    return session_string
+    session_string = finish_sign_in(client, phone, state["api_id"], state["phone_code_hash"],
+                                    checkpoint, state.get("stage", "code"))
+    print_result(state["api_id"], state["api_hash"], session_string)
+
+
+# ── One session, no prompts ──────────────────────────────
+def new_main(args):
+    """The walkthrough from steps 0–3 with the answers given as arguments, for scripts and pipelines."""
+    if args.jsonl:
+        machine_mode()
+    check_telethon()
+    api_id, api_hash = check_credentials(args.api_id, args.api_hash)
+    phone  = check_phone(args.phone)
+    client = BackgroundClient(api_id, api_hash)
+    session_string = generate_session(phone, api_id, api_hash, client, codes=args.codes)
+    print_result(api_id, api_hash, session_string)
 
 
 # ── Done ─────────────────────────────────────────────────
 def print_result(api_id, api_hash, session_string):
+    if JSONL:
+        return emit("session", api_id=api_id, session=session_string,
+                    timings={k: round(v, 4) for k, v in metrics().run.items()}, **metrics().notes)
     clear()
     print(f"""
 {G}╔══════════════════════════════════════════════════════════════════════════╗
@@ -555,21 +2099,2837 @@ def print_result(api_id, api_hash, session_string):
 
 {G}══════════════════════════════════════════════════════════════════════════{R}
 """)
-    input(f"  {DIM}Press Enter to exit…{R}\n")
+    if sys.stdin.isatty():
+        input(f"  {DIM}Press Enter to exit…{R}\n")
 
 
-# ── Main ─────────────────────────────────────────────────
-def main():
-    banner()
-    check_telethon()
-    api_id, api_hash = get_api_credentials()
-    phone = get_phone()
-    session_string = generate_session(phone, api_id, api_hash)
-    print_result(api_id, api_hash, session_string)
+# ── Batch mode: many accounts on one event loop ──────────
+# One-line explanation for every error generate_session() distinguishes,
+# keyed by class name so batch output uses the same wording as the table
+# in the README.
+ERROR_HINTS = {
+    "PhoneNumberInvalidError":    "Number format wrong — check country code",
+    "PhoneNumberBannedError":     "Account banned from Telegram",
+    "PhoneNumberUnoccupiedError": "No Telegram account for this number",
+    "PhoneNumberFloodError":      "Too many code requests today — wait 24h",
+    "ApiIdInvalidError":          "Wrong API credentials — re-copy from my.telegram.org",
+    "ApiIdPublishedFloodError":   "API ID has been flagged — create a new app",
+    "FloodWaitError":             "Rate limited by Telegram",
+    "FloodPremiumWaitError":      "Premium flood wait",
+    "AuthRestartError":           "Broken session — retry from scratch",
+    "PhoneMigrateError":          "DC redirect — retry",
+    "NetworkMigrateError":        "DC redirect — retry",
+    "UserMigrateError":           "DC redirect — retry",
+    "AuthKeyUnregisteredError":   "Auth key unregistered — session is dead",
+    "AuthKeyInvalidError":        "Corrupt auth key — create a fresh session",
+    "SessionExpiredError":        "Session expired — create a fresh session",
+    "SessionRevokedError":        "Session revoked — create a fresh session",
+    "PhoneCodeInvalidError":      "Wrong code entered",
+    "PhoneCodeExpiredError":      "Code timed out before it was entered",
+    "PhoneCodeEmptyError":        "Empty code submitted",
+    "PhoneCodeHashEmptyError":    "Phone code hash missing — retry from scratch",
+    "SessionPasswordNeededError": "2FA enabled but no password was supplied",
+    "PasswordHashInvalidError":   "Wrong 2FA password",
+    "AuthKeyDuplicatedError":     "Session used from two places at once — Telegram killed it",
+    "UserDeactivatedError":       "Account deleted",
+    "UserDeactivatedBanError":    "Account banned from Telegram",
+}
 
-if __name__ == "__main__":
+def explain_error(e):
+    """Return 'ErrorName: plain-English hint' for an exception from the auth flow."""
+    name = type(e).__name__
+    hint = ERROR_HINTS.get(name)
+    if hint is None:
+        return f"{name}: {e}"
+    seconds = getattr(e, "seconds", None)
+    if seconds is not None:
+        hint += f" — wait {seconds}s"
+    return f"{name}: {hint}"
+
+
+def code_method(sent_type):
+    """'app', 'sms', 'call', … — a SentCodeType's name without the prefix, for metric names."""
+    return type(sent_type).__name__.replace("SentCodeType", "").lower()
+
+
+def observe_code(source, phone, sent, waited, code):
+    """Record code_wait_<method> and, if the source knows when the code arrived, code_submit_<method>."""
+    method = code_method(sent.type)
+    metrics().observe(f"code_wait_{method}", waited, failed=not code)
+    arrived = source.delivered(phone) if source else None
+    if code and arrived:
+        metrics().observe(f"code_submit_{method}", max(0.0, time.time() - arrived))
+
+
+class CodeSource(ABC):
+    """Where batch mode gets sign-in codes and 2FA passwords from.
+
+    Subclass and implement code() (and password(), if the source has them)
+    to plug in another source.
+    Returning None means "nothing arrived" and fails that account only.
+    expect() is called just before the code is requested, so a source can
+    start listening first; a source that knows when a code reached it calls
+    mark(), which feeds the code_submit_<method> metric. A `scripted` source
+    answers every prompt of the interactive flow, not only the first.
+    """
+    scripted = False
+
+    async def expect(self, phone, api_id, api_hash):
+        pass
+
+    @abstractmethod
+    async def code(self, phone, sent):
+        """The code sent to `phone`, once it arrives; None if it never does."""
+
+    async def password(self, phone):
+        return None
+
+    async def close(self):
+        pass
+
+    def mark(self, phone, at):
+        self.__dict__.setdefault("delivered_at", {})[phone.lstrip("+")] = at
+
+    def delivered(self, phone):
+        """Epoch seconds the last code for `phone` reached this source, or None if it can't tell."""
+        return self.__dict__.get("delivered_at", {}).pop(phone.lstrip("+"), None)
+
+
+class PromptCodeSource(CodeSource):
+    """Ask on the terminal, one prompt at a time — other accounts keep running."""
+    def __init__(self):
+        import asyncio
+        self._lock = asyncio.Lock()
+
+    async def _ask(self, prompt):
+        import asyncio
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, input, prompt)
+
+    async def code(self, phone, sent):
+        method = type(sent.type).__name__.replace("SentCodeType", "")
+        return (await self._ask(f"\n  {Y}Code for {phone} (via {method}): {R}")).strip()
+
+    async def password(self, phone):
+        return await self._ask(f"  {Y}2FA password for {phone}: {R}")
+
+
+class DirCodeSource(CodeSource):
+    """Poll a directory for <phone>.code and <phone>.password files.
+
+    Whatever drops the files — an SMS gateway, a colleague, another script —
+    acts as the operator. Code files are deleted once read so a code is never
+    submitted twice; files older than the request are ignored as stale. The
+    file's mtime is taken as the moment the code arrived.
+    """
+    def __init__(self, path, timeout=300, poll=0.1):
+        self.path    = path
+        self.timeout = timeout
+        self.poll    = poll
+        self.since   = {}
+
+    def _file(self, phone, ext):
+        return os.path.join(self.path, phone.lstrip("+") + ext)
+
+    async def expect(self, phone, api_id, api_hash):
+        self.since[phone] = time.time() - 1
+
+    async def code(self, phone, sent):
+        import asyncio
+        path     = self._file(phone, ".code")
+        since    = self.since.pop(phone, time.time() - 1)
+        deadline = time.monotonic() + (getattr(sent, "timeout", None) or self.timeout)
+        while time.monotonic() < deadline:
+            try:
+                mtime = os.path.getmtime(path)
+                if mtime >= since:
+                    with open(path, encoding="utf-8") as f:
+                        code = f.read().strip()
+                    os.remove(path)
+                    self.mark(phone, mtime)
+                    return code
+            except FileNotFoundError:
+                pass
+            await asyncio.sleep(self.poll)
+        return None
+
+    async def password(self, phone):
+        try:
+            with open(self._file(phone, ".password"), encoding="utf-8") as f:
+                return f.read().rstrip("\n")
+        except FileNotFoundError:
+            return None
+
+
+class PushCodeSource(CodeSource):
+    """Codes pushed in by something else, handed to whichever code() call is waiting.
+
+    deliver() runs on the event loop — from a pipe reader, an HTTP handler or
+    a Telegram event — so a code is submitted the moment it lands rather than
+    on the next poll. A code that lands before code() is called is held until
+    it is; one that landed before the request went out is dropped as stale.
+    """
+    def __init__(self, timeout=300):
+        self.timeout = timeout
+        self.waiting = {}       # phone → future code() is awaiting
+        self.early   = {}       # phone → (code, arrived at) with nobody waiting yet
+        self.started = False
+
+    async def start(self):
+        """Begin listening; called once, on the loop that will deliver codes."""
+
+    def deliver(self, phone, code, at=None):
+        key, at = phone.lstrip("+"), at or time.time()
+        waiter  = self.waiting.pop(key, None)
+        if waiter is not None and not waiter.done():
+            self.mark(phone, at)
+            waiter.set_result(code)
+        else:
+            self.early[key] = (code, at)
+
+    async def expect(self, phone, api_id, api_hash):
+        if not self.started:
+            self.started = True
+            await self.start()
+        self.early.pop(phone.lstrip("+"), None)
+
+    async def code(self, phone, sent):
+        import asyncio
+        key = phone.lstrip("+")
+        if key in self.early:
+            code, at = self.early.pop(key)
+            self.mark(phone, at)
+            return code
+        waiter = self.waiting[key] = asyncio.get_running_loop().create_future()
+        try:
+            return await asyncio.wait_for(waiter, getattr(sent, "timeout", None) or self.timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if self.waiting.get(key) is waiter:
+                del self.waiting[key]
+
+
+class PipeCodeSource(PushCodeSource):
+    """Read "<phone> <code>" lines from a named pipe, e.g. `echo "+447700900123 12345" > codes.fifo`.
+
+    A line holding just the code goes to the only account waiting, if there
+    is exactly one. The pipe is opened read-write so it never reports EOF
+    when a writer closes, and is watched with the loop's add_reader().
+    """
+    def __init__(self, path, timeout=300):
+        super().__init__(timeout)
+        self.path = path
+        self._fd  = None
+        self._buf = b""
+
+    async def start(self):
+        import asyncio
+        if not os.path.exists(self.path):
+            os.mkfifo(self.path, 0o600)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+        asyncio.get_running_loop().add_reader(self._fd, self._read)
+
+    def _read(self):
+        try:
+            self._buf += os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        *lines, self._buf = self._buf.split(b"\n")
+        for line in lines:
+            parts = line.decode("utf-8", "replace").split()
+            if len(parts) == 2:
+                self.deliver(*parts)
+            elif len(parts) == 1 and len(self.waiting) == 1:
+                self.deliver(next(iter(self.waiting)), parts[0])
+
+    async def close(self):
+        import asyncio
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+
+class HttpCodeSource(PushCodeSource):
+    """Take codes from an HTTP callback on 127.0.0.1, e.g. an SMS gateway's webhook.
+
+    POST /code (or GET) with phone and code as query parameters, a form body
+    or a JSON body. If TG_SESSION_CODE_TOKEN is set, requests must carry
+    `Authorization: Bearer <token>`. Replies 204 once the code is handed on.
+    """
+    def __init__(self, port, timeout=300, token=None):
+        super().__init__(timeout)
+        self.port   = port
+        self.token  = token or os.environ.get("TG_SESSION_CODE_TOKEN")
+        self.server = None
+
+    async def start(self):
+        import asyncio
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+
+    async def _handle(self, reader, writer):
+        import asyncio
+        from urllib.parse import urlsplit, parse_qsl
+        status = "400 Bad Request"
+        try:
+            method, target, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+            headers = {}
+            while (line := (await reader.readline()).decode("latin-1").strip()):
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(min(int(headers.get("content-length", 0)), 4096))
+            url  = urlsplit(target)
+            if url.path != "/code":
+                status = "404 Not Found"
+            elif self.token and not hmac.compare_digest(headers.get("authorization", ""),
+                                                        f"Bearer {self.token}"):
+                status = "401 Unauthorized"
+            else:
+                fields = dict(parse_qsl(url.query))
+                if body.lstrip().startswith(b"{"):
+                    fields.update({k: str(v) for k, v in json.loads(body).items()})
+                elif body:
+                    fields.update(parse_qsl(body.decode("utf-8")))
+                if fields.get("phone") and fields.get("code"):
+                    self.deliver(fields["phone"].strip(), fields["code"].strip())
+                    status = "204 No Content"
+        except (ValueError, UnicodeDecodeError, asyncio.IncompleteReadError):
+            pass
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+
+TELEGRAM_SERVICE_USER = 777000      # the account login codes come from
+LOGIN_CODE = r"\b(\d{5,6})\b"
+
+class TelegramCodeSource(PushCodeSource):
+    """Read the code off an authorised session of the same account.
+
+    For accounts that already have a session in the local store, expect()
+    connects the newest one before the code is requested and listens for the
+    login message from Telegram's service account, so SentCodeTypeApp codes
+    need nobody to open the app. Accounts without a stored session get None.
+    """
+    def __init__(self, timeout=300, store=None):
+        super().__init__(timeout)
+        self.store     = store
+        self.listeners = {}
+
+    async def expect(self, phone, api_id, api_hash):
+        await super().expect(phone, api_id, api_hash)
+        if phone in self.listeners:
+            return
+        from telethon import TelegramClient, events
+        from telethon.sessions import StringSession
+        store = self.store or SessionStore()
+        try:
+            row = next((r for r in store.find(phone=phone) if not r["revoked_at"]), None)
+        finally:
+            if store is not self.store:
+                store.close()
+        if row is None:
+            return
+        client = TelegramClient(StringSession(row["session"]), api_id, api_hash,
+                                **transports().client_kwargs())
+
+        async def on_message(event):
+            found = re.search(LOGIN_CODE, event.raw_text or "")
+            if found:
+                self.deliver(phone, found.group(1))
+
+        client.add_event_handler(on_message, events.NewMessage(chats=TELEGRAM_SERVICE_USER, incoming=True))
+        try:
+            await client.connect()
+            # Any request starts the update stream; get_me() also proves the session is alive.
+            if await client.get_me() is None:
+                raise ValueError("the stored session is no longer authorised")
+        except Exception as e:
+            await client.disconnect()
+            warn(f"{phone}  can't listen for the code on its stored session: {explain_error(e)}")
+            return
+        self.listeners[phone] = client
+
+    async def code(self, phone, sent):
+        client = self.listeners.pop(phone, None)
+        if client is None:
+            return None
+        try:
+            return await super().code(phone, sent)
+        finally:
+            await client.disconnect()
+
+    async def close(self):
+        for client in self.listeners.values():
+            await client.disconnect()
+        self.listeners.clear()
+
+
+class AnyCodeSource(CodeSource):
+    """Several sources at once: the first code any of them produces wins, the rest are cancelled."""
+    def __init__(self, sources):
+        self.sources = list(sources)
+
+    async def expect(self, phone, api_id, api_hash):
+        import asyncio
+        await asyncio.gather(*(s.expect(phone, api_id, api_hash) for s in self.sources))
+
+    async def code(self, phone, sent):
+        import asyncio
+        pending = {asyncio.ensure_future(s.code(phone, sent)): s for s in self.sources}
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    source = pending.pop(task)
+                    if task.result():
+                        arrived = source.delivered(phone)
+                        if arrived:
+                            self.mark(phone, arrived)
+                        return task.result()
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def password(self, phone):
+        for source in self.sources:
+            pw = await source.password(phone)
+            if pw is not None:
+                return pw
+        return None
+
+    async def close(self):
+        for source in self.sources:
+            await source.close()
+
+
+def code_source(spec, timeout=300):
+    """Build a CodeSource from a comma-separated spec of dir:PATH, pipe:PATH, http:PORT, telegram.
+
+    A bare path means a directory, as --codes always took.
+    """
+    sources = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        kind, _, arg = part.partition(":")
+        if kind == "telegram" and not arg:
+            sources.append(TelegramCodeSource(timeout))
+        elif kind == "pipe" and arg:
+            sources.append(PipeCodeSource(arg, timeout))
+        elif kind == "http" and arg:
+            if not arg.isdigit():
+                raise ValueError(f"http: wants a port number — got '{arg}'")
+            sources.append(HttpCodeSource(int(arg), timeout))
+        elif kind == "dir" and arg:
+            sources.append(DirCodeSource(arg, timeout))
+        else:
+            sources.append(DirCodeSource(part, timeout))
+    if not sources:
+        raise ValueError("no code source given")
+    return sources[0] if len(sources) == 1 else AnyCodeSource(sources)
+
+
+class BlockingCodeSource:
+    """A CodeSource driven from synchronous code, on its own loop thread.
+
+    The interactive flow is synchronous; this keeps the source's listeners —
+    pipe reader, HTTP server, Telegram client — running on a private loop
+    while the main thread blocks, like BackgroundClient does for the client.
+    """
+    def __init__(self, source, spec):
+        import asyncio
+        self.source = source
+        self.spec   = spec
+        self._loop  = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+
+    def _run(self, coro):
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def expect(self, phone, api_id, api_hash):
+        self._run(self.source.expect(phone, api_id, api_hash))
+
+    @property
+    def scripted(self):
+        return self.source.scripted
+
+    def code(self, phone, sent):
+        return self._run(self.source.code(phone, sent))
+
+    def password(self, phone):
+        return self._run(self.source.password(phone))
+
+    def delivered(self, phone):
+        return self.source.delivered(phone)
+
+    def close(self):
+        self._run(self.source.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def interactive_code_source(spec=None):
+    """A BlockingCodeSource for `spec` (a CodeSource or a spec string) or TG_SESSION_CODES, or None to prompt as usual."""
+    if isinstance(spec, CodeSource):
+        return BlockingCodeSource(spec, type(spec).__name__)
+    spec = spec or os.environ.get("TG_SESSION_CODES")
+    if not spec:
+        return None
     try:
-        main()
+        return BlockingCodeSource(code_source(spec), spec)
+    except ValueError as e:
+        fatal(f"TG_SESSION_CODES is not a code source: {e}",
+              "Use a comma-separated list of dir:PATH, pipe:PATH, http:PORT or telegram.", error="usage")
+
+
+class Job:
+    """One manifest row and, once provisioned, its outcome."""
+    def __init__(self, api_id, api_hash, phone):
+        self.api_id     = api_id
+        self.api_hash   = api_hash
+        self.phone      = phone
+        self.session    = ""
+        self.error      = ""
+        self.user_id    = 0
+        self.flood_wait = 0     # seconds Telegram asked us to back off, if that's why it failed
+        self.parks      = 0     # times the FloodScheduler has parked it
+        self.phase      = ""    # what it is waiting on right now, for the BatchBoard
+        self.since      = 0.0   # monotonic time it entered that phase
+        self.delivery   = ""    # how its code was sent
+        self.until      = 0.0   # epoch seconds a parked job is let go at
+
+
+def read_manifest(path):
+    """Yield a Job per row of a CSV manifest with api_id, api_hash, phone columns.
+
+    Rows that fail the same checks as the interactive prompts come back with
+    .error already set, so they are reported instead of aborting the run.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            api_id   = (row.get("api_id")   or "").strip()
+            api_hash = (row.get("api_hash") or "").strip()
+            phone    = (row.get("phone")    or "").strip()
+            job = Job(int(api_id) if api_id.isdigit() else 0, api_hash, phone)
+            if not api_id.isdigit():
+                job.error = f"line {line}: api_id should be all numbers — got '{api_id}'"
+            elif len(api_hash) != 32:
+                job.error = f"line {line}: api_hash should be 32 characters — got {len(api_hash)}"
+            elif not phone.startswith("+"):
+                job.error = f"line {line}: phone must start with + and the country code — got '{phone}'"
+            yield job
+
+
+async def provision(job, source, dcs=None, keys=None, passwords=None, delivery=None):
+    """connect → send_code_request → sign_in for one account, without blocking the loop.
+
+    With a DcCache the client connects straight to the prefix's home DC, and
+    migrate errors are followed in-process either way. With an AuthKeyPool it
+    starts from a pre-negotiated key (waiting for one if the reserve is empty),
+    so connect() skips the DH exchange. With a PasswordChecker the 2FA maths
+    runs on its executor, off the loop. With DeliveryStats the code is
+    requested the way that has been quickest for the prefix, and the outcome
+    is recorded.
+    """
+    from telethon import TelegramClient
+    from telethon.sessions import StringSession
+    from telethon.errors import (
+        SessionPasswordNeededError, NetworkMigrateError, PhoneMigrateError, UserMigrateError,
+        FloodWaitError, FloodPremiumWaitError, PhoneCodeInvalidError, PhoneCodeEmptyError,
+    )
+
+    # Every FloodWait surfaces, however short, so the scheduler can park the
+    # job rather than telethon sleeping on it inside a worker.
+    client = TelegramClient(StringSession(), job.api_id, job.api_hash, flood_sleep_threshold=0,
+                            **transports().client_kwargs())
+    home = dcs.lookup(job.phone) if dcs else None
+    key  = await keys.take(job.api_id, job.api_hash, home or 2) if keys else None
+    if home or key:
+        client.session.set_dc(home or 2, *dc_address(home or 2, transports().family()))
+    if key:
+        from telethon.crypto import AuthKey
+        client.session.auth_key = AuthKey(key)
+    m = metrics()
+
+    def phase(name):
+        job.phase, job.since = name, time.monotonic()
+        return m.time(name)
+
+    try:
+        with phase("connect"):
+            await client.connect()
+        config_cache().prime(client)
+        await source.expect(job.phone, job.api_id, job.api_hash)
+        strategy = delivery.choose(job.phone, DELIVERY_EXPLORE)[0] if delivery else "default"
+        for attempt in range(3):
+            try:
+                with phase("send_code"):
+                    if strategy == "sms":
+                        sent = await client(forced_sms_request(job.phone, job.api_id, job.api_hash))
+                    else:
+                        sent = await client.send_code_request(job.phone)
+                break
+            except (NetworkMigrateError, PhoneMigrateError, UserMigrateError) as e:
+                if attempt == 2:
+                    raise
+                with phase("migrate"):
+                    await client._switch_dc(e.new_dc)
+        if dcs:
+            dcs.learn(job.phone, client.session.dc_id)
+        if strategy == "resend" and sent.next_type is not None:
+            with phase("send_code"):
+                sent = await client.resend_code_request(job.phone, sent.phone_code_hash)
+        elif strategy == "resend":
+            strategy = "default"
+        job.delivery = code_method(sent.type)
+        # A wrong code is asked for again on the same connection and hash.
+        for attempt in range(1, MAX_CODE_TRIES + 1):
+            asked = time.monotonic()
+            with phase("code_wait"):
+                code = await source.code(job.phone, sent)
+            waited = time.monotonic() - asked
+            observe_code(source, job.phone, sent, waited, code)
+            if attempt == 1:
+                first_wait = waited
+            if not code:
+                if delivery:
+                    delivery.record(job.phone, strategy, sent.type, first_wait, False)
+                job.error = "No code arrived before it expired"
+                return job
+            try:
+                with phase("sign_in"):
+                    user = await client.sign_in(job.phone, code, phone_code_hash=sent.phone_code_hash)
+                if delivery:
+                    delivery.record(job.phone, strategy, sent.type, first_wait, True)
+                break
+            except (PhoneCodeInvalidError, PhoneCodeEmptyError):
+                if attempt == MAX_CODE_TRIES:
+                    raise
+            except SessionPasswordNeededError:
+                if delivery:
+                    delivery.record(job.phone, strategy, sent.type, first_wait, True)
+                pw = await source.password(job.phone)
+                if pw is None:
+                    raise
+                with phase("password"):
+                    if passwords:
+                        user = await passwords.check_async(client, job.phone, pw)
+                    else:
+                        user = await client.sign_in(password=pw)
+                break
+        job.session = client.session.save()
+        job.user_id = getattr(user, "id", 0)
+    except (FloodWaitError, FloodPremiumWaitError) as e:
+        job.flood_wait = e.seconds
+        job.error = explain_error(e)
+    except Exception as e:
+        job.error = explain_error(e)
+    finally:
+        await client.disconnect()
+    return job
+
+
+async def run_batch(jobs, source, concurrency=8, on_done=None, floods=None, max_wait=3600,
+                    keys=None, passwords=None, board=None):
+    """Provision every job with at most `concurrency` accounts in flight.
+
+    Jobs are pulled lazily from the iterable by a fixed set of workers, so a
+    manifest of any length runs in constant memory. A job that hits a
+    FloodWait, or whose phone or api_id is still penalised from an earlier
+    run, is parked in the FloodScheduler while the workers move on, and is
+    retried once its window ends. Windows longer than `max_wait` seconds fail
+    the job instead (the penalty is still remembered for the next run).
+    A BatchBoard as `board` is shown for the length of the run.
+    """
+    import asyncio
+    jobs      = iter(jobs)
+    dcs       = DcCache()
+    delivery  = delivery_stats()
+    floods    = floods or FloodScheduler()
+    passwords = passwords or PasswordChecker()
+    busy      = 0
+    warm_dcs  = {2} | {entry["dc"] for entry in dcs.entries.values()}
+    warmed    = set()
+
+    def park_or_fail(job, until, hit=False):
+        # Only a FloodWait the job itself hit counts towards its three retries;
+        # waiting behind someone else's api_id penalty doesn't.
+        wait = until - time.time()
+        if wait > max_wait or (hit and job.parks >= 3):
+            job.error = job.error or f"Rate limited for another {wait:.0f}s — retry in a later run"
+            return False
+        job.parks += hit
+        job.flood_wait, job.error = 0, ""
+        floods.park(job, until)
+        if board:
+            board.park(job, until)
+        info(f"{job.phone}  parked for {wait:.1f}s by FloodWait  ({len(floods.parked)} parked)")
+        return True
+
+    async def next_job():
+        while True:
+            job = floods.pop_ready() or next(jobs, None)
+            if job is None:
+                if not floods.parked and not busy:
+                    return None
+                wake = floods.next_ready()
+                await asyncio.sleep(min(1.0, max(0.05, wake - time.time())) if wake else 0.5)
+                continue
+            until = floods.blocked_until(job.phone, job.api_id)
+            if job.error or until <= time.time() or not park_or_fail(job, until):
+                return job
+
+    async def worker():
+        nonlocal busy
+        while (job := await next_job()) is not None:
+            if not job.error:
+                busy += 1
+                if keys and job.api_id not in warmed:
+                    # The first job of each api_id starts its keys for every DC we know of.
+                    warmed.add(job.api_id)
+                    keys.warm(job.api_id, job.api_hash, warm_dcs)
+                if board:
+                    board.add(job)
+                try:
+                    await provision(job, source, dcs, keys, passwords, delivery)
+                finally:
+                    busy -= 1
+                if job.flood_wait and park_or_fail(job, floods.penalise(job.phone, job.api_id, job.flood_wait), hit=True):
+                    continue
+            passwords.forget(job.phone)
+            if board:
+                board.remove(job)
+            if on_done:
+                on_done(job)
+
+    ticker = asyncio.ensure_future(board.run()) if board else None
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    finally:
+        if ticker:
+            ticker.cancel()
+            board.stop()
+        dcs.save()
+        delivery.save()
+        floods.save()
+        metrics().save()
+        passwords.close()
+        await source.close()
+        if keys:
+            keys.close()
+
+
+def batch_main(args):
+    import asyncio
+    step("B", f"Batch provisioning from {args.manifest}")
+    try:
+        source = code_source(args.codes) if args.codes else PromptCodeSource()
+    except ValueError as e:
+        warn(f"--codes: {e}")
+        sys.exit(EXIT_CODES["usage"])
+    if args.codes:
+        info(f"Taking codes from {args.codes} as they arrive (2FA from <phone>.password in a dir source)")
+    info(f"Up to {args.concurrency} accounts in flight — results go to {args.output}")
+
+    counts = {"ok": 0, "failed": 0}
+    store  = SessionStore() if keeping_sessions() else None
+    # The output holds live session strings — create it owner-only.
+    fd = os.open(args.output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        writer.writerow(["phone", "api_id", "status", "session", "error"])
+
+        def done(job):
+            if job.session:
+                counts["ok"] += 1
+                ok(f"{job.phone}  signed in")
+            else:
+                counts["failed"] += 1
+                warn(f"{job.phone}  {job.error}")
+            writer.writerow([job.phone, job.api_id, "ok" if job.session else "failed",
+                             job.session, job.error])
+            out.flush()
+            if job.session and store:
+                try:
+                    store.add(job.phone, job.api_id, job.session, job.user_id)
+                except ValueError as e:
+                    warn(f"{job.phone}  not saved to the session store: {e}")
+
+        jobs   = read_manifest(args.manifest)
+        keys   = None
+        if args.key_pool:
+            keys = AuthKeyPool(reserve=args.key_pool)
+            info(f"Keeping {args.key_pool} pre-negotiated auth keys ready per api_id and DC")
+        from concurrent.futures import ProcessPoolExecutor
+        floods    = FloodScheduler()
+        passwords = PasswordChecker(ProcessPoolExecutor(args.srp_workers or None))
+        # The prompt source asks on the terminal, where neither the table nor
+        # summary lines may cut into a prompt.
+        board     = BatchBoard(live=False if args.plain else None, fps=args.fps) if args.codes else None
+        start     = time.monotonic()
+        asyncio.run(run_batch(jobs, source, args.concurrency, done, floods, args.max_wait, keys,
+                              passwords, board))
+
+    elapsed = time.monotonic() - start
+    total   = counts["ok"] + counts["failed"]
+    dcs     = DcCache()
+    print()
+    ok(f"{total} accounts in {elapsed:.1f}s — {counts['ok']} signed in, {counts['failed']} failed")
+    if store:
+        info(f"Session store: {store.count()} sessions in {store.path}")
+        store.close()
+    info(f"DC cache: {len(dcs.entries)} prefixes known, {dcs.hits} hits / {dcs.misses} misses so far")
+    if config_cache().outcome:
+        info(f"Server config: cache {config_cache().outcome}"
+             + (", refreshed during the run" if config_cache().refreshed else ""))
+    st = floods.stats()
+    info(f"FloodWait: {st['penalties']} penalties, peak {st['peak_parked']} jobs parked, "
+         f"{st['blocked_seconds']}s spent parked, {st['active_windows']} windows still active")
+    if passwords.checks:
+        info(f"2FA: {passwords.checks} password checks, {passwords.cpu:.2f}s CPU "
+             f"({passwords.cpu / passwords.checks:.3f}s each), {passwords.cache_hits} reused a cached hash")
+    if keys:
+        info(f"Auth-key pool: {keys.hits} jobs started with a ready key, {keys.misses} negotiated "
+             f"their own; {keys.generated} keys generated, {keys.expired} expired")
+    if counts["failed"]:
+        sys.exit(EXIT_CODES["failed"])
+
+
+# ── Batch dashboard ───────────────────────────────────────
+# A live table of the accounts in flight for `batch`, redrawn cell by cell:
+# each frame formats only the rows that fit on the screen and writes only the
+# cells whose text changed, in one buffered write, at most BOARD_FPS times a
+# second. Finished accounts are only counted, so a frame costs the same with
+# fifty accounts behind it or fifty thousand. Anything printed while the table
+# is up lands in a log pane under it rather than scrolling it away. When
+# stdout is not a terminal the counts come out as a summary line instead.
+BOARD_FPS      = 8          # frame cap on a terminal
+BOARD_INTERVAL = 10         # seconds between summary lines otherwise
+BOARD_LOG      = 200        # log lines kept, and printed again when the table closes
+BOARD_COLUMNS  = (("PHONE", 17), ("PHASE", 10), ("DELIVERY", 13), ("IN PHASE", 9), ("FLOODWAIT", 9))
+
+
+def short_duration(seconds):
+    seconds = max(0, int(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds // 60 % 60:02d}m"
+
+
+class BatchBoard:
+    """Per-account progress for run_batch(): a live table on a terminal, summary lines elsewhere.
+
+    run_batch() calls add() as a job starts, park() when the FloodScheduler
+    holds it and remove() when it is done; provision() keeps the job's phase,
+    delivery method and phase start time up to date. Each job on screen keeps
+    its row until it is done, and jobs that don't fit wait for a free row.
+    """
+    def __init__(self, live=None, fps=BOARD_FPS, interval=BOARD_INTERVAL, out=None):
+        self.out      = out or sys.stdout
+        self.live     = self.out.isatty() and not JSONL if live is None else live
+        self.period   = 1 / fps if self.live else interval
+        self.started  = time.monotonic()
+        self.active   = {}          # id(job) → job, in flight or parked
+        self.slot     = {}          # id(job) → its row in the table
+        self.rows     = []          # row → job or None
+        self.free     = []          # heap of empty rows
+        self.hidden   = deque()     # jobs waiting for a row; may hold ones already done
+        self.parked   = 0
+        self.done = self.ok = self.failed = 0
+        self.log      = deque(maxlen=BOARD_LOG)
+        self.logged   = 0
+        self.shown    = {}          # (row, column) → text on the screen there
+        self.size     = None
+        self.frames   = 0
+        self._line    = ""
+        self._up      = False
+
+    # ── Job state, from run_batch() ──
+    def add(self, job):
+        if id(job) in self.active:
+            if job.phase == "parked":
+                self.parked -= 1
+                job.phase, job.since = "", time.monotonic()
+            return
+        self.active[id(job)] = job
+        job.since = time.monotonic()
+        if self.free:
+            self._place(job, heapq.heappop(self.free))
+        else:
+            self.hidden.append(job)
+
+    def park(self, job, until):
+        self.add(job)
+        job.phase, job.since, job.until = "parked", time.monotonic(), until
+        self.parked += 1
+
+    def remove(self, job):
+        if self.active.pop(id(job), None) is not None and job.phase == "parked":
+            self.parked -= 1
+        self.done += 1
+        if job.session:
+            self.ok += 1
+        else:
+            self.failed += 1
+        row = self.slot.pop(id(job), None)
+        if row is not None:
+            self.rows[row] = None
+            heapq.heappush(self.free, row)
+            self._fill()
+
+    def _place(self, job, row):
+        self.rows[row] = job
+        self.slot[id(job)] = row
+
+    def _fill(self):
+        while self.free and self.hidden:
+            job = self.hidden.popleft()
+            if id(job) in self.active and id(job) not in self.slot:
+                self._place(job, heapq.heappop(self.free))
+
+    def summary(self):
+        elapsed = int(time.monotonic() - self.started)     # whole seconds, so the line changes once a second
+        return (f"{self.done} done — {self.ok} signed in, {self.failed} failed  ·  "
+                f"{len(self.active) - self.parked} in flight  ·  {self.parked} parked  ·  "
+                f"{self.done / elapsed if elapsed else 0:.1f} accounts/s  ·  {short_duration(elapsed)}")
+
+    # ── Output ──
+    async def run(self):
+        """Draw a frame (or print a summary line) every period until cancelled."""
+        import asyncio
+        self.start()
+        while True:
+            await asyncio.sleep(self.period)
+            if self.live:
+                self.draw()
+            else:
+                info(self.summary())
+
+    def start(self):
+        if self.live and not self._up:
+            # The alternate screen keeps the table out of the scrollback, and
+            # taking sys.stdout routes every ok()/warn() into the log pane.
+            self.out.write("\033[?1049h\033[?25l")
+            self._stdout, sys.stdout, self._up = sys.stdout, self, True
+            self.draw()
+
+    def stop(self):
+        if not self._up:
+            return
+        self.draw()
+        sys.stdout, self._up = self._stdout, False
+        self.out.write("\033[?25h\033[?1049l")
+        if self.logged > len(self.log):
+            self.out.write(f"  {DIM}… {self.logged - len(self.log)} earlier lines — every result is "
+                           f"in the output CSV{R}\n")
+        self.out.write("".join(line + "\n" for line in self.log))
+        self.out.flush()
+
+    # Enough of a file for print() while the table is up.
+    encoding = "utf-8"
+
+    def write(self, text):
+        *lines, self._line = (self._line + text).split("\n")
+        self.log.extend(lines)
+        self.logged += len(lines)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def _resize(self, size):
+        self.size     = size
+        self.log_rows = max(3, size.lines // 4)
+        height        = max(1, size.lines - self.log_rows - 3)
+        jobs          = [job for job in self.rows if job is not None]
+        self.hidden.extendleft(reversed(jobs[height:]))
+        self.rows, self.slot = [None] * height, {}
+        for row, job in enumerate(jobs[:height]):
+            self._place(job, row)
+        self.free = list(range(len(jobs[:height]), height))
+        self._fill()
+        self.shown = {}
+        self.out.write("\033[2J")
+
+    def cells(self):
+        """(row, column, text) for every cell on the screen, each padded to its width and cut at the edge."""
+        import shutil
+        size = shutil.get_terminal_size()
+        if size != self.size:
+            self._resize(size)
+        width, now, wall = size.columns, time.monotonic(), time.time()
+
+        def line(row, text):
+            return row, 0, text[:width].ljust(width)
+
+        def columns(row, texts):
+            x = 0
+            for (_, w), text in zip(BOARD_COLUMNS, texts):
+                if x >= width:
+                    break
+                yield row, x, text[:w].ljust(w)[:width - x]
+                x += w + 1
+
+        yield line(0, self.summary())
+        yield from columns(1, [heading for heading, _ in BOARD_COLUMNS])
+        for row, job in enumerate(self.rows):
+            if job is None:
+                texts = ("",) * len(BOARD_COLUMNS)
+            else:
+                texts = (job.phone, job.phase or "queued", job.delivery, short_duration(now - job.since),
+                         short_duration(job.until - wall) if job.phase == "parked" else "")
+            yield from columns(2 + row, texts)
+        hidden = len(self.active) - len(self.slot)
+        top    = 2 + len(self.rows)
+        yield line(top, (f"─── +{hidden} more " if hidden else "") + "─" * width)
+        lines = list(itertools.islice(reversed(self.log), self.log_rows))[::-1]
+        for i in range(self.log_rows):
+            yield line(top + 1 + i, ANSI.sub("", lines[i]) if i < len(lines) else "")
+
+    def draw(self):
+        """Write the cells that changed since the last frame, in one write."""
+        parts = []
+        for row, column, text in self.cells():
+            if self.shown.get((row, column)) != text:
+                self.shown[(row, column)] = text
+                parts.append(f"\033[{row + 1};{column + 1}H{text}")
+        self.frames += 1
+        if parts:
+            self.out.write("".join(parts))
+            self.out.flush()
+
+
+# ── Check mode: are existing session strings still alive? ──
+# Errors that mean the session itself is gone for good, as opposed to a
+# network blip or a rate limit where re-checking later may succeed.
+DEAD_SESSION_ERRORS = {
+    "AuthKeyUnregisteredError", "AuthKeyInvalidError", "AuthKeyDuplicatedError",
+    "SessionExpiredError", "SessionRevokedError",
+    "UserDeactivatedError", "UserDeactivatedBanError",
+}
+
+def session_dc(string):
+    """DC id encoded in a StringSession, read from the first base64 quantum only."""
+    if len(string) < 5 or string[0] != "1":
+        raise ValueError("not a version-1 StringSession")
+    try:
+        return base64.urlsafe_b64decode(string[1:5])[0]
+    except (ValueError, TypeError, IndexError):    # characters outside the alphabet are dropped
+        raise ValueError("not valid base64")
+
+
+async def check_session(string, api_id, api_hash):
+    """Return (status, detail) for one session string: ok, dead, error or invalid."""
+    from telethon import TelegramClient, functions, types
+    from telethon.sessions import StringSession
+
+    try:
+        session = StringSession(string)
+    except Exception as e:
+        return "invalid", f"Not a session string ({type(e).__name__})"
+
+    client = TelegramClient(session, api_id, api_hash, receive_updates=False,
+                            **transports().client_kwargs())
+    try:
+        await client.connect()
+        users = await client(functions.users.GetUsersRequest([types.InputUserSelf()]))
+        return "ok", f"user_id={users[0].id}"
+    except Exception as e:
+        status = "dead" if type(e).__name__ in DEAD_SESSION_ERRORS else "error"
+        return status, explain_error(e)
+    finally:
+        await client.disconnect()
+
+
+async def read_lines(f):
+    """Yield (line number, text) for non-blank, non-comment lines without blocking the loop."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    n = 0
+    while True:
+        line = await loop.run_in_executor(None, f.readline)
+        if not line:
+            return
+        n += 1
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield n, line
+
+
+async def run_check(lines, api_id, api_hash, emit, concurrency=32, per_dc=8):
+    """Validate session strings from `lines`, routed into per-DC worker pools.
+
+    Every DC seen gets a bounded queue and `per_dc` workers, and `concurrency`
+    caps requests in flight across all DCs. The reader waits whenever a queue
+    is full, so memory stays flat however long the input is.
+    """
+    import asyncio
+    inflight = asyncio.Semaphore(concurrency)
+    queues, workers = {}, []
+
+    async def worker(q, dc):
+        while True:
+            item = await q.get()
+            if item is None:
+                return
+            n, string = item
+            async with inflight:
+                status, detail = await check_session(string, api_id, api_hash)
+            emit(n, dc, status, detail)
+
+    async for n, string in lines:
+        try:
+            dc = session_dc(string)
+        except ValueError as e:
+            emit(n, "", "invalid", f"Not a session string ({e})")
+            continue
+        q = queues.get(dc)
+        if q is None:
+            q = queues[dc] = asyncio.Queue(maxsize=per_dc * 2)
+            workers.extend(asyncio.create_task(worker(q, dc)) for _ in range(per_dc))
+        await q.put((n, string))
+
+    for q in queues.values():
+        for _ in range(per_dc):
+            await q.put(None)
+    await asyncio.gather(*workers)
+
+
+def check_main(args):
+    import asyncio
+    src = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    writer = csv.writer(out)
+    writer.writerow(["line", "dc", "status", "detail"])
+    counts = {}
+
+    def emit(n, dc, status, detail):
+        counts[status] = counts.get(status, 0) + 1
+        writer.writerow([n, dc, status, detail])
+        out.flush()
+
+    start = time.monotonic()
+    try:
+        asyncio.run(run_check(read_lines(src), args.api_id, args.api_hash, emit,
+                              args.concurrency, args.per_dc))
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.monotonic() - start
+    summary = ", ".join(f"{v} {k}" for k, v in sorted(counts.items())) or "no sessions"
+    print(f"  {G}✓{R}  Checked in {elapsed:.1f}s — {summary}", file=sys.stderr)
+    if set(counts) - {"ok"}:
+        sys.exit(EXIT_CODES["failed"])
+
+
+# ── Local session store ───────────────────────────────────
+SESSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS sessions (
+    id         INTEGER PRIMARY KEY,
+    phone      TEXT    NOT NULL,
+    user_id    INTEGER,
+    api_id     INTEGER NOT NULL,
+    dc         INTEGER NOT NULL,
+    key_hash   BLOB    NOT NULL UNIQUE,     -- SHA-256 of the auth key
+    sealed     BLOB    NOT NULL,            -- seal()ed session string
+    created_at REAL    NOT NULL,
+    used_at    REAL,                        -- last handed out by `store get`
+    revoked_at REAL                         -- when `watch` found it dead
+);
+CREATE INDEX IF NOT EXISTS sessions_phone   ON sessions (phone);
+CREATE INDEX IF NOT EXISTS sessions_user_id ON sessions (user_id);
+CREATE INDEX IF NOT EXISTS sessions_api_id  ON sessions (api_id);
+CREATE INDEX IF NOT EXISTS sessions_dc      ON sessions (dc);
+"""
+
+
+class DuplicateSessionError(ValueError):
+    """The session's auth key is already in the store."""
+
+
+def session_bytes(string):
+    """The raw dc + ip + port + auth key payload of a StringSession, without telethon."""
+    if not string or string[0] != "1":
+        raise ValueError("not a version-1 StringSession")
+    try:
+        raw = base64.urlsafe_b64decode(string[1:] + "=" * (-len(string[1:]) % 4))
+    except (ValueError, TypeError):
+        raise ValueError("not valid base64")
+    if len(raw) not in (263, 275):
+        raise ValueError("not a StringSession (wrong length)")
+    return raw
+
+
+def session_fields(string):
+    """(dc, server, port, auth key) decoded from a StringSession, without telethon."""
+    import ipaddress
+    raw = session_bytes(string)
+    dc, ip, port, key = struct.unpack(f">B{len(raw) - 259}sH256s", raw)
+    return dc, str(ipaddress.ip_address(ip)), port, key
+
+
+class SessionStore:
+    """Generated sessions in SQLite, indexed by phone, user_id, api_id and DC.
+
+    Session strings carry the auth key, so they are sealed with the same
+    encryption as checkpoints; the indexed columns stay in the clear, so a
+    lookup is an index search rather than a scan. Every row shares one salt,
+    so a TG_SESSION_PASSPHRASE is stretched once per process rather than once
+    per row. key_hash is UNIQUE: the same auth key can't be stored twice.
+    """
+    LOOKUPS = ("phone", "user_id", "api_id", "dc")
+
+    def __init__(self, path=None):
+        import sqlite3
+        self.path = path or state_path("sessions.db")
+        os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))     # owner-only from the start
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SESSION_SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(sessions)")}
+        for column in ("used_at", "revoked_at"):       # stores made before these existed
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE sessions ADD COLUMN {column} REAL")
+        row = self.db.execute("SELECT value FROM meta WHERE name = 'salt'").fetchone()
+        if row is None:
+            with self.db:
+                self.db.execute("INSERT INTO meta VALUES ('salt', ?)", (os.urandom(16),))
+            row = self.db.execute("SELECT value FROM meta WHERE name = 'salt'").fetchone()
+        self.salt = row[0]
+
+    def _insert(self, phone, api_id, session, user_id, verb="INSERT"):
+        dc, _, _, key = session_fields(session)
+        return self.db.execute(
+            f"{verb} INTO sessions (phone, user_id, api_id, dc, key_hash, sealed, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (phone, int(user_id) if user_id else None, int(api_id), dc,
+             hashlib.sha256(key).digest(), seal(session.encode("utf-8"), self.salt), time.time()))
+
+    def add(self, phone, api_id, session, user_id=None):
+        """Store one session and return its row id; DuplicateSessionError if the key is known."""
+        import sqlite3
+        try:
+            with self.db:
+                return self._insert(phone, api_id, session, user_id).lastrowid
+        except sqlite3.IntegrityError:
+            key   = session_fields(session)[3]
+            owner = self.db.execute("SELECT phone FROM sessions WHERE key_hash = ?",
+                                    (hashlib.sha256(key).digest(),)).fetchone()
+            raise DuplicateSessionError(f"this auth key is already stored for {owner[0] if owner else '?'}")
+
+    def import_rows(self, rows):
+        """Add (phone, api_id, session, user_id) rows in one transaction; return (added, duplicates, invalid)."""
+        added = duplicates = invalid = 0
+        with self.db:
+            for phone, api_id, session, user_id in rows:
+                try:
+                    cursor = self._insert(phone, api_id, session, user_id, "INSERT OR IGNORE")
+                except ValueError:
+                    invalid += 1
+                    continue
+                if cursor.rowcount:
+                    added += 1
+                else:
+                    duplicates += 1
+        return added, duplicates, invalid
+
+    def find(self, **where):
+        """Rows matching every given lookup column, newest first, with the session decrypted."""
+        unknown = set(where) - set(self.LOOKUPS)
+        if unknown:
+            raise ValueError(f"can't look up by {', '.join(sorted(unknown))}")
+        clause = " AND ".join(f"{column} = ?" for column in where) or "1"
+        rows = self.db.execute(
+            "SELECT id, phone, user_id, api_id, dc, created_at, revoked_at, sealed FROM sessions "
+            f"WHERE {clause} ORDER BY id DESC", tuple(where.values()))
+        for id_, phone, user_id, api_id, dc, created_at, revoked_at, sealed in rows:
+            yield {"id": id_, "phone": phone, "user_id": user_id, "api_id": api_id, "dc": dc,
+                   "created_at": created_at, "revoked_at": revoked_at,
+                   "session": unseal(sealed).decode("utf-8")}
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def touch(self, ids, when=None):
+        """Record that these sessions were just handed out, so `watch` checks them first."""
+        with self.db:
+            self.db.executemany("UPDATE sessions SET used_at = ? WHERE id = ?",
+                                ((when or time.time(), i) for i in ids))
+
+    def live(self):
+        """(id, dc, last used or created) for every session not yet found revoked."""
+        return self.db.execute("SELECT id, dc, COALESCE(used_at, created_at) FROM sessions "
+                               "WHERE revoked_at IS NULL")
+
+    def session(self, id_):
+        """(phone, api_id, session string) of one row, or None if it's gone."""
+        row = self.db.execute("SELECT phone, api_id, sealed FROM sessions WHERE id = ?", (id_,)).fetchone()
+        return row and (row[0], row[1], unseal(row[2]).decode("utf-8"))
+
+    def revoke(self, id_, when=None):
+        with self.db:
+            self.db.execute("UPDATE sessions SET revoked_at = ? WHERE id = ?", (when or time.time(), id_))
+
+    def close(self):
+        self.db.close()
+
+
+def keeping_sessions():
+    """Whether new sessions go to the local store: only when TG_SESSION_PASSPHRASE is set.
+
+    Without a passphrase the store would be sealed with secret.key from the
+    same directory, which keeps out nobody who can read the store itself.
+    """
+    return bool(os.environ.get("TG_SESSION_PASSPHRASE"))
+
+
+def keep_session(phone, api_id, session, user_id=None):
+    """Save a freshly generated session to the local store, reporting rather than failing."""
+    if not keeping_sessions():
+        info("Not saved to the local session store — set TG_SESSION_PASSPHRASE to keep sessions there")
+        return
+    try:
+        store = SessionStore()
+        try:
+            store.add(phone, api_id, session, user_id)
+        finally:
+            store.close()
+    except Exception as e:
+        warn(f"Not saved to the local session store: {e}")
+        return
+    ok(f"Saved to the local session store  {DIM}(python3 telegram_session.py store get --phone {phone}){R}")
+
+
+STORE_COLUMNS = ["id", "phone", "user_id", "api_id", "dc", "created_at", "revoked_at", "session"]
+
+
+def store_main(args):
+    store = SessionStore(args.db)
+    try:
+        if args.action == "get":
+            where = {k: v for k, v in (("phone", args.phone), ("user_id", args.user_id),
+                                       ("api_id", args.api_id), ("dc", args.dc)) if v is not None}
+            writer, found = csv.writer(sys.stdout), []
+            writer.writerow(STORE_COLUMNS)
+            for row in store.find(**where):
+                writer.writerow([row[c] for c in STORE_COLUMNS])
+                found.append(row["id"])
+            if not found:
+                sys.exit(EXIT_CODES["failed"])
+            store.touch(found)
+        elif args.action == "import":
+            with open(args.file, newline="", encoding="utf-8") as f:
+                rows = [(r.get("phone", ""), r.get("api_id", ""), (r.get("session") or "").strip(),
+                         r.get("user_id")) for r in csv.DictReader(f)]
+            added, duplicates, invalid = store.import_rows(r for r in rows if r[2])
+            ok(f"Imported {added} sessions into {store.path}")
+            if duplicates:
+                warn(f"{duplicates} rejected — their auth key is already stored")
+            if invalid:
+                warn(f"{invalid} rejected — not a session string, or api_id / user_id not a number")
+        elif args.action == "export":
+            # The export holds live session strings — create it owner-only.
+            fd = os.open(args.file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(STORE_COLUMNS)
+                for row in store.find():
+                    writer.writerow([row[c] for c in STORE_COLUMNS])
+            ok(f"Exported {store.count()} sessions to {args.file}")
+    except ValueError as e:
+        warn(f"Can't read {store.path}: {e}")
+        info("Stored sessions are sealed with TG_SESSION_PASSPHRASE (or secret.key) — use the same one.")
+        sys.exit(EXIT_CODES["state"])
+    finally:
+        store.close()
+
+
+# ── Watch mode: keep-alive and revocation watch ───────────
+WATCH_INTERVAL = 900        # seconds between pings of one session
+WATCH_JITTER   = 0.2        # ± share of the interval, so pings don't march in lockstep
+WATCH_RESYNC   = 60         # seconds between re-reads of the store for new or handed-out sessions
+WATCH_RETRY    = 30         # first retry after a network error; doubles, capped at the interval
+
+class SessionWatcher:
+    """Ping every live session in the store on a jittered schedule; queue dead ones for regeneration.
+
+    Per session it holds only an id, a due time and a priority (when it was
+    last handed out by `store get`, else created) — the string stays sealed
+    in the store until its ping goes out. Due sessions wait in a heap ordered
+    by priority and leave it through a token bucket of `rate` pings a second,
+    so when the budget falls short the most recently used are checked first.
+    With budget to spare, a session is found dead within interval × (1 + jitter).
+    """
+    def __init__(self, api_id, api_hash, interval=WATCH_INTERVAL, jitter=WATCH_JITTER, rate=5.0,
+                 concurrency=32, store=None, queue_path=None):
+        import random
+        self.api_id, self.api_hash = api_id, api_hash
+        self.interval, self.jitter = interval, jitter
+        self.rate        = rate
+        self.concurrency = concurrency
+        self.store       = store or SessionStore()
+        self.queue_path  = queue_path or state_path("regenerate.csv")
+        self.rng         = random.Random()
+        self.due         = []       # heap of (due at, id)
+        self.ready       = []       # heap of (-priority, due at, id), waiting for budget
+        self.priority    = {}       # id → last used or created; also the set of watched ids
+        self.failures    = {}       # id → consecutive network errors, only while failing
+        self.tokens      = min(rate, 1.0)
+        self.refilled    = time.monotonic()
+        self.busy        = 0
+        self.pings = self.dead = self.errors = 0
+        self.max_lag     = 0.0      # longest a due ping waited for budget, seconds
+
+    def jittered(self, seconds):
+        return seconds * self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def sync(self, spread=True):
+        """Pick up sessions added to, handed out from or revoked in the store since the last sync."""
+        seen, now = set(), time.time()
+        for id_, dc, priority in self.store.live():
+            seen.add(id_)
+            if id_ not in self.priority:
+                # First pings are spread over one interval rather than all sent at once.
+                heapq.heappush(self.due, (now + (self.rng.uniform(0, self.interval) if spread else 0), id_))
+            self.priority[id_] = priority
+        for id_ in set(self.priority) - seen:
+            del self.priority[id_]          # its heap entry is skipped when it comes due
+
+    def bound(self):
+        """Worst-case seconds from a session dying to being found, or None if the rate can't keep up."""
+        if len(self.priority) > self.rate * self.interval * (1 - self.jitter):
+            return None
+        return self.interval * (1 + self.jitter)
+
+    def _take_token(self):
+        now = time.monotonic()
+        self.tokens   = min(max(self.rate, 1.0), self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def ping(self, id_, due_at, retry=True):
+        self.busy += 1
+        try:
+            row = self.store.session(id_)
+            if row is None:
+                self.priority.pop(id_, None)
+                return
+            phone, api_id, string = row
+            self.max_lag = max(self.max_lag, time.time() - due_at)
+            start = time.monotonic()
+            # Each session is pinged under the api_id it was made with. A signed-in
+            # session never sends its api_hash, so ours stands in for any app's.
+            status, detail = await check_session(string, api_id, self.api_hash)
+            metrics().observe("ping", time.monotonic() - start, failed=status == "error")
+            self.pings += 1
+            if status == "ok":
+                self.failures.pop(id_, None)
+                heapq.heappush(self.due, (time.time() + self.jittered(self.interval), id_))
+            elif status == "error":
+                self.errors += 1
+                n = self.failures[id_] = self.failures.get(id_, 0) + 1
+                if retry:
+                    backoff = min(self.interval, WATCH_RETRY * 2 ** (n - 1))
+                    heapq.heappush(self.due, (time.time() + self.jittered(backoff), id_))
+                warn(f"{phone}  session {id_} couldn't be checked: {detail}")
+            else:
+                self.dead += 1
+                self.failures.pop(id_, None)
+                self.priority.pop(id_, None)
+                self.store.revoke(id_)
+                self.queue(phone, api_id, detail)
+                warn(f"{phone}  session {id_} is {status}: {detail} — queued for regeneration")
+        finally:
+            self.busy -= 1
+
+    def queue(self, phone, api_id, reason):
+        """Append a batch-manifest row for the account; api_hash is only known for our own api_id."""
+        new = not os.path.exists(self.queue_path)
+        fd  = os.open(self.queue_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        with open(fd, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if new:
+                writer.writerow(["api_id", "api_hash", "phone", "reason", "detected_at"])
+            writer.writerow([api_id, self.api_hash if api_id == self.api_id else "", phone, reason,
+                             time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())])
+
+    async def run(self, once=False, report=None):
+        """Watch until cancelled; with once=True, ping every live session one time and return."""
+        import asyncio
+        self.sync(spread=not once)
+        next_sync, tasks = time.time() + WATCH_RESYNC, set()
+        while True:
+            now = time.time()
+            if now >= next_sync and not once:
+                self.sync()
+                next_sync = now + WATCH_RESYNC
+                if report:
+                    report(self)
+            while self.due and self.due[0][0] <= now:
+                due_at, id_ = heapq.heappop(self.due)
+                if id_ in self.priority:
+                    heapq.heappush(self.ready, (-self.priority[id_], due_at, id_))
+            while self.ready and len(tasks) < self.concurrency and self._take_token():
+                _, due_at, id_ = heapq.heappop(self.ready)
+                task = asyncio.ensure_future(self.ping(id_, due_at, retry=not once))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if once and not self.ready and not tasks:
+                return
+            wake = self.due[0][0] - now if self.due and not once else 1.0
+            if self.ready:
+                wake = min(wake, (1 - self.tokens) / self.rate)
+            await asyncio.sleep(min(1.0, max(0.01, wake)))
+
+
+def watch_main(args):
+    import asyncio
+    step("W", "Watching stored sessions")
+    store   = SessionStore(args.db)
+    watcher = SessionWatcher(args.api_id, args.api_hash, args.interval, args.jitter, args.rate,
+                             args.concurrency, store, args.queue)
+    live = sum(1 for _ in store.live())
+    info(f"{live} live sessions in {store.path}")
+    if not args.once:
+        info(f"Each is pinged every {args.interval:g}s ± {args.jitter:.0%}, at most {args.rate:g} pings/s overall")
+        if live > args.rate * args.interval * (1 - args.jitter):
+            warn(f"{args.rate:g} pings/s can't cover {live} sessions every {args.interval:g}s — the least "
+                 f"recently used will be checked less often (that needs "
+                 f"{live / args.interval / (1 - args.jitter):.1f} pings/s)")
+        else:
+            info(f"A revoked session is found within {args.interval * (1 + args.jitter):.0f}s "
+                 f"and queued in {watcher.queue_path}")
+
+    def report(w):
+        info(f"{len(w.priority)} watched · {w.pings} pings · {w.dead} dead · {w.errors} errors · "
+             f"{len(w.ready)} waiting for budget · worst lag {w.max_lag:.1f}s")
+        metrics().save()
+
+    try:
+        asyncio.run(watcher.run(args.once, report))
+    finally:
+        metrics().save()
+        store.close()
+    report(watcher)
+    if watcher.dead:
+        ok(f"{watcher.dead} dead sessions queued — regenerate them with: "
+           f"python3 telegram_session.py batch {watcher.queue_path}")
+    if args.once and (watcher.dead or watcher.errors):
+        sys.exit(EXIT_CODES["failed"])
+
+
+# ── Bulk session codec ────────────────────────────────────
+# A pack is a 16-byte header and then one fixed-width record per session, so
+# record i sits at a known offset and a memory map can be read in place:
+#   header  magic "TGSP", version, record size, record count
+#   record  dc (1) · ip length, 4 or 16 (1) · port (2) · ip, zero-padded (16) · auth key (256)
+PACK_MAGIC   = b"TGSP"
+PACK_VERSION = 1
+PACK_HEADER  = struct.Struct(">4sHHQ")
+PACK_RECORD  = struct.Struct(">BBH16s256s")
+PACK_FIELDS  = struct.Struct(">BBH")      # the record's leading fixed fields
+PACK_CHUNK   = 4096         # records buffered per write when building a pack
+SQLITE_SESSION_SCHEMA = """
+CREATE TABLE version (version integer primary key);
+CREATE TABLE sessions (dc_id integer primary key, server_address text, port integer,
+                       auth_key blob, takeout_id integer);
+CREATE TABLE entities (id integer primary key, hash integer not null, username text,
+                       phone integer, name text, date integer);
+CREATE TABLE sent_files (md5_digest blob, file_size integer, type integer, id integer,
+                         hash integer, primary key(md5_digest, file_size, type));
+CREATE TABLE update_state (id integer primary key, pts integer, qts integer, date integer, seq integer);
+INSERT INTO version VALUES (7);
+"""
+
+
+def write_pack(path, records):
+    """Write (dc, ip bytes, port, auth key) records to a pack; return how many were written.
+
+    The count in the header is filled in at the end, so `records` can be a
+    generator over an input of any size. The ip and key may be memoryviews;
+    they are copied once, straight into the write buffer.
+    """
+    size, count, records = PACK_RECORD.size, 0, iter(records)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)     # auth keys — owner-only
+    with open(fd, "wb") as f:
+        f.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, size, 0))
+        for batch in iter(lambda: list(itertools.islice(records, PACK_CHUNK)), []):
+            buf = memoryview(bytearray(size * len(batch)))      # zeroed, so IPv4 addresses come padded
+            for at, (dc, ip, port, key) in zip(range(0, len(buf), size), batch):
+                PACK_FIELDS.pack_into(buf, at, dc, len(ip), port)
+                buf[at + 4:at + 4 + len(ip)] = ip
+                buf[at + 20:at + size] = key
+            f.write(buf)
+            count += len(batch)
+        f.seek(0)
+        f.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, PACK_RECORD.size, count))
+    return count
+
+
+def string_records(strings, invalid=None):
+    """Records for write_pack() from StringSessions; unparseable ones are counted in invalid[0].
+
+    The ip and auth key are memoryview slices of the decoded string, not copies.
+    """
+    for string in strings:
+        try:
+            raw = memoryview(session_bytes(string.strip()))
+        except ValueError:
+            if invalid is not None:
+                invalid[0] += 1
+            continue
+        yield raw[0], raw[1:-258], (raw[-258] << 8) | raw[-257], raw[-256:]
+
+
+def sqlite_records(paths):
+    """Records for write_pack() from telethon .session files (the DC they were last saved on)."""
+    import sqlite3, ipaddress
+    for path in paths:
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            row = db.execute("SELECT dc_id, server_address, port, auth_key FROM sessions").fetchone()
+        finally:
+            db.close()
+        if row and row[3]:
+            yield row[0], ipaddress.ip_address(row[1]).packed, row[2], row[3]
+
+
+class SessionPack:
+    """A pack file, memory-mapped read-only.
+
+    Records are read through memoryview slices of the map, so nothing is
+    copied until a caller asks for a string. dc_ids() reads the DC byte of
+    every record with one strided slice rather than a loop.
+    """
+    def __init__(self, path):
+        import mmap
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < PACK_HEADER.size:
+                raise ValueError("not a session pack (too short)")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, width, self.count = PACK_HEADER.unpack_from(self._map)
+        if magic != PACK_MAGIC or version != PACK_VERSION or width != PACK_RECORD.size:
+            self._map.close()
+            raise ValueError("not a session pack, or from an incompatible version")
+        if size < PACK_HEADER.size + self.count * width:
+            self._map.close()
+            raise ValueError("session pack is truncated")
+        self.view = memoryview(self._map)[PACK_HEADER.size:PACK_HEADER.size + self.count * width]
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, i):
+        return self.view[i * PACK_RECORD.size:(i + 1) * PACK_RECORD.size]
+
+    def address(self, i):
+        """(dc, ip bytes, port) of record i."""
+        r = self.record(i)
+        return r[0], bytes(r[4:4 + r[1]]), (r[2] << 8) | r[3]
+
+    def auth_key(self, i):
+        return self.record(i)[20:]
+
+    def dc_ids(self):
+        """Every record's DC id, as one bytes object: dc_ids()[i] is record i's DC."""
+        return self.view[::PACK_RECORD.size].tobytes()
+
+    def group_by_dc(self):
+        """{dc: array of record indices}, bucketed in one pass over dc_ids()."""
+        from array import array
+        ids    = self.dc_ids()
+        groups = {dc: array("L") for dc in set(ids)}
+        append = {dc: indices.append for dc, indices in groups.items()}
+        for i, dc in enumerate(ids):
+            append[dc](i)
+        return groups
+
+    def string(self, i):
+        """Record i as a StringSession string."""
+        r = self.record(i)
+        ip_end = 4 + r[1]
+        raw = b"".join((r[0:1], r[4:ip_end], r[2:4], r[20:]))
+        return "1" + base64.urlsafe_b64encode(raw).decode("ascii")
+
+    def strings(self):
+        return map(self.string, range(self.count))
+
+    def write_sqlite(self, i, path):
+        """Record i as a telethon SQLite .session file at `path` (schema 7; telethon upgrades it)."""
+        import sqlite3, ipaddress
+        dc, ip, port = self.address(i)
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+        db = sqlite3.connect(path)
+        try:
+            db.executescript(SQLITE_SESSION_SCHEMA)
+            with db:
+                db.execute("INSERT INTO sessions VALUES (?, ?, ?, ?, NULL)",
+                           (dc, str(ipaddress.ip_address(ip)), port, self.auth_key(i)))
+        finally:
+            db.close()
+
+    def close(self):
+        self.view.release()
+        self._map.close()
+
+
+def pack_main(args):
+    if args.action == "encode":
+        invalid = [0]
+        f = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+        with f:
+            count = write_pack(args.pack, string_records(filter(str.strip, f), invalid))
+        ok(f"Packed {count} sessions into {args.pack}")
+        if invalid[0]:
+            warn(f"{invalid[0]} lines skipped — not a session string")
+        return
+    if args.action == "from-sqlite":
+        count = write_pack(args.pack, sqlite_records(args.files))
+        ok(f"Packed {count} of {len(args.files)} .session files into {args.pack}")
+        return
+    try:
+        pack = SessionPack(args.pack)
+    except (OSError, ValueError) as e:
+        warn(f"Can't read {args.pack}: {e}")
+        sys.exit(EXIT_CODES["usage"])
+    with pack:
+        if args.action == "decode":
+            fd  = os.open(args.output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600) if args.output else None
+            out = open(fd, "w", encoding="utf-8") if fd is not None else sys.stdout
+            try:
+                out.writelines(s + "\n" for s in pack.strings())
+            finally:
+                if fd is not None:
+                    out.close()
+        elif args.action == "to-sqlite":
+            os.makedirs(args.dir, mode=0o700, exist_ok=True)
+            for i in range(len(pack)):
+                pack.write_sqlite(i, os.path.join(args.dir, f"{i:0{len(str(len(pack)))}d}.session"))
+            ok(f"Wrote {len(pack)} .session files to {args.dir}")
+        elif args.action == "stats":
+            groups = pack.group_by_dc()
+            ok(f"{len(pack)} sessions in {args.pack}")
+            for dc in sorted(groups):
+                info(f"DC {dc}: {len(groups[dc])}")
+
+
+# ── Session broker daemon ─────────────────────────────────
+BROKER_CODE_TTL = 600       # seconds a requested code stays claimable in the broker
+
+
+class ClientPool:
+    """Connected, not-yet-authorised clients per (api_id, api_hash, DC).
+
+    Each client has already done its TCP connect and auth-key handshake, so a
+    provision request starts straight at send_code_request. A taken client
+    leaves the pool for good — it becomes the new account's session — and
+    the pool is topped back up to `size` in the background.
+    """
+    def __init__(self, size=2):
+        self.size    = size
+        self.idle    = {}       # (api_id, api_hash, dc) → connected clients
+        self.filling = {}       # (api_id, api_hash, dc) → clients still connecting
+        self.hits = self.misses = 0
+        self._tasks  = set()
+
+    async def _connect(self, api_id, api_hash, dc):
+        from telethon import TelegramClient
+        from telethon.sessions import StringSession
+        client = TelegramClient(StringSession(), api_id, api_hash, flood_sleep_threshold=0,
+                                receive_updates=False, **transports().client_kwargs())
+        client.session.set_dc(dc, *dc_address(dc, transports().family()))
+        with metrics().time("connect"):
+            await client.connect()
+        config_cache().prime(client)
+        return client
+
+    async def _add(self, key):
+        try:
+            client = await self._connect(*key)
+        except Exception:
+            return              # take() connects inline next time and reports the error
+        finally:
+            self.filling[key] -= 1
+        self.idle.setdefault(key, []).append(client)
+
+    def warm(self, api_id, api_hash, dcs):
+        import asyncio
+        for dc in dcs:
+            key = (api_id, api_hash, dc)
+            for _ in range(self.size - len(self.idle.get(key, ())) - self.filling.get(key, 0)):
+                self.filling[key] = self.filling.get(key, 0) + 1
+                task = asyncio.ensure_future(self._add(key))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def take(self, api_id, api_hash, dc):
+        """A connected client for `dc`, from the pool if one is ready."""
+        idle, client = self.idle.get((api_id, api_hash, dc), []), None
+        while idle and client is None:
+            client = idle.pop()
+            if not client.is_connected():
+                await client.disconnect()
+                client = None
+        if client:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.warm(api_id, api_hash, [dc])
+        return client or await self._connect(api_id, api_hash, dc)
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        for clients in self.idle.values():
+            for client in clients:
+                await client.disconnect()
+        self.idle.clear()
+
+
+class PendingSignIn:
+    """A provisioned phone waiting for its sign_in: the client, the sent code and the tries so far."""
+    def __init__(self, client, sent, api_id, started):
+        self.client   = client
+        self.sent     = sent
+        self.api_id   = api_id
+        self.started  = started
+        self.stage    = "code"
+        self.tries    = 0
+        self.pw_tries = 0
+
+
+class SessionBroker:
+    """The `serve` daemon: provision, sign_in, resend and validate as JSON lines.
+
+    One request per line, one reply per line. Every reply has "ok"; failures
+    carry the same plain-English "error" text as batch mode, a "reason" a
+    client can branch on, and "retry_after" for FloodWaits, which go through
+    the FloodScheduler like everywhere else. With a `token` (by default
+    TG_SESSION_BROKER_TOKEN), every request must carry it as "token".
+    provision requests the code with a warm pooled client and holds it until
+    sign_in supplies the code (and the 2FA password, if the account has one).
+    """
+    def __init__(self, pool_size=2, token=None):
+        self.token     = token or os.environ.get("TG_SESSION_BROKER_TOKEN")
+        self.pool      = ClientPool(pool_size)
+        self.dcs       = DcCache()
+        self.floods    = FloodScheduler()
+        self.passwords = PasswordChecker()
+        self.store     = SessionStore() if keeping_sessions() else None
+        self.pending   = {}     # phone → PendingSignIn
+        self.served    = 0
+        self.ops = {"provision": self.provision, "sign_in": self.sign_in, "resend": self.resend,
+                    "validate": self.validate, "stats": self.stats}
+
+    async def handle(self, reader, writer):
+        import asyncio
+        try:
+            while line := await reader.readline():
+                reply = await self.dispatch(line)
+                writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, line):
+        self.served += 1
+        try:
+            request = json.loads(line)
+            if self.token and not hmac.compare_digest(str(request.get("token", "")).encode("utf-8"),
+                                                      self.token.encode("utf-8")):
+                return {"ok": False, "reason": "unauthorized",
+                        "error": "Missing or wrong token — send the broker's TG_SESSION_BROKER_TOKEN as \"token\""}
+            op = self.ops.get(request.get("op"))
+            if op is None:
+                return {"ok": False, "reason": "bad_request",
+                        "error": f"Unknown op — use one of: {', '.join(self.ops)}"}
+            return await op(request)
+        except (DuplicateSessionError, SealError) as e:
+            return self.failure(e)      # the broker's own state, not the request
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return {"ok": False, "reason": "bad_request", "error": f"Bad request: {type(e).__name__}: {e}"}
+        except Exception as e:
+            return self.failure(e)
+
+    @staticmethod
+    def reason(e):
+        """What kind of failure `e` is, for a reply's "reason"."""
+        from telethon.errors import RPCError, FloodWaitError, FloodPremiumWaitError
+        if isinstance(e, (FloodWaitError, FloodPremiumWaitError)):
+            return "rate_limited"
+        if isinstance(e, RPCError):
+            return "telegram"
+        if isinstance(e, DuplicateSessionError):
+            return "duplicate"
+        if isinstance(e, SealError):
+            return "state"
+        return "internal"
+
+    def failure(self, e, phone=None, api_id=None):
+        from telethon.errors import FloodWaitError, FloodPremiumWaitError
+        reply = {"ok": False, "reason": self.reason(e), "error": explain_error(e), "type": type(e).__name__}
+        if isinstance(e, (FloodWaitError, FloodPremiumWaitError)):
+            if phone:
+                self.floods.penalise(phone, api_id, e.seconds)
+            reply["retry_after"] = e.seconds
+        return reply
+
+    def delivery(self, sent):
+        return {"delivery": type(sent.type).__name__, "length": getattr(sent.type, "length", None),
+                "next": type(sent.next_type).__name__ if sent.next_type else None,
+                "timeout": sent.timeout}
+
+    async def drop(self, phone):
+        pending = self.pending.pop(phone, None)
+        if pending:
+            await pending.client.disconnect()
+        self.passwords.forget(phone)
+
+    async def sweep(self):
+        import asyncio
+        while True:
+            await asyncio.sleep(30)
+            now = time.monotonic()
+            for phone, pending in list(self.pending.items()):
+                if now - pending.started > BROKER_CODE_TTL:
+                    await self.drop(phone)
+
+    async def provision(self, request):
+        from telethon.errors import NetworkMigrateError, PhoneMigrateError, UserMigrateError
+        phone, api_id, api_hash = str(request["phone"]), int(request["api_id"]), str(request["api_hash"])
+        until = self.floods.blocked_until(phone, api_id)
+        if until > time.time():
+            return {"ok": False, "reason": "rate_limited",
+                    "error": f"Rate limited for another {until - time.time():.0f}s",
+                    "retry_after": int(until - time.time()) + 1}
+        await self.drop(phone)
+        dc = self.dcs.lookup(phone) or 2
+        for attempt in range(3):
+            client = await self.pool.take(api_id, api_hash, dc)
+            try:
+                with metrics().time("send_code"):
+                    sent = await client.send_code_request(phone)
+                break
+            except (NetworkMigrateError, PhoneMigrateError, UserMigrateError) as e:
+                # Another pooled client already sits on the home DC — no _switch_dc().
+                await client.disconnect()
+                if attempt == 2:
+                    raise
+                dc = e.new_dc
+            except Exception as e:
+                await client.disconnect()
+                return self.failure(e, phone, api_id)
+        self.dcs.learn(phone, dc)
+        self.dcs.save()
+        self.pending[phone] = PendingSignIn(client, sent, api_id, time.monotonic())
+        return {"ok": True, "phone": phone, "dc": dc, **self.delivery(sent)}
+
+    async def resend(self, request):
+        phone   = str(request["phone"])
+        pending = self.pending.get(phone)
+        if pending is None or pending.stage != "code":
+            return {"ok": False, "reason": "no_sign_in",
+                    "error": "No code is waiting for this phone — send provision first"}
+        try:
+            with metrics().time("send_code"):
+                pending.sent = await pending.client.resend_code_request(phone, pending.sent.phone_code_hash)
+        except Exception as e:
+            await self.drop(phone)
+            return self.failure(e, phone, pending.api_id)
+        pending.started = time.monotonic()
+        return {"ok": True, "phone": phone, **self.delivery(pending.sent)}
+
+    async def sign_in(self, request):
+        from telethon.errors import SessionPasswordNeededError, PhoneCodeInvalidError, PasswordHashInvalidError
+        from telethon.tl import types
+        phone   = str(request["phone"])
+        pending = self.pending.get(phone)
+        if pending is None:
+            return {"ok": False, "reason": "no_sign_in",
+                    "error": "No sign-in is waiting for this phone (or it expired) — send provision first"}
+        code = str(request.get("code") or "").strip()
+        if pending.stage == "code" and not code:
+            # telethon's sign_in() would take an empty code as a request for a new one.
+            return {"ok": False, "reason": "bad_request", "error": "Bad request: sign_in needs the code"}
+        m = metrics()
+        try:
+            if pending.stage == "code":
+                pending.tries += 1
+                try:
+                    with m.time("sign_in"):
+                        user = await pending.client.sign_in(phone, code,
+                                                            phone_code_hash=pending.sent.phone_code_hash)
+                except SessionPasswordNeededError:
+                    pending.stage = "password"
+            if pending.stage == "password":
+                if not request.get("password"):
+                    return {"ok": False, "reason": "password_needed", "password_needed": True,
+                            "error": "2FA is enabled — send sign_in again with the password"}
+                with m.time("password"):
+                    user = await self.passwords.check_async(pending.client, phone, str(request["password"]))
+            if not isinstance(user, types.User):
+                raise TypeError(f"sign_in() returned {type(user).__name__}, not the signed-in user")
+        except PhoneCodeInvalidError as e:
+            if pending.tries >= MAX_CODE_TRIES:
+                await self.drop(phone)
+            return self.failure(e)
+        except PasswordHashInvalidError as e:
+            pending.pw_tries += 1
+            if pending.pw_tries >= MAX_PASSWORD_TRIES:
+                await self.drop(phone)
+            return self.failure(e)
+        except Exception as e:
+            await self.drop(phone)
+            return self.failure(e, phone, pending.api_id)
+        session = pending.client.session.save()
+        await self.drop(phone)
+        m.save()
+        reply = {"ok": True, "phone": phone, "user_id": getattr(user, "id", None), "session": session}
+        if self.store:
+            try:
+                reply["stored"] = self.store.add(phone, pending.api_id, session, reply["user_id"])
+            except ValueError as e:
+                reply.update(store_error=str(e), store_reason=self.reason(e))
+        return reply
+
+    async def validate(self, request):
+        string = str(request["session"])
+        status, detail = await check_session(string, int(request["api_id"]), str(request["api_hash"]))
+        return {"ok": True, "status": status, "detail": detail}
+
+    async def stats(self, request):
+        return {"ok": True, "served": self.served, "pending": len(self.pending),
+                "pool_hits": self.pool.hits, "pool_misses": self.pool.misses,
+                "idle_clients": sum(len(c) for c in self.pool.idle.values())}
+
+    async def close(self):
+        for phone in list(self.pending):
+            await self.drop(phone)
+        await self.pool.close()
+        self.passwords.close()
+        if self.store:
+            self.store.close()
+        self.dcs.save()
+        self.floods.save()
+        metrics().save()
+
+
+def serve_main(args):
+    import asyncio
+    import socket
+    if bool(args.api_id) != bool(args.api_hash):
+        warn("--api-id and --api-hash go together")
+        sys.exit(EXIT_CODES["usage"])
+    broker = SessionBroker(args.pool)
+    if args.port and not broker.token:
+        # Any local user can reach a TCP port, and replies carry live sessions.
+        warn("--port needs a shared token: set TG_SESSION_BROKER_TOKEN, and send it as \"token\" "
+             "in every request")
+        sys.exit(EXIT_CODES["usage"])
+
+    async def serve():
+        if args.port:
+            server = await asyncio.start_server(broker.handle, "127.0.0.1", args.port)
+            where  = f"127.0.0.1:{args.port}"
+        else:
+            where = args.socket or state_path("broker.sock")
+            with socket.socket(socket.AF_UNIX) as probe:
+                try:
+                    probe.connect(where)
+                except OSError:
+                    pass
+                else:
+                    warn(f"A broker is already listening on {where}")
+                    sys.exit(EXIT_CODES["usage"])
+            if os.path.exists(where):
+                os.remove(where)        # stale socket from a broker that didn't shut down
+            # Replies carry live session strings, so the socket is created
+            # owner-only rather than chmod-ed once it is already listening.
+            umask = os.umask(0o177)
+            try:
+                server = await asyncio.start_unix_server(broker.handle, where)
+            finally:
+                os.umask(umask)
+        if args.api_id:
+            broker.pool.warm(args.api_id, args.api_hash,
+                             {2} | {entry["dc"] for entry in broker.dcs.entries.values()})
+        ok(f"Session broker listening on {where}  {DIM}({args.pool} warm clients per api_id and DC){R}")
+        sweeper = asyncio.ensure_future(broker.sweep())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            sweeper.cancel()
+            await broker.close()
+
+    asyncio.run(serve())
+
+
+def race_main(args):
+    import asyncio
+    step("R", f"Racing every transport to DC {args.dc}")
+    results = asyncio.run(probe_transports(args.api_id, args.api_hash, args.dc, args.timeout))
+    for seconds, transport, family, error in sorted(results, key=lambda r: (r[0] is None, r[0] or 0)):
+        shown = f"{seconds:6.3f}s" if seconds is not None else f"{RE}failed{R}  {DIM}{error}{R}"
+        print(f"  {transport:<13} {family:<5} {shown}")
+    finished = [r for r in results if r[0] is not None]
+    if not finished:
+        warn("No transport could reach Telegram from this network")
+        sys.exit(EXIT_CODES["network"])
+    seconds, transport, family, _ = min(finished)
+    transports().learn(transport, family, seconds)
+    ok(f"{transport}/{family} is fastest here — batch, check and serve will use it on this network")
+
+
+def metrics_main(args):
+    m = metrics()
+    if args.reset:
+        m.phases = {}
+        m.save()
+        ok("Latency history cleared")
+        return
+    report = m.report()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        ok(f"JSON report written to {args.json}")
+    if args.prom:
+        with open(args.prom, "w", encoding="utf-8") as f:
+            f.write(m.prometheus())
+        ok(f"Prometheus metrics written to {args.prom}")
+    if args.json or args.prom:
+        return
+
+    print(f"\n  {C}── Provisioning latency, all runs so far ────────────────{R}")
+    print(f"  {DIM}{'phase':<20} {'count':>6} {'errors':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}{R}")
+    fmt = lambda v: f"{v:.3f}s" if v is not None else "—"
+    for name, p in report["phases"].items():
+        print(f"  {name:<20} {p['count']:>6} {p['errors']:>6} {fmt(p['p50']):>8} "
+              f"{fmt(p['p90']):>8} {fmt(p['p99']):>8} {fmt(p['max']):>8}")
+    if not report["phases"]:
+        info("Nothing recorded yet — run the script or a batch first.")
+    print(f"  {C}─────────────────────────────────────────────────────────{R}\n")
+
+
+# ── Trace record and replay ──────────────────────────────
+# A trace is JSON Lines appended to an owner-only file: a header line, one
+# line per step of the auth flow, then an end line with the exit code. Steps
+# are the connect and DC-switch markers plus every RPC the client sends, with
+# monotonic offsets, durations and TL sizes. Secrets never reach the file.
+TRACE_SECRET_KEYS = {       # replaced by a placeholder of the same length
+    "phone_code", "phone_code_hash", "api_hash", "password", "first_name", "last_name",
+    "username", "email", "future_auth_token", "access_hash",
+}
+TRACE_PHONE_KEYS  = {"phone", "phone_number"}   # masked to the country code and last two digits
+# Other bytes are kept as their length only. The 2FA challenge's public
+# parameters stay so replay can redo the SRP maths; the answer (A, M1), which
+# could be tested against password guesses, does not.
+TRACE_KEEP_BYTES  = {"salt1", "salt2", "p", "srp_B"}
+
+TRACE = None                # this run's TraceRecorder, when --trace is given
+
+
+def mask_phone(phone):
+    digits = str(phone).lstrip("+")
+    prefix = phone_prefix("+" + digits)
+    return prefix + "•" * max(0, len(digits) - len(prefix) - 1) + digits[-2:]
+
+
+def trace_value(value, key=None):
+    """A TL object, or anything inside one, as redacted JSON-ready data that trace_object() rebuilds."""
+    from telethon.tl.tlobject import TLObject
+    if value is None or isinstance(value, bool):
+        return value
+    if key in TRACE_PHONE_KEYS and isinstance(value, str):
+        return {"masked": mask_phone(value)}
+    if key in TRACE_SECRET_KEYS and isinstance(value, (int, str, bytes)):
+        if isinstance(value, int):
+            return 0
+        if key == "phone_code_hash":        # still tells one code request from the next
+            return {"redacted": "h" + hashlib.sha256(value.encode("utf-8")).hexdigest()[:15]}
+        if isinstance(value, bytes):
+            return {"redacted": "•" * len(value), "bytes": True}
+        return {"redacted": "•" * len(value)}
+    if isinstance(value, TLObject):
+        data = {"_": type(value).__name__, "#": value.CONSTRUCTOR_ID}
+        for name in value.to_dict():
+            if name != "_":
+                data[name] = trace_value(getattr(value, name), name)
+        return data
+    if isinstance(value, (list, tuple)):
+        return [trace_value(v, key) for v in value]
+    if isinstance(value, bytes):
+        return {"b64": base64.b64encode(value).decode("ascii")} if key in TRACE_KEEP_BYTES else {"len": len(value)}
+    if hasattr(value, "timestamp"):
+        return {"date": value.timestamp()}
+    return value
+
+
+def trace_object(data):
+    """Rebuild what trace_value() recorded, with placeholders where the secrets were."""
+    import datetime
+    from telethon.tl.alltlobjects import tlobjects
+    if isinstance(data, list):
+        return [trace_object(v) for v in data]
+    if not isinstance(data, dict):
+        return data
+    if "#" in data:
+        return tlobjects[data["#"]](**{k: trace_object(v) for k, v in data.items() if k not in ("_", "#")})
+    if "masked" in data:
+        return data["masked"]
+    if "redacted" in data:
+        return data["redacted"].encode("utf-8") if data.get("bytes") else data["redacted"]
+    if "b64" in data:
+        return base64.b64decode(data["b64"])
+    if "len" in data:
+        return bytes(data["len"])
+    if "date" in data:
+        return datetime.datetime.fromtimestamp(data["date"], datetime.timezone.utc)
+    return data
+
+
+def tl_size(value):
+    if isinstance(value, (list, tuple)):
+        return sum(tl_size(v) or 0 for v in value)
+    try:
+        return len(bytes(value))
+    except TypeError:
+        return None
+
+
+def trace_error(e):
+    capture = getattr(e, "new_dc", None) or getattr(e, "seconds", None)
+    return {"error": type(e).__name__, "message": str(e), **({"capture": capture} if capture else {})}
+
+
+def rebuild_error(data):
+    import builtins
+    from telethon import errors
+    cls = getattr(errors, data["error"], None)
+    if isinstance(cls, type) and issubclass(cls, errors.RPCError):
+        try:
+            return cls(None, data["capture"]) if "capture" in data else cls(None)
+        except TypeError:
+            return cls(None, data["message"])
+    cls = getattr(builtins, data["error"], None)
+    if isinstance(cls, type) and issubclass(cls, Exception):
+        return cls(data["message"])
+    return RuntimeError(f"{data['error']}: {data['message']}")
+
+
+class TraceRecorder:
+    """Appends one run's auth exchange to a trace file, through the client attach() returns."""
+    def __init__(self, path):
+        self.path    = path
+        self.started = None
+        self._file   = None
+        self._lock   = threading.Lock()     # RPCs are recorded from a BackgroundClient's loop thread
+
+    def _write(self, record):
+        with self._lock:
+            if self._file is None:
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+                self._file = open(fd, "a", encoding="utf-8")
+            self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._file.flush()
+
+    def attach(self, client, phone, api_id):
+        from telethon.tl.alltlobjects import LAYER
+        self.started = time.monotonic()
+        self._write({"trace": 1, "at": round(time.time(), 3), "layer": LAYER,
+                     "phone": mask_phone(phone), "api_id": int(api_id)})
+        return TracedClient(client, self)
+
+    def step(self, op, start, dc=None, **fields):
+        self._write({"t": round(start - self.started, 4), "op": op,
+                     "dur": round(time.monotonic() - start, 4), "dc": dc, **fields})
+
+    def rpc(self, request, start, dc, result=None, error=None):
+        fields = {"req": trace_value(request), "req_bytes": tl_size(request)}
+        if error is not None:
+            fields["err"] = trace_error(error)
+        else:
+            fields.update(res=trace_value(result), res_bytes=tl_size(result))
+        self.step(type(request).__name__, start, dc, **fields)
+
+    def close(self, exit_code):
+        if self.started is not None:
+            self._write({"t": round(time.monotonic() - self.started, 4), "op": "end", "exit": exit_code})
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class TracedClient:
+    """A telethon.sync or BackgroundClient whose connect, DC switches and RPCs go into a TraceRecorder.
+
+    RPCs are caught at the client's _call(), which every high-level method
+    and raw request goes through, so the exact TL request and response are
+    recorded whichever way generate_session() asked.
+    """
+    def __init__(self, client, recorder):
+        self._traced   = client
+        self._recorder = recorder
+
+    def _hook(self):
+        inner    = self._traced._client if isinstance(self._traced, BackgroundClient) else self._traced
+        original = inner._call
+        recorder = self._recorder
+
+        async def _call(sender, request, ordered=False, flood_sleep_threshold=None):
+            start = time.monotonic()
+            try:
+                result = await original(sender, request, ordered, flood_sleep_threshold)
+            except Exception as e:
+                recorder.rpc(request, start, inner.session.dc_id, error=e)
+                raise
+            recorder.rpc(request, start, inner.session.dc_id, result)
+            return result
+        inner._call = _call
+
+    def connect(self):
+        start = time.monotonic()
+        try:
+            saved = self._traced.connect()
+        except Exception as e:
+            self._recorder.step("connect", start, err=trace_error(e))
+            raise
+        extra = {"transport": self._traced.transport, "handshake": round(self._traced.handshake, 4)} \
+            if saved is not None else {}
+        self._recorder.step("connect", start, self._traced.session.dc_id, **extra)
+        self._hook()
+        return saved
+
+    def _switch_dc(self, dc):
+        start = time.monotonic()
+        try:
+            switch_dc(self._traced, dc)
+        except Exception as e:
+            self._recorder.step("migrate", start, dc, err=trace_error(e))
+            raise
+        self._recorder.step("migrate", start, self._traced.session.dc_id)
+
+    def __call__(self, request):
+        return self._traced(request)
+
+    def __getattr__(self, name):
+        return getattr(self._traced, name)
+
+
+def read_traces(path):
+    """[(header, steps)] for every trace appended to `path`, oldest first."""
+    traces = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "trace" in record:
+                traces.append((record, []))
+            elif traces:
+                traces[-1][1].append(record)
+    return traces
+
+
+class ReplayDivergence(BaseException):
+    """The replayed flow asked for a step the rest of the trace doesn't have.
+
+    A BaseException, so generate_session()'s catch-all handlers don't turn it
+    into an ordinary failure that could pass for the recorded one.
+    """
+
+
+class ReplayClient:
+    """Plays a trace back to generate_session() through the telethon.sync client interface.
+
+    Each call takes the next recorded step of its kind, waits until that step
+    finished in the recording (scaled by `speed`; 0 doesn't wait at all) and
+    returns the recorded response or raises the recorded error. Steps the
+    replayed flow doesn't ask for are skipped, and their time still passes.
+    """
+    _config = None
+
+    def __init__(self, steps, speed=1.0):
+        from telethon.crypto import AuthKey
+        from telethon.sessions import StringSession
+        self.steps   = steps
+        self.speed   = speed
+        self.next    = 0
+        self.skipped = []
+        self.session = StringSession()
+        dc = next((s["dc"] for s in steps if s.get("dc")), 2)
+        self.session.set_dc(dc, *dc_address(dc))
+        self.session.auth_key = AuthKey(os.urandom(256))    # the recorded key is never in the trace
+        self.started = time.monotonic()
+
+    def until_next(self):
+        """Seconds until the next step started in the recording — the user's think time, for a source."""
+        if not self.speed or self.next >= len(self.steps):
+            return 0.0
+        return max(0.0, self.started + self.steps[self.next]["t"] / self.speed - time.monotonic())
+
+    def _take(self, op):
+        while self.next < len(self.steps):
+            step = self.steps[self.next]
+            self.next += 1
+            if self.speed:
+                time.sleep(max(0.0, self.started + (step["t"] + step["dur"]) / self.speed - time.monotonic()))
+            if step.get("dc") and step["dc"] != self.session.dc_id:
+                self.session.set_dc(step["dc"], *dc_address(step["dc"]))
+            if step["op"] != op:
+                self.skipped.append(step["op"])
+                continue
+            if "err" in step:
+                raise rebuild_error(step["err"])
+            return trace_object(step.get("res"))
+        raise ReplayDivergence(f"the flow asked for {op}, but the trace has none left")
+
+    def connect(self):
+        self._take("connect")
+
+    def disconnect(self):
+        pass
+
+    def _switch_dc(self, dc):
+        self._take("migrate")
+
+    def send_code_request(self, phone, force_sms=False):
+        return self._take("SendCodeRequest")
+
+    def resend_code_request(self, phone, phone_code_hash):
+        return self._take("ResendCodeRequest")
+
+    def sign_in(self, phone=None, code=None, *, password=None, phone_code_hash=None):
+        result = self._take("SignInRequest")
+        return getattr(result, "user", result)
+
+    def _on_login(self, user):
+        return user
+
+    def __call__(self, request):
+        return self._take(type(request).__name__)
+
+
+class ReplayCodeSource(CodeSource):
+    """Answers every prompt of a replay after the think time the recording shows."""
+    scripted = True
+
+    def __init__(self, replay):
+        self.replay = replay
+
+    async def code(self, phone, sent):
+        import asyncio
+        await asyncio.sleep(self.replay.until_next())
+        return "1" * (getattr(sent.type, "length", None) or 5)
+
+    async def password(self, phone):
+        import asyncio
+        await asyncio.sleep(self.replay.until_next())
+        return "replay"
+
+
+def replay_main(args):
+    global STATE_DIR
+    import tempfile
+    try:
+        traces = read_traces(args.file)
+        header, steps = traces[args.index]
+    except (OSError, ValueError, IndexError) as e:
+        fatal(f"Can't read trace {args.index} from {args.file}: {e}",
+              "Record one with  python3 telegram_session.py --trace FILE  (or --trace FILE new …).",
+              error="usage")
+    check_telethon()
+    from telethon.tl.alltlobjects import LAYER
+    if header["layer"] != LAYER:
+        warn(f"Recorded under API layer {header['layer']}, replaying under {LAYER} — responses may not rebuild")
+    # Checkpoints, caches, metrics and the store written during a replay go
+    # to a scratch directory, not yours.
+    STATE_DIR = tempfile.mkdtemp(prefix="tg-replay-")
+    end      = next((s for s in steps if s["op"] == "end"), None)
+    steps    = [s for s in steps if s["op"] != "end"]
+    recorded = end["t"] if end else (steps[-1]["t"] + steps[-1]["dur"] if steps else 0.0)
+    step("R", f"Replaying {len(steps)} steps for {header['phone']} recorded "
+              f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(header['at']))}"
+              + (f" at {args.speed:g}× speed" if args.speed else " without waiting"))
+
+    client, exit_code = ReplayClient(steps, args.speed), 0
+    start = time.monotonic()
+    try:
+        generate_session(header["phone"], header["api_id"], "0" * 32, client, codes=ReplayCodeSource(client))
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+    except ReplayDivergence as e:
+        warn(f"The flow diverged from the trace: {e}")
+        exit_code = None
+    elapsed = time.monotonic() - start
+
+    info(f"Replayed in {elapsed:.2f}s — recorded {recorded:.2f}s; "
+         f"{client.next - len(client.skipped)} of {len(steps)} steps asked for"
+         + (f", skipped {', '.join(client.skipped)}" if client.skipped else ""))
+    if exit_code is None:
+        sys.exit(EXIT_CODES["failed"])
+    if end is None:
+        warn("The recording has no end line (it was killed), so there is no outcome to compare")
+    elif exit_code == end["exit"]:
+        ok(f"Same outcome as the recording (exit {exit_code})")
+    else:
+        warn(f"Different outcome: exit {exit_code} here, {end['exit']} in the recording")
+        sys.exit(EXIT_CODES["failed"])
+
+
+# ── Profiling ────────────────────────────────────────────
+PROFILE_INTERVAL = 0.005    # seconds between stack samples
+PROFILE_TOP      = 25       # functions listed in the summary
+
+# Where a leaf frame's time goes, by file and then by function. Waits are
+# listed too: a sampler sees a thread blocked on the network the same way
+# it sees one computing.
+PROFILE_CATEGORIES = (
+    ("telethon/crypto/", "crypto"), ("telethon/password", "crypto"), ("hashlib", "crypto"),
+    ("telethon/tl/", "tl serialization"), ("telethon/extensions/binary", "tl serialization"),
+    ("selectors.py", "waiting (network / idle loop)"), ("threading.py", "waiting (threads)"),
+    ("queue.py", "waiting (threads)"), ("concurrent/futures/", "waiting (threads)"),
+    ("telethon/network/", "telethon network"), ("asyncio/", "asyncio"),
+)
+OWN_CATEGORIES = dict.fromkeys(
+    ("clear", "step", "ok", "info", "warn", "fatal", "ask", "banner", "dump_sent", "decode_code_type",
+     "print_result", "wait_out", "get_api_credentials", "get_phone", "emit"), "terminal (output and prompts)")
+OWN_CATEGORIES.update(dict.fromkeys(("srp_answer", "generate_auth_key", "seal", "unseal", "_derive_seal_keys"),
+                                    "crypto"))
+
+def profile_category(filename, function):
+    if filename.endswith("telegram_session.py") and function in OWN_CATEGORIES:
+        return OWN_CATEGORIES[function]
+    for fragment, category in PROFILE_CATEGORIES:
+        if fragment in filename:
+            return category
+    return "other"
+
+
+class StackSampler:
+    """Sample every thread's Python stack at a fixed interval, for --profile.
+
+    A daemon thread reads sys._current_frames(), so nothing is instrumented
+    and the code under test runs at full speed apart from the GIL hand-offs.
+    Each sample counts towards its full stack (for a flamegraph) and towards
+    the innermost frame's function (for self time). Work done in worker
+    processes — batch 2FA hashing, the auth-key pool — isn't seen.
+    """
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks   = {}      # "thread;file:function;…" → samples
+        self.leaves   = {}      # (file, function) → samples as the innermost frame
+        self.samples  = 0
+        self._done    = threading.Event()
+        self._thread  = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._done.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                leaf  = (frame.f_code.co_filename, frame.f_code.co_name)
+                stack = []
+                while frame is not None:
+                    stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                key = ";".join([names.get(ident, "thread").replace(";", ",")] + stack[::-1])
+                self.stacks[key]  = self.stacks.get(key, 0) + 1
+                self.leaves[leaf] = self.leaves.get(leaf, 0) + 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+
+    def collapsed(self):
+        """Brendan Gregg's collapsed-stack format: flamegraph.pl, speedscope and inferno read it."""
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(self.stacks.items()))
+
+    def summary(self, wall, cpu, phases, phase_cpu, top=PROFILE_TOP):
+        lines = [f"wall {wall:.3f}s   process CPU {cpu:.3f}s   "
+                 f"{self.samples} samples every {self.interval * 1000:.0f} ms", ""]
+        lines += ["Per phase (wall vs process CPU):",
+                  f"  {'phase':<20} {'wall':>9} {'cpu':>9} {'cpu/wall':>9}"]
+        for phase, seconds in phases.items():
+            used = phase_cpu.get(phase)
+            if used is None:
+                continue
+            share = f"{used / seconds:8.0%}" if seconds else "       —"
+            lines.append(f"  {phase:<20} {seconds:8.3f}s {used:8.3f}s {share:>9}")
+        categories = {}
+        for (filename, function), n in self.leaves.items():
+            category = profile_category(filename, function)
+            categories[category] = categories.get(category, 0) + n
+        lines += ["", "Self time by category (all threads):"]
+        lines += [f"  {category:<32} {n * self.interval:8.3f}s"
+                  for category, n in sorted(categories.items(), key=lambda c: -c[1])]
+        lines += ["", f"Top {top} functions by self time (all threads):",
+                  f"  {'self':>9}  {'samples':>7}  function"]
+        for (filename, function), n in sorted(self.leaves.items(), key=lambda l: -l[1])[:top]:
+            lines.append(f"  {n * self.interval:8.3f}s  {n:>7}  {function}  "
+                         f"({os.path.basename(filename)}, {profile_category(filename, function)})")
+        return "\n".join(lines) + "\n"
+
+
+def run_profiled(prefix, fn, *args):
+    """Run fn(*args) under a StackSampler; write PREFIX.collapsed and PREFIX.txt however it ends."""
+    sampler = StackSampler()
+    wall, cpu = time.monotonic(), time.process_time()
+    sampler.start()
+    try:
+        return fn(*args)
+    finally:
+        sampler.stop()
+        wall, cpu = time.monotonic() - wall, time.process_time() - cpu
+        m = metrics()
+        with open(prefix + ".collapsed", "w", encoding="utf-8") as f:
+            f.write(sampler.collapsed())
+        with open(prefix + ".txt", "w", encoding="utf-8") as f:
+            f.write(sampler.summary(wall, cpu, m.run, m.cpu))
+        print(f"\n  Profile: {prefix}.txt (summary), {prefix}.collapsed "
+              f"(flamegraph.pl / speedscope)", file=sys.stderr)
+
+
+def cli(argv):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="telegram_session.py",
+        description="Run with no arguments for the interactive, step-by-step walkthrough.",
+    )
+    parser.add_argument("--profile", metavar="PREFIX",
+                        help="sample the run's stacks and write PREFIX.collapsed (for flamegraphs) and "
+                             "PREFIX.txt (top functions by self time, CPU vs wall per phase); "
+                             "with no command, profiles the walkthrough")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="append the auth exchange (timings, TL requests and responses, secrets "
+                             "redacted) to FILE as JSON Lines, for  replay ; with no command, traces "
+                             "the walkthrough")
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("batch", help="provision many accounts from a CSV manifest")
+    p.add_argument("manifest", help="CSV file with api_id, api_hash, phone columns")
+    p.add_argument("-o", "--output", default="sessions.csv",
+                   help="CSV to write results to (default: sessions.csv)")
+    p.add_argument("-j", "--concurrency", type=int, default=8,
+                   help="accounts in flight at once (default: 8)")
+    p.add_argument("--codes", metavar="SOURCES",
+                   help="take codes from these comma-separated sources instead of prompting: "
+                        "DIR or dir:DIR (DIR/<phone>.code, 2FA from DIR/<phone>.password), "
+                        "pipe:PATH, http:PORT, telegram (a stored session of the same account)")
+    p.add_argument("--max-wait", type=int, default=3600, metavar="SECONDS",
+                   help="longest FloodWait to park an account for before failing it (default: 3600)")
+    p.add_argument("--srp-workers", type=int, default=0, metavar="N",
+                   help="worker processes for the 2FA password maths (default: one per CPU)")
+    p.add_argument("--key-pool", type=int, default=0, metavar="N",
+                   help="keep N pre-negotiated auth keys ready per api_id and DC, generated "
+                        "in worker processes (default: 0, off)")
+    p.add_argument("--fps", type=float, default=BOARD_FPS,
+                   help=f"most redraws per second of the live table (default: {BOARD_FPS})")
+    p.add_argument("--plain", action="store_true",
+                   help="print a line per account and a summary every "
+                        f"{BOARD_INTERVAL}s instead of the live table")
+    p.set_defaults(func=batch_main)
+
+    p = sub.add_parser("check", help="report which existing session strings are still valid")
+    p.add_argument("input", nargs="?", default="-",
+                   help="file with one session string per line (default: stdin)")
+    p.add_argument("--api-id", type=int, required=True, help="any api_id you own")
+    p.add_argument("--api-hash", required=True, help="the matching api_hash")
+    p.add_argument("-o", "--output", default="-",
+                   help="CSV to write one result line per session to (default: stdout)")
+    p.add_argument("-j", "--concurrency", type=int, default=32,
+                   help="checks in flight across all DCs (default: 32)")
+    p.add_argument("--per-dc", type=int, default=8,
+                   help="workers per data centre (default: 8)")
+    p.set_defaults(func=check_main)
+
+    p = sub.add_parser("new", help="generate one session from arguments, without the walkthrough")
+    p.add_argument("--api-id", required=True, help="your App api_id")
+    p.add_argument("--api-hash", required=True, help="your App api_hash")
+    p.add_argument("--phone", required=True, help="the account's number, with + and the country code")
+    p.add_argument("--codes", metavar="SOURCES",
+                   help="take the code from these sources (as for batch --codes) instead of stdin")
+    p.add_argument("--jsonl", action="store_true",
+                   help="machine mode: one JSON event per line on stdout, no prompts or colour; "
+                        "the code and 2FA password are read as lines from stdin when asked for")
+    p.set_defaults(func=new_main)
+
+    p = sub.add_parser("resume", help="continue a sign-in that was interrupted after the code was sent")
+    p.add_argument("phone", nargs="?", help="which sign-in to resume, if more than one is waiting")
+    p.set_defaults(func=resume_main)
+
+    p = sub.add_parser("store", help="look up, import or export sessions in the local store")
+    p.add_argument("--db", metavar="PATH", help="store to use (default: ~/.telegram-session/sessions.db)")
+    actions = p.add_subparsers(dest="action", required=True)
+    a = actions.add_parser("get", help="print matching sessions as CSV (newest first)")
+    a.add_argument("--phone")
+    a.add_argument("--user-id", type=int)
+    a.add_argument("--api-id", type=int)
+    a.add_argument("--dc", type=int)
+    a = actions.add_parser("import", help="add sessions from a CSV with phone, api_id, session "
+                                          "(and optionally user_id) columns, e.g. batch output")
+    a.add_argument("file")
+    a = actions.add_parser("export", help="write every stored session to an owner-only CSV")
+    a.add_argument("file")
+    p.set_defaults(func=store_main)
+
+    p = sub.add_parser("watch", help="ping stored sessions on a schedule and queue revoked ones "
+                                     "for regeneration")
+    p.add_argument("--api-id", type=int, required=True,
+                   help="your api_id; dead sessions made with it are queued with --api-hash filled in")
+    p.add_argument("--api-hash", required=True, help="the matching api_hash")
+    p.add_argument("--interval", type=float, default=WATCH_INTERVAL, metavar="SECONDS",
+                   help=f"time between pings of one session (default: {WATCH_INTERVAL})")
+    p.add_argument("--jitter", type=float, default=WATCH_JITTER,
+                   help=f"spread each interval by ± this fraction (default: {WATCH_JITTER})")
+    p.add_argument("--rate", type=float, default=5.0, help="pings per second across all sessions (default: 5)")
+    p.add_argument("-j", "--concurrency", type=int, default=32, help="pings in flight (default: 32)")
+    p.add_argument("--db", metavar="PATH", help="store to watch (default: ~/.telegram-session/sessions.db)")
+    p.add_argument("--queue", metavar="PATH",
+                   help="batch manifest to append dead accounts to "
+                        "(default: ~/.telegram-session/regenerate.csv)")
+    p.add_argument("--once", action="store_true",
+                   help="ping every live session once, then exit (10 if any was dead or unreachable)")
+    p.set_defaults(func=watch_main)
+
+    p = sub.add_parser("pack", help="convert sessions in bulk between strings, a fixed-width binary "
+                                    "pack and telethon .session files")
+    actions = p.add_subparsers(dest="action", required=True)
+    a = actions.add_parser("encode", help="pack session strings, one per line")
+    a.add_argument("input", help="file of session strings (- for stdin)")
+    a.add_argument("pack", help="pack file to write")
+    a = actions.add_parser("decode", help="print a pack's sessions as strings, one per line")
+    a.add_argument("pack")
+    a.add_argument("-o", "--output", help="write to this owner-only file instead of stdout")
+    a = actions.add_parser("to-sqlite", help="write one telethon .session file per packed session")
+    a.add_argument("pack")
+    a.add_argument("dir", help="directory for the .session files")
+    a = actions.add_parser("from-sqlite", help="pack telethon .session files")
+    a.add_argument("pack", help="pack file to write")
+    a.add_argument("files", nargs="+", metavar="FILE.session")
+    a = actions.add_parser("stats", help="count a pack's sessions per DC")
+    a.add_argument("pack")
+    p.set_defaults(func=pack_main)
+
+    p = sub.add_parser("serve", help="run a daemon that provisions and validates on request")
+    p.add_argument("--socket", metavar="PATH",
+                   help="Unix socket to listen on (default: ~/.telegram-session/broker.sock)")
+    p.add_argument("--port", type=int, help="listen on 127.0.0.1:PORT instead of a Unix socket")
+    p.add_argument("--pool", type=int, default=2,
+                   help="connected clients kept ready per api_id and DC (default: 2)")
+    p.add_argument("--api-id", type=int, help="warm the pool for this api_id at startup")
+    p.add_argument("--api-hash", help="the matching api_hash")
+    p.set_defaults(func=serve_main)
+
+    p = sub.add_parser("race", help="time every transport and address family, and remember the fastest")
+    p.add_argument("--api-id", type=int, required=True, help="any api_id you own")
+    p.add_argument("--api-hash", required=True, help="the matching api_hash")
+    p.add_argument("--dc", type=int, default=2, choices=sorted(DC_ADDRESSES), help="DC to race to (default: 2)")
+    p.add_argument("--timeout", type=float, default=10, help="seconds before a transport counts as failed")
+    p.set_defaults(func=race_main)
+
+    p = sub.add_parser("replay", help="run the auth flow against a recorded --trace instead of Telegram")
+    p.add_argument("file", metavar="TRACE", help="trace file written by --trace")
+    p.add_argument("--index", type=int, default=-1,
+                   help="which trace in the file, counting from 0 (default: -1, the last one)")
+    p.add_argument("--speed", type=float, default=1.0,
+                   help="time scale: 1 keeps the recorded timing, 2 halves it, 0 doesn't wait (default: 1)")
+    p.set_defaults(func=replay_main)
+
+    p = sub.add_parser("metrics", help="show or export per-phase latency across runs")
+    p.add_argument("--json", metavar="FILE", help="write a JSON report with p50/p90/p99 per phase")
+    p.add_argument("--prom", metavar="FILE", help="write Prometheus text-format histograms")
+    p.add_argument("--reset", action="store_true", help="clear the recorded history")
+    p.set_defaults(func=metrics_main)
+
+    args = parser.parse_args(argv)
+    if args.command is None and not (args.profile or args.trace):
+        parser.error("a command is required (or run with no arguments for the walkthrough)")
+    run = main if args.command is None else lambda: args.func(args)
+    if args.trace:
+        global TRACE
+        TRACE = TraceRecorder(args.trace)
+    exit_code = 0
+    try:
+        if args.profile:
+            run_profiled(args.profile, run)
+        else:
+            run()
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+        raise
+    except KeyboardInterrupt:
+        exit_code = 130
+        raise
+    except BaseException:
+        exit_code = 1
+        raise
+    finally:
+        if TRACE:
+            TRACE.close(exit_code)
+            TRACE = None
+
+
+# ── Main ─────────────────────────────────────────────────
+def main():
+    banner()
+    check_telethon()
+    api_id, api_hash = get_api_credentials()
+    client = BackgroundClient(api_id, api_hash)
+    phone = get_phone()
+    session_string = generate_session(phone, api_id, api_hash, client)
+    print_result(api_id, api_hash, session_string)
+
+if __name__ == "__main__":
+    try:
+        if len(sys.argv) > 1:
+            cli(sys.argv[1:])
+        else:
+            main()
     except KeyboardInterrupt:
+        if JSONL:
+            emit("error", error="cancelled", message="Cancelled", exit=EXIT_CODES["cancelled"])
+            sys.exit(EXIT_CODES["cancelled"])
         print(f"\n\n  {Y}Cancelled.{R}\n")
+        if Checkpoint.pending():
+            print(f"  {DIM}A sign-in is still waiting for its code — run  "
+                  f"python3 telegram_session.py resume  to pick it up.{R}\n")
         sys.exit(0)
@@ -0,0 +1,47 @@
+import os, sys, tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# STATE_DIR is read when telegram_session is imported, so point it at a
+# scratch directory first: the tests never touch your ~/.telegram-session.
+os.environ["TG_SESSION_HOME"] = tempfile.mkdtemp(prefix="tg-session-tests-")
+for name in ("TG_SESSION_PASSPHRASE", "TG_SESSION_BROKER_TOKEN", "TG_SESSION_CODES", "TG_SESSION_CODE_TOKEN"):
+    os.environ.pop(name, None)
+sys.path[:0] = [ROOT, os.path.join(ROOT, "bench")]
+
+import fake_telegram
+import telegram_session
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    """A fresh state directory for every test, so caches never leak between them."""
+    path = tmp_path / "state"
+    monkeypatch.setattr(telegram_session, "STATE_DIR", str(path))
+    monkeypatch.setattr(telegram_session, "_metrics", None)
+    monkeypatch.setattr(telegram_session, "_transports", None)
+    monkeypatch.setattr(telegram_session, "_config_cache", None)
+    monkeypatch.setattr(telegram_session, "_delivery", None)
+    return path
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """The offline fake in place of telethon.TelegramClient, with no latency."""
+    import socket, telethon, telethon.sync
+    monkeypatch.setattr(telethon, "TelegramClient", telethon.TelegramClient)
+    monkeypatch.setattr(telethon.sync, "TelegramClient", telethon.sync.TelegramClient)
+    monkeypatch.setattr(socket.socket, "connect", socket.socket.connect)
+    monkeypatch.setattr(fake_telegram.FakeClient, "_config", None)
+    b = fake_telegram.FakeBackend(latency=0, jitter=0, handshake=0, seed=1)
+    fake_telegram.install(b)
+    return b
+
+
+def session_string(dc=2, ip=bytes((149, 154, 167, 51)), port=443, key=None):
+    """A well-formed StringSession with a random auth key."""
+    import base64, struct
+    raw = struct.pack(f">B{len(ip)}sH256s", dc, ip, port, key or os.urandom(256))
+    return "1" + base64.urlsafe_b64encode(raw).decode("ascii")
@@ -0,0 +1,66 @@
+import asyncio, threading, time
+
+import pytest
+import telethon
+
+import telegram_session as ts
+
+
+class SlowClient:
+    """Just enough of TelegramClient: a handshake that takes a while, and a few calls."""
+    def __init__(self, session, api_id, api_hash, **kwargs):
+        self.session, self.api_id, self.threads, self.connected = session, api_id, [], False
+
+    async def connect(self):
+        await asyncio.sleep(0.2)
+        self.connected = True
+
+    async def send_code_request(self, phone):
+        self.threads.append(threading.get_ident())
+        return f"sent to {phone}"
+
+    async def __call__(self, request):
+        return ("called", request)
+
+    def is_connected(self):
+        return self.connected
+
+    async def disconnect(self):
+        self.connected = False
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(telethon, "TelegramClient", SlowClient)
+    client = ts.BackgroundClient(1, "a" * 32)
+    yield client
+    if client._loop.is_running():
+        client.disconnect()
+
+
+def test_handshake_runs_while_the_caller_is_blocked(client):
+    time.sleep(0.3)             # the phone prompt
+    start = time.monotonic()
+    overlapped = client.connect()
+    assert time.monotonic() - start < 0.1
+    assert client.handshake >= 0.2 and overlapped > 0.15
+
+
+def test_connect_waits_for_a_handshake_still_in_progress(client):
+    overlapped = client.connect()
+    assert overlapped < 0.1 and client.is_connected()
+
+
+def test_calls_run_on_the_loop_thread_and_block_for_their_result(client):
+    client.connect()
+    assert client.send_code_request("+447700900001") == "sent to +447700900001"
+    assert client("request") == ("called", "request")
+    assert client.api_id == 1
+    assert client._client.threads and client._client.threads[0] != threading.get_ident()
+
+
+def test_disconnect_stops_the_loop(client):
+    client.connect()
+    client.disconnect()
+    time.sleep(0.05)
+    assert not client._client.connected and not client._loop.is_running()
@@ -0,0 +1,161 @@
+import asyncio, csv, os, stat, time
+from types import SimpleNamespace
+
+import pytest
+from telethon.errors import FloodWaitError
+
+import fake_telegram
+import telegram_session as ts
+
+HASH = "a" * 32
+
+
+def write_manifest(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["api_id", "api_hash", "phone"])
+        writer.writerows(rows)
+    return str(path)
+
+
+def test_read_manifest_flags_bad_rows_with_their_line(tmp_path):
+    path = write_manifest(tmp_path / "accounts.csv", [
+        ("12345", HASH, "+447700900001"),
+        ("12x45", HASH, "+447700900002"),
+        ("12345", "short", "+447700900003"),
+        ("12345", HASH, "447700900004"),
+        (" 12345 ", f" {HASH} ", " +447700900005 "),
+    ])
+    jobs = list(ts.read_manifest(path))
+    assert [(j.api_id, j.phone, j.error) for j in jobs[:1]] == [(12345, "+447700900001", "")]
+    assert jobs[1].error.startswith("line 3: api_id") and jobs[1].api_id == 0
+    assert jobs[2].error.startswith("line 4: api_hash")
+    assert jobs[3].error.startswith("line 5: phone")
+    assert (jobs[4].api_id, jobs[4].api_hash, jobs[4].phone, jobs[4].error) == (12345, HASH, "+447700900005", "")
+
+
+def test_run_batch_caps_accounts_in_flight_and_skips_bad_rows(monkeypatch):
+    flight, seen = {"now": 0, "peak": 0}, []
+
+    async def provision(job, source, *args):
+        flight["now"] += 1
+        flight["peak"] = max(flight["peak"], flight["now"])
+        await asyncio.sleep(0.01)
+        flight["now"] -= 1
+        job.session = "session"
+        return job
+
+    monkeypatch.setattr(ts, "provision", provision)
+    jobs = [ts.Job(1, HASH, f"+4477009000{i:02}") for i in range(20)]
+    jobs[3].error = "line 5: phone must start with +"
+    asyncio.run(ts.run_batch(jobs, ts.PromptCodeSource(), concurrency=4, on_done=seen.append))
+    assert flight["peak"] == 4
+    assert sorted(j.phone for j in seen) == sorted(j.phone for j in jobs)
+    assert not jobs[3].session and all(j.session for j in jobs if j is not jobs[3])
+
+
+def test_run_batch_pulls_the_manifest_lazily(monkeypatch):
+    pulled = []
+
+    async def provision(job, source, *args):
+        # Only the jobs the two workers hold can have been read so far.
+        assert len(pulled) - sum(bool(j.session) for j in pulled) <= 2
+        await asyncio.sleep(0)
+        job.session = "session"
+
+    def manifest():
+        for i in range(10):
+            job = ts.Job(1, HASH, f"+44770090000{i}")
+            pulled.append(job)
+            yield job
+
+    monkeypatch.setattr(ts, "provision", provision)
+    asyncio.run(ts.run_batch(manifest(), ts.PromptCodeSource(), concurrency=2))
+    assert len(pulled) == 10 and all(j.session for j in pulled)
+
+
+def test_dir_code_source_takes_a_fresh_code_once(tmp_path):
+    source = ts.DirCodeSource(str(tmp_path), timeout=0.3, poll=0.01)
+    (tmp_path / "447700900001.code").write_text("12345\n")
+    (tmp_path / "447700900001.password").write_text("hunter2\n")
+    sent = SimpleNamespace(timeout=None)
+    assert asyncio.run(source.code("+447700900001", sent)) == "12345"
+    assert not (tmp_path / "447700900001.code").exists()
+    assert asyncio.run(source.password("+447700900001")) == "hunter2"
+    assert asyncio.run(source.password("+447700900002")) is None
+
+
+def test_dir_code_source_ignores_a_stale_code(tmp_path):
+    source = ts.DirCodeSource(str(tmp_path), timeout=0.1, poll=0.01)
+    stale = tmp_path / "447700900001.code"
+    stale.write_text("12345")
+    os.utime(stale, (time.time() - 60, time.time() - 60))
+    assert asyncio.run(source.code("+447700900001", SimpleNamespace(timeout=None))) is None
+    assert stale.exists()
+
+
+def test_explain_error_adds_the_wait():
+    assert ts.explain_error(FloodWaitError(None, capture=30)) == \
+        "FloodWaitError: Rate limited by Telegram — wait 30s"
+    assert ts.explain_error(KeyError("x")) == "KeyError: 'x'"
+
+
+def test_batch_main_writes_an_owner_only_csv_and_fails_on_any_error(tmp_path, monkeypatch, capsys):
+    async def provision(job, source, *args):
+        if job.phone.endswith("2"):
+            job.error = "PhoneNumberBannedError: Account banned from Telegram"
+        else:
+            job.session = "1session"
+
+    monkeypatch.setattr(ts, "provision", provision)
+    manifest = write_manifest(tmp_path / "accounts.csv", [("1", HASH, "+447700900001"),
+                                                          ("1", HASH, "+447700900002")])
+    output = tmp_path / "sessions.csv"
+    with pytest.raises(SystemExit) as exit:
+        ts.cli(["batch", manifest, "-o", str(output), "--codes", str(tmp_path)])
+    assert exit.value.code == ts.EXIT_CODES["failed"]
+    assert stat.S_IMODE(os.stat(output).st_mode) == 0o600
+    with open(output, newline="", encoding="utf-8") as f:
+        rows = {r["phone"]: r for r in csv.DictReader(f)}
+    assert rows["+447700900001"]["status"] == "ok" and rows["+447700900001"]["session"] == "1session"
+    assert rows["+447700900002"]["status"] == "failed" and "banned" in rows["+447700900002"]["error"]
+
+
+# ── Against the fake backend ──────────────────────────────
+def test_provision_signs_in_against_the_fake(backend):
+    job = asyncio.run(ts.provision(ts.Job(1, HASH, "+447700900001"), fake_telegram.FakeCodeSource(backend)))
+    assert job.error == "" and ts.session_dc(job.session) == 2
+
+
+def test_provision_handles_2fa_migrations_and_wrong_sources(backend):
+    backend.password_rate = backend.migrate_rate = 1
+    dcs = ts.DcCache()
+    job = asyncio.run(ts.provision(ts.Job(1, HASH, "+447700900001"), fake_telegram.FakeCodeSource(backend), dcs))
+    assert job.error == "" and ts.session_dc(job.session) == backend.home_dc("+447700900001")
+    assert dcs.entries["+44"]["dc"] == backend.home_dc("+447700900001")
+
+    class NoPassword(fake_telegram.FakeCodeSource):
+        async def password(self, phone):
+            return None
+
+    job = asyncio.run(ts.provision(ts.Job(1, HASH, "+447700900002"), NoPassword(backend), dcs))
+    assert job.error.startswith("SessionPasswordNeededError") and not job.session
+
+
+def test_provision_reports_a_flood_wait(backend):
+    backend.flood_rate, backend.flood_seconds = 1, 42
+    job = asyncio.run(ts.provision(ts.Job(1, HASH, "+447700900001"), fake_telegram.FakeCodeSource(backend)))
+    assert job.flood_wait == 42 and job.error.endswith("wait 42s") and not job.session
+
+
+def test_run_batch_provisions_a_manifest_against_the_fake(backend, tmp_path):
+    backend.password_rate, backend.migrate_rate = 0.1, 0.3     # 2FA costs a real PBKDF2 each
+    manifest = write_manifest(tmp_path / "accounts.csv",
+                              [("1", HASH, f"+4477009{i:05}") for i in range(20)] + [("x", HASH, "+1")])
+    done = []
+    asyncio.run(ts.run_batch(ts.read_manifest(manifest), fake_telegram.FakeCodeSource(backend),
+                             concurrency=8, on_done=done.append))
+    assert len(done) == 21
+    signed_in = [j for j in done if j.session]
+    assert len(signed_in) == 20 and len({j.session for j in signed_in}) == 20
+    assert [j.error[:7] for j in done if not j.session] == ["line 22"]
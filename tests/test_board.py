@@ -0,0 +1,165 @@
+import asyncio, io, os, re, shutil, sys
+
+import pytest
+
+import telegram_session as ts
+
+MOVE = re.compile(r"\033\[(\d+);(\d+)H")
+
+
+class Screen(io.StringIO):
+    """A terminal stand-in that remembers each write separately."""
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+        return super().write(text)
+
+    def isatty(self):
+        return True
+
+    def cells(self, since=0):
+        """(row, column) of every cell written by writes[since:], 0-based."""
+        return {(int(r) - 1, int(c) - 1) for w in self.writes[since:] for r, c in MOVE.findall(w)}
+
+
+@pytest.fixture
+def screen(monkeypatch):
+    size = {"now": os.terminal_size((80, 24))}
+    monkeypatch.setattr(shutil, "get_terminal_size", lambda *a: size["now"])
+    monkeypatch.setattr(sys, "stdout", sys.stdout)      # start() takes it over
+    screen = Screen()
+    screen.size = size
+    return screen
+
+
+def jobs(n):
+    return [ts.Job(1, "a" * 32, f"+4477009{i:05}") for i in range(n)]
+
+
+def board(screen):
+    b = ts.BatchBoard(live=True, out=screen)
+    b.cells = lambda cells=b.cells: [c for c in cells() if c[0] != 0]   # row 0 ticks with the clock
+    return b
+
+
+@pytest.mark.parametrize("seconds, text", [(0, "0s"), (59.9, "59s"), (61, "1m01s"), (3725, "1h02m"), (-3, "0s")])
+def test_short_duration(seconds, text):
+    assert ts.short_duration(seconds) == text
+
+
+def test_only_changed_cells_are_redrawn(screen):
+    b = board(screen)
+    first = jobs(3)
+    for job in first:
+        b.add(job)
+    b.draw()
+    everything = screen.cells()
+    assert len(everything) > 20
+
+    mark = len(screen.writes)
+    b.draw()
+    assert screen.cells(mark) == set()
+
+    first[1].phase = "code_wait"
+    b.draw()
+    assert screen.cells(mark) == {(2 + b.slot[id(first[1])], 18)}
+
+
+def test_a_finished_job_frees_its_row_for_a_hidden_one(screen):
+    screen.size["now"] = os.terminal_size((80, 12))     # 12 - 3 log rows - 3 = 6 job rows
+    b = board(screen)
+    many = jobs(8)
+    for job in many:
+        b.add(job)
+    b.draw()
+    assert len(b.rows) == 6 and len(b.hidden) == 2
+    assert "+2 more" in screen.getvalue()
+    many[0].session = "s"
+    b.remove(many[0])
+    assert b.rows[0] is many[6] and (b.done, b.ok) == (1, 1)
+    many[7].error = "failed"
+    b.remove(many[7])                       # done before it ever got a row
+    assert b.failed == 1 and not any(job is many[7] for job in b.rows)
+
+
+def test_parking_is_counted_and_undone(screen):
+    b = board(screen)
+    [job] = jobs(1)
+    b.add(job)
+    b.park(job, until=0)
+    assert b.parked == 1 and "1 parked" in b.summary()
+    b.add(job)
+    assert b.parked == 0 and job.phase == ""
+    b.park(job, until=0)
+    b.remove(job)
+    assert b.parked == 0 and b.active == {}
+
+
+def test_a_resize_redraws_everything(screen):
+    b = board(screen)
+    for job in jobs(2):
+        b.add(job)
+    b.draw()
+    screen.size["now"] = os.terminal_size((100, 30))
+    mark = len(screen.writes)
+    b.draw()
+    assert "\033[2J" in "".join(screen.writes[mark:]) and len(screen.cells(mark)) > 20
+
+
+def test_cells_are_cut_at_the_edge(screen):
+    screen.size["now"] = os.terminal_size((30, 24))
+    b = board(screen)
+    b.add(jobs(1)[0])
+    assert all(column + len(text) <= 30 for _, column, text in b.cells())
+
+
+def test_prints_go_to_the_log_pane_and_come_back_after(screen):
+    b = board(screen)
+    b.start()
+    print("first line")
+    ts.ok("second")
+    assert "first line" not in "".join(w for w in screen.writes if not MOVE.search(w))
+    b.stop()
+    tail = screen.writes[-2:]
+    assert sys.stdout is not b and "first line\n" in tail[-1] and "second" in tail[-1]
+
+
+def test_log_overflow_is_reported(screen):
+    b = board(screen)
+    b.start()
+    for i in range(ts.BOARD_LOG + 5):
+        print(f"line {i}")
+    b.stop()
+    assert "5 earlier lines" in screen.getvalue()
+
+
+def test_without_a_terminal_summary_lines_are_printed(capsys):
+    b = ts.BatchBoard(out=io.StringIO(), interval=0.01)
+    assert not b.live
+
+    async def run():
+        task = asyncio.ensure_future(b.run())
+        await asyncio.sleep(0.05)
+        task.cancel()
+    asyncio.run(run())
+    assert "0 done — 0 signed in, 0 failed" in capsys.readouterr().out
+
+
+def test_run_batch_keeps_the_board_up_to_date(screen, monkeypatch):
+    async def provision(job, source, *args):
+        job.phase = "code_wait"
+        await asyncio.sleep(0.01)
+        if job.phone.endswith("3"):
+            job.error = "no code"
+        else:
+            job.session = "s"
+        return job
+
+    monkeypatch.setattr(ts, "provision", provision)
+    b = ts.BatchBoard(live=True, fps=50, out=screen)
+    asyncio.run(ts.run_batch(jobs(6), ts.PromptCodeSource(), concurrency=2, board=b))
+    assert (b.done, b.ok, b.failed, b.active) == (6, 5, 1, {})
+    assert b.frames >= 2 and sys.stdout is not b
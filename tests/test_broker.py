@@ -0,0 +1,195 @@
+import asyncio, json, os, socket, stat
+
+import pytest
+from telethon.errors import FloodWaitError
+
+import telegram_session as ts
+from conftest import session_string
+
+PHONE = "+447700900123"
+HASH  = "a" * 32
+
+
+def dispatch(line, token=None, **ops):
+    """A broker reply to one request line, with `ops` standing in for the real handlers."""
+    async def run():
+        broker = ts.SessionBroker(token=token)
+        broker.ops.update(ops)
+        try:
+            return await broker.dispatch(line)
+        finally:
+            await broker.close()
+    return asyncio.run(run())
+
+
+def raising(e):
+    async def op(request):
+        raise e
+    return op
+
+
+async def ok(request):
+    return {"ok": True}
+
+
+@pytest.mark.parametrize("line", [
+    b"not json",
+    b'{"op": "launch"}',
+    b'{"op": "provision", "api_id": 1}',
+    b'{"op": "provision", "phone": "+447700900000", "api_id": "one", "api_hash": "x"}',
+])
+def test_bad_requests(line):
+    reply = dispatch(line)
+    assert (reply["ok"], reply["reason"]) == (False, "bad_request")
+
+
+def test_sign_in_without_provision():
+    reply = dispatch(b'{"op": "sign_in", "phone": "+447700900000", "code": "12345"}')
+    assert (reply["ok"], reply["reason"]) == (False, "no_sign_in")
+
+
+@pytest.mark.parametrize("error, reason", [
+    (ts.DuplicateSessionError("this auth key is already stored"), "duplicate"),
+    (ts.SealError("wrong key, or the file was modified"), "state"),
+    (RuntimeError("boom"), "internal"),
+])
+def test_failures_are_not_blamed_on_the_request(error, reason):
+    reply = dispatch(b'{"op": "provision"}', provision=raising(error))
+    assert (reply["ok"], reply["reason"], reply["type"]) == (False, reason, type(error).__name__)
+
+
+def test_flood_wait_is_rate_limited():
+    reply = dispatch(b'{"op": "provision"}', provision=raising(FloodWaitError(None, capture=30)))
+    assert (reply["reason"], reply["retry_after"]) == ("rate_limited", 30)
+
+
+def test_a_token_is_required_once_configured():
+    assert dispatch(b'{"op": "stats"}', token="s3cret", stats=ok)["reason"] == "unauthorized"
+    assert dispatch(b'{"op": "stats", "token": "wrong"}', token="s3cret", stats=ok)["reason"] == "unauthorized"
+    assert dispatch(b'{"op": "stats", "token": "s3cret"}', token="s3cret", stats=ok) == {"ok": True}
+
+
+# ── Against the fake backend ──────────────────────────────
+def broker_session(backend, steps):
+    async def run():
+        broker = ts.SessionBroker()
+        try:
+            return await steps(broker)
+        finally:
+            await broker.close()
+    return asyncio.run(run())
+
+
+def provision(broker, phone=PHONE):
+    return broker.dispatch(json.dumps({"op": "provision", "phone": phone, "api_id": 1, "api_hash": HASH}))
+
+
+def test_provision_then_sign_in_returns_a_session(backend):
+    async def steps(broker):
+        sent = await provision(broker)
+        code = backend.code_for(broker.pending[PHONE].sent.phone_code_hash)
+        return sent, await broker.sign_in({"phone": PHONE, "code": code}), broker.pending
+    sent, signed_in, pending = broker_session(backend, steps)
+    assert sent["ok"] and sent["dc"] == 2 and sent["delivery"].startswith("SentCodeType")
+    assert signed_in["ok"] and ts.session_dc(signed_in["session"]) == 2 and pending == {}
+
+
+def test_sign_in_refuses_an_empty_code(backend):
+    async def steps(broker):
+        await provision(broker)
+        codes = len(backend.codes)
+        blank = await broker.sign_in({"phone": PHONE, "code": "  "})
+        assert len(backend.codes) == codes      # no new code was requested
+        code = backend.code_for(broker.pending[PHONE].sent.phone_code_hash)
+        return blank, await broker.sign_in({"phone": PHONE, "code": code})
+    blank, signed_in = broker_session(backend, steps)
+    assert (blank["ok"], blank["reason"]) == (False, "bad_request")
+    assert signed_in["ok"] and signed_in["session"]
+
+
+def test_wrong_codes_run_out(backend):
+    async def steps(broker):
+        await provision(broker)
+        replies = [await broker.sign_in({"phone": PHONE, "code": "000000"}) for _ in range(ts.MAX_CODE_TRIES)]
+        return replies, broker.pending
+    replies, pending = broker_session(backend, steps)
+    assert all(r["type"] == "PhoneCodeInvalidError" for r in replies) and pending == {}
+
+
+def test_2fa_asks_for_the_password_and_limits_wrong_ones(backend):
+    backend.password_rate = 1
+
+    async def steps(broker):
+        await provision(broker)
+        code = backend.code_for(broker.pending[PHONE].sent.phone_code_hash)
+        needed = await broker.sign_in({"phone": PHONE, "code": code})
+        wrong = [await broker.sign_in({"phone": PHONE, "password": "wrong"})
+                 for _ in range(ts.MAX_PASSWORD_TRIES)]
+        return needed, wrong, broker.pending
+    needed, wrong, pending = broker_session(backend, steps)
+    assert needed["reason"] == "password_needed"
+    assert [r["type"] for r in wrong] == ["PasswordHashInvalidError"] * ts.MAX_PASSWORD_TRIES
+    assert pending == {}
+
+
+def test_2fa_sign_in_with_the_password(backend):
+    backend.password_rate = 1
+
+    async def steps(broker):
+        await provision(broker)
+        code = backend.code_for(broker.pending[PHONE].sent.phone_code_hash)
+        return await broker.sign_in({"phone": PHONE, "code": code, "password": backend.password})
+    assert broker_session(backend, steps)["ok"]
+
+
+def test_provision_follows_a_migration_and_remembers_it(backend):
+    backend.migrate_rate = 1
+    home = backend.home_dc(PHONE)
+
+    async def steps(broker):
+        return await provision(broker), broker.dcs.lookup(PHONE)
+    sent, learned = broker_session(backend, steps)
+    assert sent["ok"] and sent["dc"] == home == learned
+
+
+def test_pooled_clients_are_reused(backend):
+    async def steps(broker):
+        broker.pool.warm(1, HASH, [2])
+        await asyncio.sleep(0.05)
+        await provision(broker, "+447700900001")
+        await provision(broker, "+447700900002")
+        return await broker.dispatch(b'{"op": "stats"}')
+    stats = broker_session(backend, steps)
+    assert (stats["pool_hits"], stats["pending"]) == (2, 2)
+
+
+def test_validate_checks_a_session(backend):
+    async def steps(broker):
+        return await broker.dispatch(json.dumps({"op": "validate", "session": session_string(),
+                                                 "api_id": 1, "api_hash": HASH}))
+    assert broker_session(backend, steps)["status"] == "ok"
+
+
+def test_serve_refuses_a_port_without_a_token(capsys):
+    with pytest.raises(SystemExit) as exit:
+        ts.cli(["serve", "--port", "8765"])
+    assert exit.value.code == ts.EXIT_CODES["usage"]
+    assert "TG_SESSION_BROKER_TOKEN" in capsys.readouterr().out
+
+
+def test_the_socket_is_owner_only_from_the_start(backend, tmp_path, monkeypatch):
+    path = str(tmp_path / "broker.sock")
+    modes = []
+
+    async def stop(server):
+        modes.append(stat.S_IMODE(os.stat(path).st_mode))
+        with socket.socket(socket.AF_UNIX) as client:
+            client.connect(path)
+            client.sendall(b'{"op": "stats"}\n')
+            modes.append(json.loads(await asyncio.get_running_loop().run_in_executor(None, client.recv, 4096)))
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(asyncio.Server, "serve_forever", stop)
+    with pytest.raises(KeyboardInterrupt):
+        ts.cli(["serve", "--socket", path])
+    assert modes[0] == 0o600 and modes[1]["ok"]
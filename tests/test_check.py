@@ -0,0 +1,65 @@
+import asyncio, io
+
+import pytest
+
+import telegram_session as ts
+from conftest import session_string
+
+
+def test_session_dc_reads_the_dc_from_the_first_quantum():
+    assert [ts.session_dc(session_string(dc)) for dc in (1, 2, 5)] == [1, 2, 5]
+    for bad in ("", "1abc", "2" + session_string()[1:], "1!!!!!!!"):
+        with pytest.raises(ValueError):
+            ts.session_dc(bad)
+
+
+def test_read_lines_skips_blanks_and_comments():
+    async def run():
+        return [item async for item in ts.read_lines(io.StringIO("# header\n\n  one  \ntwo\n#x\n"))]
+    assert asyncio.run(run()) == [(3, "one"), (4, "two")]
+
+
+def test_run_check_routes_each_session_to_its_dc(monkeypatch):
+    checked, flight = [], {"now": 0, "peak": 0}
+
+    async def check_session(string, api_id, api_hash):
+        flight["now"] += 1
+        flight["peak"] = max(flight["peak"], flight["now"])
+        await asyncio.sleep(0.001)
+        flight["now"] -= 1
+        checked.append(string)
+        return "ok", f"dc {ts.session_dc(string)}"
+
+    async def lines(items):
+        for item in items:
+            yield item
+
+    monkeypatch.setattr(ts, "check_session", check_session)
+    strings = [session_string(dc) for dc in (1, 2, 4, 2, 1) * 10]
+    results = []
+    asyncio.run(ts.run_check(lines([(n, s) for n, s in enumerate(strings, 1)] + [(99, "garbage")]),
+                             1, "a" * 32, lambda *r: results.append(r), concurrency=3, per_dc=2))
+    assert sorted(checked) == sorted(strings)
+    assert flight["peak"] <= 3
+    assert all(detail == f"dc {dc}" for n, dc, status, detail in results if status == "ok")
+    assert [(n, dc, status) for n, dc, status, _ in results if status != "ok"] == [(99, "", "invalid")]
+
+
+def test_check_main_writes_a_line_per_session_and_fails_on_dead_ones(tmp_path, monkeypatch, capsys):
+    async def check_session(string, api_id, api_hash):
+        return ("dead", "AuthKeyUnregisteredError: …") if ts.session_dc(string) == 4 else ("ok", "user_id=1")
+
+    monkeypatch.setattr(ts, "check_session", check_session)
+    sessions = tmp_path / "sessions.txt"
+    sessions.write_text(f"{session_string(2)}\n{session_string(4)}\n")
+    with pytest.raises(SystemExit) as exit:
+        ts.cli(["check", str(sessions), "--api-id", "1", "--api-hash", "a" * 32])
+    assert exit.value.code == ts.EXIT_CODES["failed"]
+    out, err = capsys.readouterr()
+    assert out.splitlines() == ["line,dc,status,detail", "1,2,ok,user_id=1", "2,4,dead,AuthKeyUnregisteredError: …"]
+    assert "1 dead, 1 ok" in err
+
+
+def test_check_session_says_invalid_without_connecting():
+    status, detail = asyncio.run(ts.check_session("1" + "A" * 20, 1, "a" * 32))
+    assert status == "invalid"
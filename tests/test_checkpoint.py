@@ -0,0 +1,167 @@
+import builtins, os, stat
+from types import SimpleNamespace
+
+import pytest
+from telethon.errors import PhoneCodeInvalidError, SessionPasswordNeededError, PasswordHashInvalidError
+from telethon.tl import types
+
+import telegram_session as ts
+from conftest import session_string
+
+PHONE = "+447700900123"
+
+
+def test_seal_round_trip():
+    assert ts.unseal(ts.seal(b"auth key")) == b"auth key"
+    assert ts.unseal(ts.seal(b"")) == b""
+
+
+def test_unseal_rejects_a_modified_blob():
+    blob = bytearray(ts.seal(b"auth key"))
+    blob[60] ^= 1
+    with pytest.raises(ValueError):
+        ts.unseal(bytes(blob))
+
+
+def test_unseal_rejects_what_was_never_sealed():
+    with pytest.raises(ValueError):
+        ts.unseal(b'{"phone": "+447700900000"}')
+
+
+def test_unseal_rejects_the_wrong_passphrase(monkeypatch):
+    monkeypatch.setenv("TG_SESSION_PASSPHRASE", "correct horse")
+    blob = ts.seal(b"auth key")
+    monkeypatch.setenv("TG_SESSION_PASSPHRASE", "battery staple")
+    with pytest.raises(ValueError):
+        ts.unseal(blob)
+
+
+def test_checkpoint_is_sealed_and_listed_until_dropped():
+    string = session_string()
+    checkpoint = ts.Checkpoint(PHONE)
+    checkpoint.save(1, "a" * 32, string, "hash")
+    with open(checkpoint.path, "rb") as f:
+        assert string.encode() not in f.read()
+    assert stat.S_IMODE(os.stat(checkpoint.path).st_mode) == 0o600
+    assert ts.Checkpoint.pending() == [PHONE]
+    checkpoint.advance("password")
+    state = ts.Checkpoint(PHONE).load()
+    assert (state["session"], state["phone_code_hash"], state["stage"]) == (string, "hash", "password")
+    checkpoint.drop()
+    checkpoint.drop()
+    assert ts.Checkpoint.pending() == []
+
+
+class Client:
+    """The slice of a telethon.sync client finish_sign_in() uses; sign_in answers from a script."""
+    def __init__(self, *results):
+        self.results, self.calls, self.connected = list(results), [], True
+        self.session = SimpleNamespace(save=lambda: "1session")
+
+    def sign_in(self, phone=None, code=None, password=None, phone_code_hash=None):
+        self.calls.append(code or password)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def disconnect(self):
+        self.connected = False
+
+
+@pytest.fixture
+def typed(monkeypatch):
+    """Answer input() prompts from a list; returns the warnings shown."""
+    def answers(*lines):
+        lines = list(lines)
+        monkeypatch.setattr(builtins, "input", lambda prompt="": lines.pop(0) if lines else "")
+        return warned
+    warned = []
+    monkeypatch.setattr(ts, "warn", warned.append)
+    return answers
+
+
+@pytest.fixture
+def checkpoint():
+    checkpoint = ts.Checkpoint(PHONE)
+    checkpoint.save(1, "a" * 32, session_string(), "hash")
+    return checkpoint
+
+
+def test_finish_sign_in_reprompts_on_an_empty_code(typed, checkpoint):
+    warned = typed("   ", "", "12345")
+    client = Client(types.User(id=7))
+    assert ts.finish_sign_in(client, PHONE, 1, "hash", checkpoint) == "1session"
+    assert client.calls == ["12345"]
+    assert sum("empty code" in w for w in warned) == 2
+    assert ts.Checkpoint.pending() == [] and not client.connected
+
+
+def test_finish_sign_in_retries_a_wrong_code_on_the_same_hash(typed, checkpoint):
+    typed("11111", "12345")
+    client = Client(PhoneCodeInvalidError(None), types.User(id=7))
+    assert ts.finish_sign_in(client, PHONE, 1, "hash", checkpoint) == "1session"
+    assert client.calls == ["11111", "12345"]
+
+
+def test_finish_sign_in_gives_up_after_max_code_tries(typed, checkpoint):
+    typed(*["11111"] * ts.MAX_CODE_TRIES)
+    client = Client(*[PhoneCodeInvalidError(None)] * ts.MAX_CODE_TRIES)
+    with pytest.raises(SystemExit) as exit:
+        ts.finish_sign_in(client, PHONE, 1, "hash", checkpoint)
+    assert exit.value.code == ts.EXIT_CODES["code"]
+    assert len(client.calls) == ts.MAX_CODE_TRIES and ts.Checkpoint.pending() == []
+
+
+def test_finish_sign_in_refuses_anything_but_a_user(typed, checkpoint):
+    typed("12345")
+    client = Client(types.auth.SentCode(type=types.auth.SentCodeTypeApp(length=5), phone_code_hash="h"))
+    with pytest.raises(SystemExit):
+        ts.finish_sign_in(client, PHONE, 1, "hash", checkpoint)
+
+
+def test_finish_sign_in_records_the_password_stage(typed, checkpoint, monkeypatch):
+    stages = []
+    typed("12345", "wrong", "hunter2")
+    client = Client(SessionPasswordNeededError(None), PasswordHashInvalidError(None), types.User(id=7))
+    sign_in_2fa = ts.sign_in_2fa
+
+    def recording(*args, **kwargs):
+        stages.append(ts.Checkpoint(PHONE).load()["stage"])
+        return sign_in_2fa(*args, **kwargs)
+
+    monkeypatch.setattr(ts, "sign_in_2fa", recording)
+    monkeypatch.setattr(ts.PasswordChecker, "check", lambda self, client, phone, pw: client.sign_in(password=pw))
+    assert ts.finish_sign_in(client, PHONE, 1, "hash", checkpoint) == "1session"
+    assert stages == ["password"] and client.calls == ["12345", "wrong", "hunter2"]
+
+
+def test_resume_continues_with_the_saved_key_and_hash(typed, checkpoint, monkeypatch):
+    import telethon.sync
+    made = []
+
+    class ResumedClient(Client):
+        def __init__(self, session, api_id, api_hash, **kwargs):
+            super().__init__(types.User(id=7))
+            made.append((session.save(), api_id))
+
+        def connect(self):
+            pass
+
+    typed("12345")
+    monkeypatch.setattr(telethon.sync, "TelegramClient", ResumedClient)
+    monkeypatch.setattr(ts, "clear", lambda: None)
+    results = []
+    monkeypatch.setattr(ts, "print_result", lambda *args: results.append(args))
+    saved = checkpoint.load()
+    ts.cli(["resume"])
+    assert made == [(saved["session"], 1)]
+    assert results == [(1, "a" * 32, "1session")]
+    assert ts.Checkpoint.pending() == []
+
+
+def test_resume_with_nothing_pending_exits(typed):
+    typed()
+    with pytest.raises(SystemExit) as exit:
+        ts.cli(["resume"])
+    assert exit.value.code == ts.EXIT_CODES["usage"]
@@ -0,0 +1,277 @@
+import asyncio, json, os, threading, time
+from types import SimpleNamespace
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+
+import pytest
+from telethon import types
+
+import fake_telegram
+import telegram_session as ts
+
+PHONE = "+447700900123"
+SMS   = SimpleNamespace(type=types.auth.SentCodeTypeSms(length=5), timeout=None)
+
+
+def waiting(source, phone=PHONE):
+    """Start source.code() for `phone` and return once it is waiting."""
+    async def start():
+        task = asyncio.ensure_future(source.code(phone, SMS))
+        while phone.lstrip("+") not in getattr(source, "waiting", {phone.lstrip("+"): 1}):
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return task
+    return start()
+
+
+# ── PushCodeSource ───────────────────────────────────────
+def test_a_pushed_code_goes_to_the_waiting_call():
+    async def run():
+        source = ts.PushCodeSource(timeout=1)
+        await source.expect(PHONE, 1, "a" * 32)
+        task = await waiting(source)
+        source.deliver(PHONE, "12345", at=100.0)
+        return await task, source.delivered(PHONE), source.waiting
+    assert asyncio.run(run()) == ("12345", 100.0, {})
+
+
+def test_a_code_that_lands_early_is_held():
+    async def run():
+        source = ts.PushCodeSource(timeout=1)
+        await source.expect(PHONE, 1, "a" * 32)
+        source.deliver(PHONE.lstrip("+"), "12345")
+        return await source.code(PHONE, SMS)
+    assert asyncio.run(run()) == "12345"
+
+
+def test_a_code_from_before_the_request_is_stale():
+    async def run():
+        source = ts.PushCodeSource(timeout=0.05)
+        source.deliver(PHONE, "11111")
+        await source.expect(PHONE, 1, "a" * 32)
+        return await source.code(PHONE, SMS), source.waiting
+    assert asyncio.run(run()) == (None, {})
+
+
+def test_start_runs_once():
+    class Counting(ts.PushCodeSource):
+        starts = 0
+
+        async def start(self):
+            self.starts += 1
+
+    async def run():
+        source = Counting()
+        for phone in ("+447700900001", "+447700900002"):
+            await source.expect(phone, 1, "a" * 32)
+        return source.starts
+    assert asyncio.run(run()) == 1
+
+
+# ── Pipe ─────────────────────────────────────────────────
+def test_pipe_lines_are_delivered_by_phone(tmp_path):
+    path = str(tmp_path / "codes.fifo")
+
+    async def run():
+        source = ts.PipeCodeSource(path, timeout=1)
+        await source.expect(PHONE, 1, "a" * 32)
+        await source.expect("+447700900124", 1, "a" * 32)
+        first, second = await waiting(source), await waiting(source, "+447700900124")
+        fd = os.open(path, os.O_WRONLY)
+        os.write(fd, b"+447700900124 22222\n+4477009")
+        os.write(fd, b"00123 11111\n")
+        os.close(fd)
+        codes = await first, await second
+        await source.close()
+        return codes
+    assert asyncio.run(run()) == ("11111", "22222")
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+
+def test_a_bare_code_goes_to_the_only_waiter(tmp_path):
+    path = str(tmp_path / "codes.fifo")
+
+    async def run():
+        source = ts.PipeCodeSource(path, timeout=1)
+        await source.expect(PHONE, 1, "a" * 32)
+        task = await waiting(source)
+        fd = os.open(path, os.O_WRONLY)
+        os.write(fd, b"33333\n")
+        os.close(fd)
+        code = await task
+        await source.close()
+        return code
+    assert asyncio.run(run()) == "33333"
+
+
+# ── HTTP ─────────────────────────────────────────────────
+def post(port, path="/code", body=None, token=None, content_type="application/json"):
+    request = Request(f"http://127.0.0.1:{port}{path}", data=body, method="POST",
+                      headers={"Content-Type": content_type})
+    if token:
+        request.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urlopen(request, timeout=2) as reply:
+            return reply.status
+    except HTTPError as e:
+        return e.code
+
+
+def http_exchange(token, requests):
+    """Run an HttpCodeSource on a free port; send `requests` (kwargs for post()) while a code is awaited."""
+    async def run():
+        source = ts.HttpCodeSource(0, timeout=1, token=token)
+        await source.expect(PHONE, 1, "a" * 32)
+        port = source.server.sockets[0].getsockname()[1]
+        task = await waiting(source)
+        loop = asyncio.get_running_loop()
+        statuses = [await loop.run_in_executor(None, lambda r=r: post(port, **r)) for r in requests]
+        code = await task
+        await source.close()
+        return statuses, code
+    return asyncio.run(run())
+
+
+def test_http_takes_a_json_body():
+    body = json.dumps({"phone": PHONE, "code": 12345}).encode()
+    assert http_exchange(None, [{"body": body}]) == ([204], "12345")
+
+
+def test_http_takes_a_form_body():
+    body = b"phone=%2B447700900123&code=54321"
+    assert http_exchange(None, [{"body": body, "content_type": "application/x-www-form-urlencoded"}]) \
+        == ([204], "54321")
+
+
+def test_http_needs_the_token_once_one_is_set():
+    body = json.dumps({"phone": PHONE, "code": "12345"}).encode()
+    statuses, code = http_exchange("s3cret", [
+        {"body": body}, {"body": body, "token": "wrong"},
+        {"path": "/elsewhere", "body": body, "token": "s3cret"},
+        {"body": b'{"phone": "' + PHONE.encode() + b'"}', "token": "s3cret"},
+        {"body": body, "token": "s3cret"},
+    ])
+    assert (statuses, code) == ([401, 401, 404, 400, 204], "12345")
+
+
+def test_http_token_comes_from_the_environment(monkeypatch):
+    monkeypatch.setenv("TG_SESSION_CODE_TOKEN", "from-env")
+    assert ts.HttpCodeSource(0).token == "from-env"
+
+
+# ── Several at once ──────────────────────────────────────
+class Fixed(ts.CodeSource):
+    def __init__(self, code, delay, pw=None, at=None):
+        self.value, self.delay, self.pw, self.at, self.cancelled = code, delay, pw, at, False
+
+    async def code(self, phone, sent):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.at:
+            self.mark(phone, self.at)
+        return self.value
+
+    async def password(self, phone):
+        return self.pw
+
+
+def test_the_first_code_wins_and_the_rest_are_cancelled():
+    slow, empty, fast = Fixed("99999", 5), Fixed(None, 0), Fixed("12345", 0.01, at=42.0)
+    source = ts.AnyCodeSource([slow, empty, fast])
+    assert asyncio.run(source.code(PHONE, SMS)) == "12345"
+    assert slow.cancelled and source.delivered(PHONE) == 42.0
+
+
+def test_none_when_no_source_has_a_code():
+    assert asyncio.run(ts.AnyCodeSource([Fixed(None, 0), Fixed("", 0)]).code(PHONE, SMS)) is None
+
+
+def test_the_first_password_found_is_used():
+    source = ts.AnyCodeSource([Fixed(None, 0), Fixed(None, 0, pw="hunter2"), Fixed(None, 0, pw="other")])
+    assert asyncio.run(source.password(PHONE)) == "hunter2"
+
+
+@pytest.mark.parametrize("spec, kind", [
+    ("codes/", ts.DirCodeSource), ("dir:codes/", ts.DirCodeSource),
+    ("pipe:/tmp/codes.fifo", ts.PipeCodeSource), ("http:8080", ts.HttpCodeSource),
+    ("telegram", ts.TelegramCodeSource), (" telegram , ", ts.TelegramCodeSource),
+])
+def test_a_single_source_is_used_directly(spec, kind):
+    assert type(ts.code_source(spec)) is kind
+
+
+def test_several_sources_are_combined():
+    source = ts.code_source("telegram,http:8080,dir:codes/", timeout=30)
+    assert [type(s) for s in source.sources] == [ts.TelegramCodeSource, ts.HttpCodeSource, ts.DirCodeSource]
+    assert all(s.timeout == 30 for s in source.sources)
+
+
+@pytest.mark.parametrize("spec", ["", " , ", "http:eighty"])
+def test_a_bad_spec_is_refused(spec):
+    with pytest.raises(ValueError):
+        ts.code_source(spec)
+
+
+# ── Metrics ──────────────────────────────────────────────
+def test_wait_and_submit_times_are_kept_per_method():
+    source = Fixed("12345", 0)
+    source.mark(PHONE, time.time() - 2)
+    ts.observe_code(source, PHONE, SMS, 3.0, "12345")
+    ts.observe_code(None, PHONE, SimpleNamespace(type=types.auth.SentCodeTypeApp(length=5)), 9.0, None)
+    phases = ts.metrics().phases
+    assert phases["code_wait_sms"]["count"] == 1 and phases["code_wait_app"]["errors"] == 1
+    assert 2 <= phases["code_submit_sms"]["sum"] < 3 and "code_submit_app" not in phases
+
+
+# ── From synchronous code ────────────────────────────────
+def test_the_blocking_wrapper_keeps_listening_while_the_caller_blocks():
+    source = ts.BlockingCodeSource(ts.PushCodeSource(timeout=2), "test")
+    source.expect(PHONE, 1, "a" * 32)
+    threading.Timer(0.05, lambda: source._loop.call_soon_threadsafe(
+        source.source.deliver, PHONE, "12345", 7.0)).start()
+    assert source.code(PHONE, SMS) == "12345" and source.delivered(PHONE) == 7.0
+    source.close()
+
+
+def test_an_unusable_spec_in_the_environment_is_fatal(monkeypatch):
+    monkeypatch.setenv("TG_SESSION_CODES", "http:eighty")
+    monkeypatch.setattr("builtins.input", lambda prompt="": "")
+    with pytest.raises(SystemExit) as exit:
+        ts.interactive_code_source()
+    assert exit.value.code == ts.EXIT_CODES["usage"]
+    monkeypatch.delenv("TG_SESSION_CODES")
+    assert ts.interactive_code_source() is None
+
+
+# ── Telegram, through a stored session ───────────────────
+def test_an_app_code_is_read_off_a_stored_session(backend, monkeypatch):
+    monkeypatch.setenv("TG_SESSION_PASSPHRASE", "correct horse")
+    backend.code_types, backend.app_delay = ["app"], 0.01
+    first = asyncio.run(ts.provision(ts.Job(1, "a" * 32, PHONE), fake_telegram.FakeCodeSource(backend)))
+    store = ts.SessionStore()
+    store.add(PHONE, 1, first.session)
+    submitted = ts.metrics().phases["code_submit_app"]["count"]
+
+    async def run():
+        source = ts.TelegramCodeSource(timeout=2, store=store)
+        job = await ts.provision(ts.Job(1, "a" * 32, PHONE), source)
+        await source.close()
+        return job, source
+    job, source = asyncio.run(run())
+    store.close()
+    assert job.session and not job.error and job.session != first.session
+    assert source.listeners == {} and ts.metrics().phases["code_submit_app"]["count"] == submitted + 1
+
+
+def test_no_stored_session_means_no_code(backend, tmp_path):
+    store = ts.SessionStore(str(tmp_path / "empty.db"))
+
+    async def run():
+        source = ts.TelegramCodeSource(timeout=0.1, store=store)
+        await source.expect(PHONE, 1, "a" * 32)
+        return await source.code(PHONE, SMS)
+    assert asyncio.run(run()) is None
+    store.close()
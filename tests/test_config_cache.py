@@ -0,0 +1,109 @@
+import asyncio, json, time
+
+import pytest
+from telethon.tl import types
+
+import fake_telegram
+import telegram_session as ts
+
+HASH  = "a" * 32
+PHONE = "+447700900123"
+
+
+def migrated_provision(backend):
+    """Provision one account that has to change DC, and wait for any config refresh it started."""
+    backend.migrate_rate = 1
+
+    async def run():
+        job = await ts.provision(ts.Job(1, HASH, PHONE), fake_telegram.FakeCodeSource(backend))
+        if ts.config_cache().task:
+            await ts.config_cache().task
+        return job
+    return asyncio.run(run())
+
+
+def next_run(monkeypatch):
+    """What a new process starts with: no config in telethon's class, the cache re-read from disk."""
+    monkeypatch.setattr(fake_telegram.FakeClient, "_config", None)
+    monkeypatch.setattr(ts, "_config_cache", None)
+
+
+def test_a_miss_fetches_and_saves_the_config(backend, state_dir):
+    job = migrated_provision(backend)
+    assert job.session and not job.error
+    cache = ts.config_cache()
+    assert (cache.outcome, cache.refreshed, cache.stale) == ("miss", True, False)
+    saved = json.loads((state_dir / "config.json").read_text())
+    assert saved["addresses"]["ipv4"]["4"] == [fake_telegram.DC_ADDRESSES[4], 443]
+    assert ts.metrics().notes["config_cache"] == "miss"
+
+
+def test_a_hit_skips_the_config_request(backend, monkeypatch):
+    migrated_provision(backend)
+    next_run(monkeypatch)
+    before = backend.config_requests
+    job = migrated_provision(backend)
+    assert job.session and ts.config_cache().outcome == "hit"
+    assert backend.config_requests == before
+
+
+def test_a_stale_cache_is_used_and_refreshed(backend, monkeypatch, state_dir):
+    migrated_provision(backend)
+    path = state_dir / "config.json"
+    data = json.loads(path.read_text())
+    data["fetched_at"] -= ts.CONFIG_TTL + 1
+    path.write_text(json.dumps(data))
+    next_run(monkeypatch)
+    migrated_provision(backend)
+    cache = ts.config_cache()
+    assert (cache.outcome, cache.refreshed) == ("stale", True) and cache.age() < 60
+
+
+@pytest.mark.parametrize("change", [
+    lambda d: d.update(fetched_at=time.time() - ts.CONFIG_MAX_AGE - 1),
+    lambda d: d.update(fetched_at=time.time() + 3600),
+    lambda d: d["addresses"]["ipv4"].update({"4": ["not an ip", 443]}),
+    lambda d: d["addresses"]["ipv4"].update({"9": ["10.0.0.1", 443]}),
+    lambda d: d["addresses"].update(ipv4={}),
+])
+def test_a_cache_that_cannot_be_trusted_is_ignored(backend, monkeypatch, state_dir, change):
+    migrated_provision(backend)
+    path = state_dir / "config.json"
+    data = json.loads(path.read_text())
+    change(data)
+    path.write_text(json.dumps(data))
+    next_run(monkeypatch)
+    cache = ts.config_cache()
+    assert cache.data == {} and cache.stale and cache.config() is None
+
+
+def test_another_layer_is_not_parsed(backend, monkeypatch, state_dir):
+    migrated_provision(backend)
+    path = state_dir / "config.json"
+    data = json.loads(path.read_text())
+    data["layer"] -= 1
+    path.write_text(json.dumps(data))
+    next_run(monkeypatch)
+    assert ts.config_cache().config() is None
+    assert ts.config_cache().address(4) == (fake_telegram.DC_ADDRESSES[4], 443)
+
+
+def test_dc_address_prefers_the_cached_table(backend):
+    config = backend.config()
+    config.dc_options = [
+        types.DcOption(id=4, ip_address="10.4.4.4", port=443),
+        types.DcOption(id=4, ip_address="10.9.9.9", port=443, media_only=True),
+        types.DcOption(id=2, ip_address="10.2.2.2", port=443),
+        types.DcOption(id=2, ip_address="2001:db8::2", port=443, ipv6=True),
+    ]
+    ts.config_cache().learn(config)
+    assert ts.dc_address(4) == ("10.4.4.4", 443)
+    assert ts.dc_address(2, "ipv6") == ("2001:db8::2", 443)
+    assert ts.dc_address(5) == ts.DC_ADDRESSES[5]
+
+
+def test_a_test_mode_config_is_not_kept(backend, state_dir):
+    config = backend.config()
+    config.test_mode = True
+    ts.config_cache().learn(config)
+    assert not (state_dir / "config.json").exists() and ts.config_cache().data == {}
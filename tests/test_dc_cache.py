@@ -0,0 +1,109 @@
+import asyncio, json, os, stat, time
+
+import pytest
+import telethon
+from telethon.errors import PhoneMigrateError
+
+import telegram_session as ts
+
+
+@pytest.mark.parametrize("phone, prefix", [
+    ("+447700900123", "+44"), ("+12025550123", "+1"), ("+79161234567", "+7"),
+    ("+380501234567", "+380"), ("+4915112345678", "+49"), ("447700900123", "+44"),
+])
+def test_phone_prefix(phone, prefix):
+    assert ts.phone_prefix(phone) == prefix
+
+
+def test_save_json_is_owner_only_and_load_json_survives_garbage(tmp_path):
+    path = str(tmp_path / "cache.json")
+    ts.save_json(path, {"a": 1})
+    assert ts.load_json(path, None) == {"a": 1}
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    with open(path, "w") as f:
+        f.write("{half")
+    assert ts.load_json(path, "default") == "default"
+    assert ts.load_json(str(tmp_path / "missing.json"), []) == []
+
+
+def test_dc_cache_learns_per_prefix_and_counts_across_runs():
+    dcs = ts.DcCache()
+    assert dcs.lookup("+447700900001") is None
+    dcs.learn("+447700900001", 4)
+    dcs.save()
+    again = ts.DcCache()
+    assert again.lookup("+447700900999") == 4
+    assert again.lookup("+12025550123") is None
+    assert (again.hits, again.misses) == (1, 2)
+
+
+def test_dc_cache_drops_expired_entries(state_dir):
+    dcs = ts.DcCache(ttl=60)
+    dcs.learn("+447700900001", 4)
+    dcs.learn("+12025550123", 1)
+    dcs.entries["+44"]["at"] = time.time() - 61
+    dcs.save()
+    assert ts.DcCache(ttl=60).entries.keys() == {"+1"}
+    dcs.entries["+1"]["at"] = time.time() - 61     # expires while the cache is open
+    assert dcs.lookup("+12025550123") is None and "+1" not in dcs.entries
+
+
+def test_dc_cache_ignores_an_unknown_dc():
+    dcs = ts.DcCache()
+    dcs.learn("+447700900001", 99)
+    assert dcs.lookup("+447700900001") is None
+
+
+class MigratingClient:
+    """A TelegramClient whose first code request is redirected to DC 4."""
+    def __init__(self, session, api_id, api_hash, **kwargs):
+        self.session = session
+        self.session.set_dc(2, "149.154.167.51", 443)
+        self.switches = []
+
+    async def connect(self):
+        pass
+
+    async def _switch_dc(self, dc):
+        self.switches.append(dc)
+        self.session.set_dc(dc, *ts.DC_ADDRESSES[dc])
+
+    async def send_code_request(self, phone):
+        if self.session.dc_id != 4:
+            raise PhoneMigrateError(None, capture=4)
+        return telethon.types.auth.SentCode(telethon.types.auth.SentCodeTypeSms(length=5), "h")
+
+    async def sign_in(self, *args, **kwargs):
+        pass
+
+    async def disconnect(self):
+        pass
+
+
+class NoCode(ts.CodeSource):
+    async def code(self, phone, sent):
+        return None
+
+
+def test_provision_follows_a_migration_and_remembers_it(monkeypatch):
+    monkeypatch.setattr(telethon, "TelegramClient", MigratingClient)
+    dcs = ts.DcCache()
+    job = asyncio.run(ts.provision(ts.Job(1, "a" * 32, "+447700900001"), NoCode(), dcs))
+    assert job.error == "No code arrived before it expired"
+    assert dcs.entries["+44"]["dc"] == 4
+
+    # The next +44 account starts on DC 4, so it is never redirected.
+    seen = []
+    monkeypatch.setattr(MigratingClient, "_switch_dc", lambda self, dc: seen.append(dc))
+    asyncio.run(ts.provision(ts.Job(1, "a" * 32, "+447700900002"), NoCode(), dcs))
+    assert seen == [] and dcs.hits == 1
+
+
+def test_run_batch_saves_the_cache(monkeypatch, state_dir):
+    async def provision(job, source, dcs, *args):
+        dcs.learn(job.phone, 5)
+
+    monkeypatch.setattr(ts, "provision", provision)
+    asyncio.run(ts.run_batch([ts.Job(1, "a" * 32, "+447700900001")], ts.PromptCodeSource()))
+    saved = json.loads((state_dir / "dc_cache.json").read_text())
+    assert saved["entries"]["+44"]["dc"] == 5
@@ -0,0 +1,115 @@
+import asyncio, json, time
+
+import pytest
+from telethon import types
+
+import fake_telegram
+import telegram_session as ts
+
+HASH = "a" * 32
+APP, SMS = types.auth.SentCodeTypeApp(length=5), types.auth.SentCodeTypeSms(length=5)
+
+
+def seed(stats, phone, strategy, sent_type, seconds, times=3, delivered=True):
+    for _ in range(times):
+        stats.record(phone, strategy, sent_type, seconds, delivered)
+
+
+def test_no_data_means_the_default_request():
+    assert ts.DeliveryStats().choose("+447700900001") == ("default", None)
+
+
+def test_the_quickest_strategy_for_the_prefix_wins():
+    stats = ts.DeliveryStats()
+    seed(stats, "+447700900001", "default", APP, 40)
+    seed(stats, "+447700900002", "sms", SMS, 8)
+    strategy, why = stats.choose("+447700900003")
+    assert strategy == "sms"
+    assert "+44 numbers" in why and "forced SMS, ~8.0s" in why and "default request ~40.0s" in why
+
+
+def test_too_few_observations_are_not_trusted():
+    stats = ts.DeliveryStats()
+    seed(stats, "+447700900001", "default", APP, 40)
+    seed(stats, "+447700900002", "sms", SMS, 8, times=2)
+    assert stats.choose("+447700900003")[0] == "default"
+
+
+def test_a_country_without_data_uses_every_number():
+    stats = ts.DeliveryStats()
+    seed(stats, "+447700900001", "default", APP, 40)
+    seed(stats, "+447700900002", "resend", SMS, 12)
+    strategy, why = stats.choose("+12025550123")
+    assert strategy == "resend" and "all numbers" in why
+
+
+def test_a_code_that_never_came_costs_the_miss_penalty():
+    stats = ts.DeliveryStats()
+    stats.record("+447700900001", "sms", SMS, 5, delivered=False)
+    seconds, weight = stats.expected("+44")["sms"]
+    assert (seconds, weight) == pytest.approx((ts.DELIVERY_MISS, 1), rel=1e-3)
+    assert stats.cells["+44 sms sms"][2] == 1
+
+
+def test_methods_are_pooled_per_strategy():
+    stats = ts.DeliveryStats()
+    stats.record("+447700900001", "default", APP, 10, True)
+    stats.record("+447700900001", "default", SMS, 30, True)
+    assert stats.expected("+44")["default"] == pytest.approx((20, 2), rel=1e-3)
+
+
+def test_old_observations_decay():
+    stats = ts.DeliveryStats(half_life=1000)
+    seed(stats, "+447700900001", "sms", SMS, 10, times=4)
+    stats.cells["+44 sms sms"][3] -= 1000
+    assert stats.expected("+44")["sms"] == pytest.approx((10, 2), rel=0.01)
+    stats.record("+447700900001", "sms", SMS, 40, True)
+    assert stats.expected("+44")["sms"] == pytest.approx((20, 3), rel=0.01)
+
+
+def test_save_drops_what_has_decayed_away(state_dir):
+    stats = ts.DeliveryStats(half_life=100)
+    stats.record("+447700900001", "sms", SMS, 10, True)
+    stats.record("+12025550123", "sms", SMS, 10, True)
+    stats.cells["+1 sms sms"][3] -= 1000
+    stats.save()
+    saved = json.loads((state_dir / "delivery.json").read_text())
+    assert sorted(saved["cells"]) == ["* sms sms", "+44 sms sms"]
+    assert ts.DeliveryStats().expected("+44")["sms"] == pytest.approx((10, 1), rel=1e-3)
+
+
+def test_exploration_tries_a_strategy_short_of_data():
+    stats = ts.DeliveryStats()
+    seed(stats, "+447700900001", "default", APP, 40)
+    seed(stats, "+447700900001", "sms", SMS, 8)
+    assert stats.choose("+447700900002", explore=1.0) == ("resend", None)
+    assert stats.choose("+447700900002", explore=0.0)[0] == "sms"
+
+
+def test_the_forced_sms_request_opts_out_of_everything_else():
+    request = ts.forced_sms_request("+447700900001", "1", HASH)
+    assert request.api_id == 1 and not any((request.settings.allow_flashcall, request.settings.current_number,
+                                            request.settings.allow_missed_call, request.settings.allow_firebase))
+
+
+# ── In batch mode ────────────────────────────────────────
+@pytest.mark.parametrize("strategy, method", [("sms", "sms"), ("resend", "sms"), ("default", "app")])
+def test_provision_asks_the_way_the_stats_say_and_records_it(backend, strategy, method):
+    backend.code_types = ["app", "sms"]
+    stats = ts.DeliveryStats()
+    for other in ts.DELIVERY_STRATEGIES:
+        seed(stats, "+447700900001", other, APP, 5 if other == strategy else 50)
+    before = stats.expected("+44")[strategy][1]
+    job = asyncio.run(ts.provision(ts.Job(1, HASH, "+447700900002"), fake_telegram.FakeCodeSource(backend),
+                                   delivery=stats))
+    assert job.session and not job.error
+    assert stats.expected("+44")[strategy][1] == pytest.approx(before + 1, abs=0.01)
+    assert f"+44 {strategy} {method}" in stats.cells
+
+
+def test_run_batch_saves_what_it_learned(backend, state_dir, tmp_path):
+    jobs = [ts.Job(1, HASH, f"+44770090000{i}") for i in range(3)]
+    asyncio.run(ts.run_batch(jobs, fake_telegram.FakeCodeSource(backend)))
+    saved = json.loads((state_dir / "delivery.json").read_text())
+    assert sum(cell[0] for key, cell in saved["cells"].items() if key.startswith("+44 ")) == pytest.approx(3, abs=0.01)
+    assert time.time() - max(cell[3] for cell in saved["cells"].values()) < 60
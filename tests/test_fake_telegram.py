@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from telethon import TelegramClient as RealClient
+from telethon.errors import (
+    PhoneCodeInvalidError, PhoneCodeExpiredError, PhoneMigrateError, SessionPasswordNeededError,
+    PasswordHashInvalidError, FloodWaitError,
+)
+from telethon.sessions import StringSession
+from telethon.tl import types
+
+import fake_telegram
+
+PHONE = "+447700900123"
+
+
+def run(backend, steps):
+    """Run `steps(client)` on a connected fake client."""
+    async def go():
+        import telethon
+        client = telethon.TelegramClient(StringSession(), 1, "a" * 32)
+        await client.connect()
+        try:
+            return await steps(client)
+        finally:
+            await client.disconnect()
+    return asyncio.run(go())
+
+
+def test_install_replaces_telethons_client(backend):
+    import telethon
+    assert telethon.TelegramClient is fake_telegram.FakeClient is not RealClient
+
+
+def test_sign_in_with_an_empty_code_sends_a_new_one(backend):
+    # What telethon 1.45 does, and why an empty code must never reach it.
+    async def steps(client):
+        first = await client.send_code_request(PHONE)
+        return first, await client.sign_in(PHONE, "", phone_code_hash=first.phone_code_hash)
+    first, again = run(backend, steps)
+    assert isinstance(again, types.auth.SentCode)
+    assert again.phone_code_hash != first.phone_code_hash
+
+
+def test_sign_in_with_nothing_at_all_is_a_usage_error(backend):
+    async def steps(client):
+        return await client.sign_in()
+    with pytest.raises(ValueError):
+        run(backend, steps)
+
+
+def test_sign_in_checks_the_code_against_its_hash(backend):
+    async def steps(client):
+        sent = await client.send_code_request(PHONE)
+        code = backend.code_for(sent.phone_code_hash)
+        with pytest.raises(PhoneCodeInvalidError):
+            await client.sign_in(PHONE, "00000" if code != "00000" else "11111",
+                                 phone_code_hash=sent.phone_code_hash)
+        user = await client.sign_in(PHONE, code, phone_code_hash=sent.phone_code_hash)
+        with pytest.raises(PhoneCodeExpiredError):    # a code is good for one sign-in
+            await client.sign_in(PHONE, code, phone_code_hash=sent.phone_code_hash)
+        return user
+    assert isinstance(run(backend, steps), types.User)
+
+
+def test_two_factor_accounts_need_the_password(backend):
+    backend.password_rate = 1
+
+    async def steps(client):
+        sent = await client.send_code_request(PHONE)
+        with pytest.raises(SessionPasswordNeededError):
+            await client.sign_in(PHONE, backend.code_for(sent.phone_code_hash),
+                                 phone_code_hash=sent.phone_code_hash)
+        with pytest.raises(PasswordHashInvalidError):
+            await client.sign_in(password="wrong")
+        return await client.sign_in(password=backend.password)
+    assert isinstance(run(backend, steps), types.User)
+
+
+def test_phones_off_the_default_dc_are_redirected_home(backend):
+    backend.migrate_rate = 1
+
+    async def steps(client):
+        with pytest.raises(PhoneMigrateError) as e:
+            await client.send_code_request(PHONE)
+        await client._switch_dc(e.value.new_dc)
+        return e.value.new_dc, await client.send_code_request(PHONE)
+    dc, sent = run(backend, steps)
+    assert dc == backend.home_dc(PHONE) != 2 and sent.phone_code_hash in backend.codes
+
+
+def test_flood_rate_injects_flood_waits(backend):
+    backend.flood_rate, backend.flood_seconds = 1, 7
+
+    async def steps(client):
+        with pytest.raises(FloodWaitError) as e:
+            await client.send_code_request(PHONE)
+        return e.value.seconds
+    assert run(backend, steps) == 7
+
+
+def test_delivery_methods_rotate(backend):
+    backend.code_types = ["app", "sms", "call"]
+
+    async def steps(client):
+        return [type((await client.send_code_request(PHONE)).type).__name__ for _ in range(4)]
+    assert run(backend, steps) == ["SentCodeTypeApp", "SentCodeTypeSms", "SentCodeTypeCall", "SentCodeTypeApp"]
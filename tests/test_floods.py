@@ -0,0 +1,98 @@
+import asyncio, time
+
+import telegram_session as ts
+
+HASH = "a" * 32
+
+
+def test_a_flood_wait_penalises_the_phone():
+    floods = ts.FloodScheduler()
+    until = floods.penalise("+447700900001", 1, 60)
+    assert floods.blocked_until("+447700900001", 1) == until
+    assert floods.blocked_until("+447700900002", 1) == 0
+
+
+def test_a_second_phone_on_the_same_api_id_penalises_the_api_id_for_the_shorter_window():
+    floods = ts.FloodScheduler()
+    floods.penalise("+447700900001", 1, 86400)
+    short = floods.penalise("+447700900002", 1, 60)
+    assert floods.blocked_until("+447700900003", 1) == short
+    assert floods.blocked_until("+447700900003", 2) == 0
+    floods.penalise("+447700900004", 2, 60)     # another api_id is not affected
+    assert floods.blocked_until("+447700900005", 2) == 0
+
+
+def test_penalties_outlive_the_process_until_they_expire():
+    floods = ts.FloodScheduler()
+    until = floods.penalise("+447700900001", 1, 60)
+    floods.penalise("+447700900002", 1, 60)
+    floods.until["phone:+447700900002"] = time.time() - 1
+    floods.save()
+    again = ts.FloodScheduler()
+    assert again.blocked_until("+447700900001", 2) == until
+    assert "phone:+447700900002" not in again.until
+    assert again.owner == {"+447700900001": 1}
+
+
+def test_parked_jobs_come_back_in_window_order_once_ready():
+    floods = ts.FloodScheduler()
+    late, early = ts.Job(1, HASH, "+447700900001"), ts.Job(1, HASH, "+447700900002")
+    floods.park(late, time.time() + 0.2)
+    floods.park(early, time.time() - 1)
+    assert floods.pop_ready() is early
+    assert floods.pop_ready() is None and floods.peak_parked == 2
+    time.sleep(0.2)
+    assert floods.pop_ready() is late
+    assert floods.blocked_seconds > 0.2 and floods.next_ready() is None
+
+
+def test_run_batch_parks_a_flooded_job_and_retries_it_while_others_go_on(monkeypatch):
+    order = []
+
+    async def provision(job, source, *args):
+        order.append(job.phone)
+        if job.phone.endswith("1") and job.parks == 0:
+            job.flood_wait, job.error = 0.3, "FloodWaitError: Rate limited by Telegram — wait 0s"
+        else:
+            job.session = "session"
+
+    monkeypatch.setattr(ts, "provision", provision)
+    jobs = [ts.Job(1, HASH, f"+44770090000{i}") for i in (1, 2, 3)]
+    floods = ts.FloodScheduler()
+    asyncio.run(ts.run_batch(jobs, ts.PromptCodeSource(), concurrency=1, floods=floods))
+    assert order == ["+447700900001", "+447700900002", "+447700900003", "+447700900001"]
+    assert all(j.session and not j.error for j in jobs)
+    assert jobs[0].parks == 1 and floods.penalties == 1
+
+
+def test_run_batch_fails_a_job_whose_window_is_too_long(monkeypatch):
+    calls = []
+
+    async def provision(job, source, *args):
+        calls.append(job.phone)
+        job.flood_wait, job.error = 7200, "FloodWaitError: Rate limited by Telegram — wait 7200s"
+
+    monkeypatch.setattr(ts, "provision", provision)
+    [job] = jobs = [ts.Job(1, HASH, "+447700900001")]
+    asyncio.run(ts.run_batch(jobs, ts.PromptCodeSource(), max_wait=3600))
+    assert job.error.startswith("FloodWaitError") and job.parks == 0
+    # …and the next run doesn't spend another request on it.
+    [again] = jobs = [ts.Job(1, HASH, "+447700900001")]
+    asyncio.run(ts.run_batch(jobs, ts.PromptCodeSource(), max_wait=3600))
+    assert len(calls) == 1 and again.error.startswith("Rate limited for another")
+
+
+def test_run_batch_holds_back_a_job_still_blocked_from_an_earlier_run(monkeypatch):
+    started = []
+
+    async def provision(job, source, *args):
+        started.append(time.time())
+        job.session = "session"
+
+    monkeypatch.setattr(ts, "provision", provision)
+    ts.FloodScheduler().penalise("+447700900001", 1, 0.3)
+    [job] = jobs = [ts.Job(1, HASH, "+447700900001")]
+    begin = time.time()
+    asyncio.run(ts.run_batch(jobs, ts.PromptCodeSource()))
+    assert job.session and started[0] - begin >= 0.25
+    assert job.parks == 0       # waiting out an earlier penalty isn't one of its retries
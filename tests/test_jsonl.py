@@ -0,0 +1,127 @@
+import io, json, sys
+
+import pytest
+
+import telegram_session as ts
+
+HASH  = "a" * 32
+PHONE = "+447700900123"
+
+
+@pytest.fixture
+def events(monkeypatch, capsys):
+    """What machine mode writes to stdout, as a function giving the events so far.
+
+    Machine mode swaps module globals and sys.stdout, so both are put back afterwards.
+    """
+    for name in ("JSONL", "_events", "R", "G", "Y", "C", "RE", "W", "B", "DIM"):
+        monkeypatch.setattr(ts, name, getattr(ts, name))
+    monkeypatch.setattr(sys, "stdout", sys.stdout)
+    seen = []
+
+    def read():
+        seen.extend(json.loads(line) for line in capsys.readouterr().out.splitlines())
+        return list(seen)
+    return read
+
+
+class Stdin:
+    """Answers each `input` event in turn; None stands for the code the backend sent last."""
+    def __init__(self, backend, *answers):
+        self.backend, self.answers = backend, iter(answers or [None])
+
+    def readline(self):
+        answer = next(self.answers, None)
+        return (answer if answer is not None else list(self.backend.codes.values())[-1][1]) + "\n"
+
+    def isatty(self):
+        return False
+
+
+def test_exit_codes_are_distinct_and_nonzero():
+    assert len(set(ts.EXIT_CODES.values())) == len(ts.EXIT_CODES)
+    assert 0 not in ts.EXIT_CODES.values() and ts.EXIT_CODES["cancelled"] == 130
+
+
+@pytest.mark.parametrize("error", sorted(ts.EXIT_CODES))
+def test_fatal_emits_the_error_class_and_exits_with_its_code(events, error):
+    ts.machine_mode()
+    with pytest.raises(SystemExit) as exit:
+        ts.fatal(f"{ts.RE}went wrong{ts.R}", "do this", error=error, retry_after=5)
+    assert exit.value.code == ts.EXIT_CODES[error]
+    [event] = events()
+    assert (event["event"], event["error"], event["exit"]) == ("error", error, ts.EXIT_CODES[error])
+    assert (event["message"], event["fix"], event["retry_after"]) == ("went wrong", "do this", 5)
+
+
+def test_human_output_goes_to_stderr_and_colour_is_off(events):
+    ts.machine_mode()
+    print("human text")
+    ts.ok(f"{ts.G}done{ts.R}")
+    ts.step(2, "Phone number")
+    assert ts.G == "" and sys.stdout is sys.stderr
+    assert [(e["event"], e.get("message"), e.get("step")) for e in events()] == [
+        ("ok", "done", None), ("step", None, 2)]
+
+
+def test_fatal_without_a_terminal_does_not_wait_for_enter(monkeypatch):
+    monkeypatch.setattr(sys, "stdin", io.StringIO())
+    monkeypatch.setattr("builtins.input", lambda prompt="": pytest.fail("asked for Enter"))
+    with pytest.raises(SystemExit) as exit:
+        ts.fatal("no", error="network")
+    assert exit.value.code == ts.EXIT_CODES["network"]
+
+
+def test_closed_stdin_is_an_error_for_what_was_wanted(events, monkeypatch):
+    ts.machine_mode()
+    monkeypatch.setattr(sys, "stdin", io.StringIO())
+    with pytest.raises(SystemExit) as exit:
+        ts.ask("Enter the code: ", "code")
+    assert exit.value.code == ts.EXIT_CODES["code"]
+    assert [e["event"] for e in events()] == ["input", "error"]
+
+
+@pytest.mark.parametrize("argv, error", [
+    (["--api-id", "abc", "--api-hash", HASH, "--phone", PHONE], "usage"),
+    (["--api-id", "1", "--api-hash", "short", "--phone", PHONE], "usage"),
+    (["--api-id", "1", "--api-hash", HASH, "--phone", "07700900123"], "usage"),
+])
+def test_bad_arguments_exit_as_usage(events, argv, error):
+    with pytest.raises(SystemExit) as exit:
+        ts.cli(["new", "--jsonl", *argv])
+    assert exit.value.code == ts.EXIT_CODES[error] and events()[-1]["error"] == error
+
+
+# ── Against the fake backend ──────────────────────────────
+def new(backend, monkeypatch, *answers):
+    monkeypatch.setattr(sys, "stdin", Stdin(backend, *answers))
+    ts.cli(["new", "--jsonl", "--api-id", "1", "--api-hash", HASH, "--phone", PHONE])
+
+
+def test_new_streams_events_ending_in_the_session(backend, events, monkeypatch):
+    backend.code_types = ["sms"]
+    new(backend, monkeypatch)
+    stream = events()
+    kinds = [e["event"] for e in stream]
+    assert kinds[-1] == "session" and kinds.index("code_sent") < kinds.index("input")
+    sent = next(e for e in stream if e["event"] == "code_sent")
+    assert (sent["phone"], sent["delivery"], sent["type"]) == (PHONE, "sms", "SentCodeTypeSms")
+    session = stream[-1]
+    assert ts.session_dc(session["session"]) == backend.home_dc(PHONE)
+    assert "transport" in session and "sign_in" in session["timings"]
+    assert [e["want"] for e in stream if e["event"] == "input"] == ["code"]
+
+
+def test_new_asks_for_the_password_on_2fa(backend, events, monkeypatch):
+    backend.password_rate = 1
+    new(backend, monkeypatch, None, backend.password)
+    stream = events()
+    assert [e["want"] for e in stream if e["event"] == "input"] == ["code", "password"]
+    assert stream[-1]["event"] == "session"
+
+
+def test_a_wrong_password_exits_as_password(backend, events, monkeypatch):
+    backend.password_rate = 1
+    with pytest.raises(SystemExit) as exit:
+        new(backend, monkeypatch, None, *["wrong"] * ts.MAX_PASSWORD_TRIES)
+    assert exit.value.code == ts.EXIT_CODES["password"] and events()[-1]["error"] == "password"
@@ -0,0 +1,164 @@
+import asyncio, os, socket, threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import fake_telegram
+import telegram_session as ts
+
+HASH = "a" * 32
+
+
+@pytest.fixture
+def made(monkeypatch):
+    """Keys come from threads instead of processes; returns the (dc, api_id, api_hash) of each."""
+    made = Made()
+    made.gate.set()
+
+    def generate_auth_key(dc, api_id, api_hash):
+        made.gate.wait(5)
+        made.append((dc, api_id, api_hash))
+        if api_hash == "broken":
+            raise ConnectionError("no handshake today")
+        return os.urandom(256)
+
+    monkeypatch.setattr(ts, "generate_auth_key", generate_auth_key)
+    return made
+
+
+class Made(list):
+    def __init__(self):
+        super().__init__()
+        self.gate = threading.Event()     # cleared: workers hold their keys back
+
+
+def pool(**kwargs):
+    keys = ts.AuthKeyPool(**kwargs)
+    keys._pool.shutdown()
+    keys._pool = ThreadPoolExecutor(keys.workers)
+    return keys
+
+
+async def settle(keys):
+    while any(keys.pending.values()):
+        await asyncio.sleep(0.01)
+
+
+def test_take_hands_out_a_ready_key_once_and_refills(made):
+    async def run():
+        keys = pool(reserve=2)
+        keys.warm(1, HASH, [2, 4])
+        await settle(keys)
+        ready = list(keys.keys[1, 2])
+        key = await keys.take(1, HASH, 2)
+        await settle(keys)
+        keys.close()
+        return keys, ready, key
+    keys, ready, key = asyncio.run(run())
+    assert key == ready[0][1] and key not in [k for _, k in keys.keys[1, 2]]
+    assert len(keys.keys[1, 2]) == 2 and len(keys.keys[1, 4]) == 2
+    assert (keys.hits, keys.misses, keys.generated) == (1, 0, 5)
+
+
+def test_a_job_waits_for_a_key_already_being_made(made):
+    async def run():
+        keys = pool(reserve=1, workers=1)
+        made.gate.clear()
+        keys.warm(1, HASH, [2])
+        taking = asyncio.ensure_future(keys.take(1, HASH, 2))
+        await asyncio.sleep(0.05)
+        assert not taking.done()
+        # A second job would queue behind the first: it negotiates its own instead.
+        assert await keys.take(1, HASH, 2) is None
+        made.gate.set()
+        key = await taking
+        await settle(keys)
+        keys.close()
+        return keys, key
+    keys, key = asyncio.run(run())
+    assert key and (keys.hits, keys.misses) == (1, 1)
+
+
+def test_waiting_jobs_are_released_when_the_worker_fails(made):
+    async def run():
+        keys = pool(reserve=1, workers=1)
+        made.gate.clear()
+        keys.warm(1, "broken", [2])
+        taking = asyncio.ensure_future(keys.take(1, "broken", 2))
+        await asyncio.sleep(0.05)
+        made.gate.set()
+        key = await taking
+        keys.close()
+        return keys, key
+    keys, key = asyncio.run(run())
+    assert key is None and keys.failed >= 1 and keys.misses == 1
+
+
+def test_keys_are_kept_apart_per_api_id(made):
+    async def run():
+        keys = pool(reserve=1)
+        keys.warm(1, HASH, [2])
+        await settle(keys)
+        made.gate.clear()
+        other = asyncio.ensure_future(keys.take(2, "b" * 32, 2))
+        await asyncio.sleep(0.05)
+        assert not other.done() and keys.keys[1, 2]
+        made.gate.set()
+        await other
+        await settle(keys)
+        keys.close()
+    asyncio.run(run())
+    assert {(api_id, api_hash) for _, api_id, api_hash in made} == {(1, HASH), (2, "b" * 32)}
+
+
+def test_expired_keys_are_never_handed_out(made):
+    async def run():
+        keys = pool(reserve=1, ttl=0.05)
+        keys.warm(1, HASH, [2])
+        await settle(keys)
+        await asyncio.sleep(0.06)
+        made.gate.clear()
+        taking = asyncio.ensure_future(keys.take(1, HASH, 2))
+        await asyncio.sleep(0.02)
+        made.gate.set()
+        await taking
+        keys.close()
+        return keys
+    keys = asyncio.run(run())
+    assert keys.expired == 1
+
+
+def test_leftover_keys_are_sealed_for_the_next_run(made):
+    async def run(reserve):
+        keys = pool(reserve=reserve)
+        before = {slot: [k for _, k in q] for slot, q in keys.keys.items()}
+        keys.warm(7, HASH, [2])
+        await settle(keys)
+        keys.close()
+        return keys, before
+    first, _ = asyncio.run(run(2))
+    with open(first.path, "rb") as f:
+        sealed = f.read()
+    assert all(key not in sealed for _, key in first.keys[7, 2]) and ts.unseal(sealed)
+    second, loaded = asyncio.run(run(2))
+    assert loaded == {(7, 2): [k for _, k in first.keys[7, 2]]}
+    assert second.generated == 0
+
+
+def test_worker_processes_use_the_fake_through_the_initializer(backend):
+    async def run():
+        keys = ts.AuthKeyPool(reserve=1, workers=1, initializer=fake_telegram.install, initargs=(backend,))
+        keys.warm(1, HASH, [2])
+        key = await keys.take(1, HASH, 2)
+        keys.close()
+        return keys, key
+    keys, key = asyncio.run(run())
+    assert key and len(key) == 256 and keys.failed == 0
+
+
+def test_offline_refuses_everything_but_loopback(backend):
+    with pytest.raises(ConnectionRefusedError, match="149.154.167.51"):
+        socket.create_connection(("149.154.167.51", 443), timeout=1)
+    server = socket.create_server(("127.0.0.1", 0))
+    with server, socket.create_connection(server.getsockname(), timeout=1):
+        pass
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+import telegram_session as ts
+
+
+def test_observe_fills_the_first_bucket_that_fits():
+    m = ts.Metrics()
+    for seconds in (0.01, 0.05, 0.3, 1000):
+        m.observe("connect", seconds)
+    p = m.phases["connect"]
+    assert p["buckets"][:4] == [2, 0, 0, 1] and sum(p["buckets"]) == 3
+    assert p["count"] == 4 and p["sum"] == pytest.approx(1000.36)
+
+
+def test_time_marks_a_phase_that_raised_as_an_error():
+    m = ts.Metrics()
+    with m.time("sign_in"):
+        pass
+    with pytest.raises(KeyError):
+        with m.time("sign_in"):
+            raise KeyError
+    assert (m.phases["sign_in"]["count"], m.phases["sign_in"]["errors"]) == (2, 1)
+
+
+def test_start_and_stop_time_a_phase_across_calls():
+    m = ts.Metrics()
+    m.stop("code_wait")                     # never started: nothing observed
+    m.start("code_wait")
+    m.stop("code_wait")
+    assert m.phases["code_wait"]["count"] == 1 and "code_wait" in m.readout()
+
+
+def test_report_quantiles_come_from_the_recent_samples():
+    m = ts.Metrics()
+    for i in range(1, 101):
+        m.observe("send_code", i / 100)
+    p = m.report()["phases"]["send_code"]
+    assert (p["p50"], p["p90"], p["p99"], p["max"]) == (0.51, 0.91, 1.0, 1.0)
+    assert p["mean"] == pytest.approx(0.505)
+
+
+def test_recent_samples_are_bounded():
+    m = ts.Metrics()
+    for i in range(ts.RECENT_SAMPLES + 10):
+        m.observe("connect", i)
+    assert len(m.phases["connect"]["recent"]) == ts.RECENT_SAMPLES
+    assert m.phases["connect"]["recent"][0] == 10
+
+
+def test_prometheus_buckets_are_cumulative():
+    m = ts.Metrics()
+    for seconds in (0.01, 0.2, 0.2, 1000):
+        m.observe("connect", seconds, failed=seconds > 1)
+    text = m.prometheus()
+    assert 'telegram_session_phase_seconds_bucket{phase="connect",le="0.05"} 1' in text
+    assert 'telegram_session_phase_seconds_bucket{phase="connect",le="0.25"} 3' in text
+    assert 'telegram_session_phase_seconds_bucket{phase="connect",le="600"} 3' in text
+    assert 'telegram_session_phase_seconds_bucket{phase="connect",le="+Inf"} 4' in text
+    assert 'telegram_session_phase_errors_total{phase="connect"} 1' in text
+
+
+def test_history_accumulates_across_runs_and_resets_with_new_buckets(state_dir, monkeypatch):
+    m = ts.Metrics()
+    m.observe("connect", 0.2)
+    m.save()
+    assert (state_dir / "metrics.prom").exists()
+    again = ts.Metrics()
+    again.observe("connect", 0.3)
+    assert again.phases["connect"]["count"] == 2 and again.run == {"connect": 0.3}
+    again.save()
+    monkeypatch.setattr(ts, "LATENCY_BUCKETS", (1, 10))
+    assert ts.Metrics().phases == {}
+
+
+def test_metrics_command_exports_and_resets(tmp_path):
+    ts.metrics().observe("connect", 0.2)
+    ts.metrics().save()
+    report, prom = tmp_path / "report.json", tmp_path / "metrics.prom"
+    ts.cli(["metrics", "--json", str(report), "--prom", str(prom)])
+    assert json.loads(report.read_text())["phases"]["connect"]["count"] == 1
+    assert "telegram_session_phase_seconds_count" in prom.read_text()
+    ts.cli(["metrics", "--reset"])
+    assert ts.Metrics().phases == {}
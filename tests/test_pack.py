@@ -0,0 +1,96 @@
+import ipaddress, os, stat
+
+import pytest
+
+import telegram_session as ts
+from conftest import session_string
+
+V6 = ipaddress.ip_address("2001:67c:4e8:f002::a").packed
+
+
+def test_pack_round_trip(tmp_path):
+    strings = [session_string(dc=2), session_string(dc=4, ip=bytes((149, 154, 167, 91))),
+               session_string(dc=2, ip=V6)]
+    invalid, path = [0], str(tmp_path / "sessions.pack")
+    assert ts.write_pack(path, ts.string_records(strings + ["not a session"], invalid)) == 3
+    assert invalid == [1]
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    with ts.SessionPack(path) as pack:
+        assert len(pack) == 3
+        assert list(pack.strings()) == strings
+        assert {dc: list(ids) for dc, ids in pack.group_by_dc().items()} == {2: [0, 2], 4: [1]}
+        assert bytes(pack.auth_key(1)) == ts.session_fields(strings[1])[3]
+        assert pack.address(2) == (2, V6, 443)
+
+
+def test_a_generator_longer_than_one_chunk(tmp_path):
+    path = str(tmp_path / "sessions.pack")
+    key  = os.urandom(256)
+    records = ((1 + i % 5, bytes((10, 0, 0, 1)), 443, key) for i in range(ts.PACK_CHUNK + 7))
+    assert ts.write_pack(path, records) == ts.PACK_CHUNK + 7
+    with ts.SessionPack(path) as pack:
+        assert len(pack) == ts.PACK_CHUNK + 7
+        assert pack.dc_ids()[:6] == bytes((1, 2, 3, 4, 5, 1))
+        assert sum(len(ids) for ids in pack.group_by_dc().values()) == len(pack)
+
+
+def test_empty_pack(tmp_path):
+    path = str(tmp_path / "empty.pack")
+    assert ts.write_pack(path, []) == 0
+    with ts.SessionPack(path) as pack:
+        assert len(pack) == 0 and list(pack.strings()) == [] and pack.group_by_dc() == {}
+
+
+def test_truncated_pack_is_refused(tmp_path):
+    path = tmp_path / "sessions.pack"
+    ts.write_pack(str(path), ts.string_records([session_string(), session_string()]))
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(ValueError, match="truncated"):
+        ts.SessionPack(str(path))
+
+
+@pytest.mark.parametrize("data", [b"", b"TGSP", b"XXXX" + bytes(12), ts.PACK_HEADER.pack(b"TGSP", 2, 278, 0)])
+def test_what_is_not_a_pack_is_refused(tmp_path, data):
+    path = tmp_path / "other.pack"
+    path.write_bytes(data)
+    with pytest.raises(ValueError, match="not a session pack"):
+        ts.SessionPack(str(path))
+
+
+def test_sqlite_files_telethon_can_open(tmp_path):
+    from telethon.sessions import SQLiteSession
+    strings = [session_string(dc=4), session_string(dc=2, ip=V6)]
+    path = str(tmp_path / "sessions.pack")
+    ts.write_pack(path, ts.string_records(strings))
+    with ts.SessionPack(path) as pack:
+        files = [str(tmp_path / f"{i}.session") for i in range(len(pack))]
+        for i, file in enumerate(files):
+            pack.write_sqlite(i, file)
+    assert stat.S_IMODE(os.stat(files[0]).st_mode) == 0o600
+    opened = SQLiteSession(files[0][:-len(".session")])
+    assert (opened.dc_id, opened.auth_key.key) == (4, ts.session_fields(strings[0])[3])
+    opened.close()
+
+    back = str(tmp_path / "back.pack")
+    assert ts.write_pack(back, ts.sqlite_records(files)) == 2
+    with ts.SessionPack(back) as pack:
+        assert list(pack.strings()) == strings
+
+
+def test_pack_cli(tmp_path, capsys):
+    strings = [session_string(dc=2), session_string(dc=4), session_string(dc=4)]
+    lines, pack, out = (str(tmp_path / n) for n in ("in.txt", "s.pack", "out.txt"))
+    with open(lines, "w") as f:
+        f.write("\n".join(strings + ["", "junk"]) + "\n")
+    ts.cli(["pack", "encode", lines, pack])
+    assert "Packed 3 sessions" in capsys.readouterr().out
+    ts.cli(["pack", "decode", pack, "-o", out])
+    assert open(out).read().split() == strings and stat.S_IMODE(os.stat(out).st_mode) == 0o600
+    ts.cli(["pack", "stats", pack])
+    assert "DC 4: 2" in capsys.readouterr().out
+    ts.cli(["pack", "to-sqlite", pack, str(tmp_path / "db")])
+    assert sorted(os.listdir(tmp_path / "db")) == ["0.session", "1.session", "2.session"]
+
+    with pytest.raises(SystemExit) as exit:
+        ts.cli(["pack", "stats", lines])
+    assert exit.value.code == ts.EXIT_CODES["usage"]
@@ -0,0 +1,93 @@
+import asyncio, hashlib, os
+
+import pytest
+from telethon import password as telethon_password
+from telethon.sessions import StringSession
+from telethon.tl import types
+
+import fake_telegram
+import telegram_session as ts
+
+PHONE = "+447700900123"
+
+
+@pytest.fixture
+def challenge():
+    backend = fake_telegram.FakeBackend(seed=1)
+    return backend, backend.password_challenge()
+
+
+def fixed_urandom(n):
+    return hashlib.sha512(b"fixed").digest() * (n // 64) + hashlib.sha512(b"fixed").digest()[:n % 64]
+
+
+def test_srp_answer_matches_telethons_compute_check(challenge, monkeypatch):
+    backend, request = challenge
+    algo = request.current_algo
+    monkeypatch.setattr(os, "urandom", fixed_urandom)
+    expected = telethon_password.compute_check(request, backend.password)
+    a, m1, pw_hash, cpu = ts.srp_answer(algo.salt1, algo.salt2, algo.g, algo.p, request.srp_B,
+                                        backend.password)
+    assert (a, m1) == (expected.A, expected.M1)
+    assert pw_hash == telethon_password.compute_hash(algo, backend.password) and cpu > 0
+    # With the hash passed back in, the answer is the same without the PBKDF2.
+    again = ts.srp_answer(algo.salt1, algo.salt2, algo.g, algo.p, request.srp_B, backend.password, pw_hash)
+    assert again[:3] == (a, m1, pw_hash) and again[3] < cpu
+
+
+def test_srp_answer_passes_the_servers_check(challenge):
+    backend, request = challenge
+    algo = request.current_algo
+    a, m1, _, _ = ts.srp_answer(algo.salt1, algo.salt2, algo.g, algo.p, request.srp_B, backend.password)
+    assert backend.password_matches(types.InputCheckPasswordSRP(request.srp_id, a, m1))
+
+
+def test_srp_answer_rejects_a_bad_challenge(challenge):
+    backend, request = challenge
+    algo = request.current_algo
+    with pytest.raises(ValueError):
+        ts.srp_answer(algo.salt1, algo.salt2, algo.g, algo.p, b"\x00" * 256, backend.password)
+
+
+def test_password_checker_signs_in_and_caches_the_hash(backend):
+    backend.password_rate = 1
+
+    async def run():
+        import telethon
+        checker = ts.PasswordChecker()
+        client  = telethon.TelegramClient(StringSession(), 1, "a" * 32)
+        await client.connect()
+        users = []
+        for attempt in range(2):
+            sent = await client.send_code_request(PHONE)
+            try:
+                await client.sign_in(PHONE, backend.code_for(sent.phone_code_hash),
+                                     phone_code_hash=sent.phone_code_hash)
+            except Exception as e:
+                assert type(e).__name__ == "SessionPasswordNeededError"
+            users.append(await checker.check_async(client, PHONE, backend.password))
+        checker.forget(PHONE)
+        checker.close()
+        return checker, users
+    checker, users = asyncio.run(run())
+    assert all(isinstance(u, types.User) for u in users)
+    assert (checker.checks, checker.cache_hits, checker.hashes) == (2, 1, {})
+    assert ts.metrics().phases["password_cpu"]["count"] == 2
+
+
+def test_password_checker_refuses_an_unknown_algorithm():
+    challenge = types.account.Password(
+        new_algo=types.PasswordKdfAlgoUnknown(), new_secure_algo=types.SecurePasswordKdfAlgoUnknown(),
+        secure_random=b"", has_password=True, current_algo=types.PasswordKdfAlgoUnknown())
+    checker = ts.PasswordChecker()
+    with pytest.raises(ValueError, match="unsupported"):
+        checker._submit(PHONE, challenge, "hunter2")
+    checker.close()
+
+
+def test_batch_2fa_accounts_go_through_the_checker(backend):
+    backend.password_rate = 1
+    checker = ts.PasswordChecker()
+    jobs = [ts.Job(1, "a" * 32, f"+44770090000{i}") for i in range(3)]
+    asyncio.run(ts.run_batch(jobs, fake_telegram.FakeCodeSource(backend), passwords=checker))
+    assert all(j.session for j in jobs) and checker.checks == 3 and checker.hashes == {}
@@ -0,0 +1,86 @@
+import threading, time
+
+import pytest
+
+import telegram_session as ts
+
+
+def spin(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+@pytest.mark.parametrize("filename, function, category", [
+    ("/x/telegram_session.py", "srp_answer", "crypto"),
+    ("/x/telegram_session.py", "ask", "terminal (output and prompts)"),
+    ("/x/telegram_session.py", "run_batch", "other"),
+    ("/site-packages/telethon/crypto/aes.py", "encrypt_ige", "crypto"),
+    ("/site-packages/telethon/tl/tlobject.py", "serialize_bytes", "tl serialization"),
+    ("/lib/python3.11/selectors.py", "select", "waiting (network / idle loop)"),
+    ("/lib/python3.11/asyncio/base_events.py", "_run_once", "asyncio"),
+])
+def test_profile_categories(filename, function, category):
+    assert ts.profile_category(filename, function) == category
+
+
+def test_the_sampler_sees_a_busy_thread():
+    sampler = ts.StackSampler(interval=0.001)
+    worker = threading.Thread(target=spin, args=(0.2,), name="busy")
+    sampler.start()
+    worker.start()
+    worker.join()
+    sampler.stop()
+    assert sampler.samples > 10
+    busy = {k: n for k, n in sampler.stacks.items() if k.startswith("busy;")}
+    assert busy and all(k.endswith("test_profile.py:spin") for k in busy)
+    assert sum(n for (f, fn), n in sampler.leaves.items() if fn == "spin") == sum(busy.values())
+    for line in sampler.collapsed().splitlines():
+        stack, n = line.rsplit(" ", 1)
+        assert stack and int(n) > 0
+
+
+def test_the_summary_lists_phases_categories_and_top_functions():
+    sampler = ts.StackSampler(interval=0.01)
+    sampler.samples = 3
+    sampler.leaves = {("/x/telegram_session.py", "srp_answer"): 2, ("/lib/selectors.py", "select"): 1}
+    text = sampler.summary(1.0, 0.5, {"password": 0.4, "code_wait": 2.0}, {"password": 0.2})
+    assert "password" in text and "50%" in text and "code_wait" not in text
+    assert text.index("crypto") < text.index("waiting (network / idle loop)")
+    assert "srp_answer  (telegram_session.py, crypto)" in text
+
+
+def test_phases_record_their_cpu():
+    m = ts.metrics()
+    with m.time("password"):
+        spin(0.05)
+    m.start("code_wait")
+    time.sleep(0.05)
+    m.stop("code_wait")
+    assert m.cpu["password"] > m.cpu["code_wait"] and m.cpu["code_wait"] < m.run["code_wait"] / 2
+
+
+def test_the_profile_is_written_however_the_run_ends(tmp_path):
+    prefix = str(tmp_path / "run")
+    with ts.metrics().time("password"):
+        pass
+
+    def fail():
+        spin(0.05)
+        raise RuntimeError("boom")
+    with pytest.raises(RuntimeError):
+        ts.run_profiled(prefix, fail)
+    assert "fail" in (tmp_path / "run.collapsed").read_text()
+    assert "Per phase" in (tmp_path / "run.txt").read_text()
+
+
+def test_profile_wraps_a_subcommand(tmp_path):
+    prefix = str(tmp_path / "metrics")
+    ts.cli(["--profile", prefix, "metrics"])
+    assert (tmp_path / "metrics.txt").exists() and (tmp_path / "metrics.collapsed").exists()
+
+
+def test_a_command_is_still_required_without_profile():
+    with pytest.raises(SystemExit) as exit:
+        ts.cli([])
+    assert exit.value.code == 2
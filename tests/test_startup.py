@@ -0,0 +1,45 @@
+import builtins, importlib.metadata, importlib.util, subprocess, sys
+
+import pytest
+
+import telegram_session as ts
+from conftest import ROOT
+
+
+def test_import_loads_neither_telethon_nor_asyncio():
+    out = subprocess.run(
+        [sys.executable, "-c", "import sys, telegram_session; "
+                               "print(sorted(m for m in ('asyncio', 'telethon', 'dataclasses') if m in sys.modules))"],
+        cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+
+
+def test_telethon_version_comes_from_the_installed_metadata():
+    assert ts.telethon_version() == importlib.metadata.version("telethon")
+
+
+def missing(name):
+    raise importlib.metadata.PackageNotFoundError(name)
+
+
+def test_a_checkout_on_sys_path_still_counts(monkeypatch):
+    monkeypatch.setattr(importlib.metadata, "version", missing)
+    assert ts.telethon_version() == "unknown version"
+
+
+def test_missing_telethon_is_fatal(monkeypatch, capsys):
+    monkeypatch.setattr(importlib.metadata, "version", missing)
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: None)
+    monkeypatch.setattr(builtins, "input", lambda prompt="": "")
+    assert ts.telethon_version() is None
+    with pytest.raises(SystemExit) as exit:
+        ts.check_telethon()
+    assert exit.value.code == ts.EXIT_CODES["dependency"]
+    assert "pip install telethon" in capsys.readouterr().out
+
+
+def test_the_plain_classes_start_empty():
+    job = ts.Job(1, "a" * 32, "+447700900000")
+    assert (job.session, job.error, job.flood_wait, job.parks) == ("", "", 0, 0)
+    pending = ts.PendingSignIn(None, None, 1, 0.0)
+    assert (pending.stage, pending.tries, pending.pw_tries) == ("code", 0, 0)
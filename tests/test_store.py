@@ -0,0 +1,172 @@
+import csv, json, os, stat
+
+import pytest
+
+import telegram_session as ts
+from conftest import session_string
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ts.SessionStore(str(tmp_path / "sessions.db"))
+    yield store
+    store.close()
+
+
+def test_session_fields_decode_without_telethon():
+    key = os.urandom(256)
+    assert ts.session_fields(session_string(dc=4, key=key)) == (4, "149.154.167.51", 443, key)
+    v6 = session_string(dc=1, ip=bytes.fromhex("20010b28f23d8001000000000000000a"))
+    assert ts.session_fields(v6)[:2] == (1, "2001:b28:f23d:8001::a")
+
+
+@pytest.mark.parametrize("string", ["", "2AAAA", "1" + "A" * 40, "1%%%%"])
+def test_session_fields_reject_what_is_not_a_session(string):
+    with pytest.raises(ValueError):
+        ts.session_fields(string)
+
+
+def test_a_given_salt_is_reused():
+    salt = os.urandom(16)
+    a, b = ts.seal(b"one", salt), ts.seal(b"two", salt)
+    start = len(ts.SEAL_MAGIC)
+    assert a[start:start + 16] == b[start:start + 16] == salt
+    assert (ts.unseal(a), ts.unseal(b)) == (b"one", b"two")
+
+
+def test_store_is_owner_only(store):
+    assert stat.S_IMODE(os.stat(store.path).st_mode) == 0o600
+
+
+def test_store_seals_sessions_and_finds_them(store):
+    string = session_string()
+    row_id = store.add("+447700900001", 1, string, user_id=42)
+    sealed = store.db.execute("SELECT sealed FROM sessions").fetchone()[0]
+    assert string.encode() not in sealed
+    [row] = store.find(phone="+447700900001")
+    assert (row["id"], row["user_id"], row["dc"], row["session"]) == (row_id, 42, 2, string)
+    assert list(store.find(user_id=43)) == []
+
+
+def test_store_finds_by_every_lookup_newest_first(store):
+    store.add("+447700900001", 1, session_string(dc=2))
+    store.add("+447700900002", 1, session_string(dc=4))
+    store.add("+447700900003", 2, session_string(dc=4))
+    assert [r["phone"] for r in store.find(dc=4)] == ["+447700900003", "+447700900002"]
+    assert [r["phone"] for r in store.find(api_id=1, dc=4)] == ["+447700900002"]
+    assert len(list(store.find())) == store.count() == 3
+
+
+def test_store_lookups_use_the_indexes(store):
+    for column in ts.SessionStore.LOOKUPS:
+        plan = " ".join(str(r) for r in store.db.execute(
+            f"EXPLAIN QUERY PLAN SELECT * FROM sessions WHERE {column} = ?", (1,)))
+        assert "INDEX" in plan, column
+
+
+def test_store_rejects_a_known_auth_key(store):
+    string = session_string()
+    store.add("+447700900001", 1, string)
+    with pytest.raises(ts.DuplicateSessionError, match=r"\+447700900001"):
+        store.add("+447700900002", 1, string)
+    assert store.count() == 1
+
+
+def test_store_import_counts_duplicates_and_invalid_rows(store):
+    string = session_string()
+    rows = [("+447700900001", 1, string, None), ("+447700900002", 1, string, None),
+            ("+447700900003", 1, "not a session", None), ("+447700900004", 1, session_string(), 7)]
+    assert store.import_rows(rows) == (2, 1, 1)
+
+
+def test_store_lookup_by_an_unindexed_column(store):
+    with pytest.raises(ValueError):
+        list(store.find(api_hash="a" * 32))
+
+
+def test_store_keeps_its_salt_across_opens(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first = ts.SessionStore(path)
+    first.add("+447700900001", 1, session_string())
+    first.close()
+    again = ts.SessionStore(path)
+    assert again.salt == first.salt and len(list(again.find())) == 1
+    again.close()
+
+
+def test_store_refuses_the_wrong_passphrase(tmp_path, monkeypatch):
+    path = str(tmp_path / "sessions.db")
+    monkeypatch.setenv("TG_SESSION_PASSPHRASE", "correct horse")
+    store = ts.SessionStore(path)
+    store.add("+447700900001", 1, session_string())
+    store.close()
+    monkeypatch.setenv("TG_SESSION_PASSPHRASE", "battery staple")
+    store = ts.SessionStore(path)
+    with pytest.raises(ts.SealError):
+        list(store.find())
+    store.close()
+
+
+# ── keep_session is opt-in ───────────────────────────────
+def test_sessions_are_not_kept_without_a_passphrase(state_dir, capsys):
+    ts.keep_session("+447700900001", 1, session_string())
+    assert "TG_SESSION_PASSPHRASE" in capsys.readouterr().out
+    assert not (state_dir / "sessions.db").exists()
+
+
+def test_sessions_are_kept_with_a_passphrase(state_dir, monkeypatch):
+    monkeypatch.setenv("TG_SESSION_PASSPHRASE", "correct horse")
+    string = session_string()
+    ts.keep_session("+447700900001", 1, string, 42)
+    ts.keep_session("+447700900001", 1, string, 42)      # a duplicate is reported, not raised
+    store = ts.SessionStore()
+    assert [r["session"] for r in store.find(user_id=42)] == [string]
+    store.close()
+
+
+# ── The store subcommand ─────────────────────────────────
+def test_store_cli_import_get_and_export(tmp_path, capsys):
+    db, batch, export = (str(tmp_path / name) for name in ("s.db", "batch.csv", "export.csv"))
+    strings = [session_string(), session_string(dc=4)]
+    with open(batch, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["phone", "api_id", "session", "error"])
+        writer.writerow(["+447700900001", 1, strings[0], ""])
+        writer.writerow(["+447700900002", 1, strings[1], ""])
+        writer.writerow(["+447700900003", 1, "", "PhoneNumberBannedError"])
+    ts.cli(["store", "--db", db, "import", batch])
+    assert "Imported 2 sessions" in capsys.readouterr().out
+
+    ts.cli(["store", "--db", db, "get", "--dc", "4"])
+    [header, row] = list(csv.reader(capsys.readouterr().out.splitlines()))
+    assert header == ts.STORE_COLUMNS and row[1] == "+447700900002" and row[-1] == strings[1]
+
+    with pytest.raises(SystemExit) as exit:
+        ts.cli(["store", "--db", db, "get", "--phone", "+447700900009"])
+    assert exit.value.code == ts.EXIT_CODES["failed"]
+
+    ts.cli(["store", "--db", db, "export", export])
+    assert stat.S_IMODE(os.stat(export).st_mode) == 0o600
+    with open(export, newline="") as f:
+        assert sorted(r["session"] for r in csv.DictReader(f)) == sorted(strings)
+
+
+# ── The broker keeps what it signs in ────────────────────
+def test_broker_stores_its_sessions(backend, monkeypatch):
+    import asyncio
+    monkeypatch.setenv("TG_SESSION_PASSPHRASE", "correct horse")
+    phone = "+447700900123"
+
+    async def run():
+        broker = ts.SessionBroker()
+        try:
+            await broker.dispatch(json.dumps({"op": "provision", "phone": phone, "api_id": 1, "api_hash": "a" * 32}))
+            code = backend.code_for(broker.pending[phone].sent.phone_code_hash)
+            return await broker.sign_in({"phone": phone, "code": code})
+        finally:
+            await broker.close()
+    reply = asyncio.run(run())
+    store = ts.SessionStore()
+    [row] = store.find(phone=phone)
+    store.close()
+    assert (row["id"], row["session"]) == (reply["stored"], reply["session"])
@@ -0,0 +1,153 @@
+import builtins, json, os, stat
+
+import pytest
+from telethon import errors, types
+
+import telegram_session as ts
+
+HASH  = "0123456789abcdef0123456789abcdef"
+PHONE = "+447700900123"
+
+
+@pytest.fixture(autouse=True)
+def no_trace(monkeypatch):
+    """--trace sets a module-wide recorder; don't let it outlive the test."""
+    monkeypatch.setattr(ts, "TRACE", None)
+
+
+@pytest.fixture
+def typed(backend, monkeypatch):
+    """The walkthrough's prompts answered: the code Telegram sent last, `password`, else "1"."""
+    answers = {"password": None}
+
+    def fake_input(prompt=""):
+        if "code" in prompt:
+            return list(backend.codes.values())[-1][1]
+        if "password" in prompt:
+            return answers["password"] or backend.password
+        return "1"
+    monkeypatch.setattr(builtins, "input", fake_input)
+    return answers
+
+
+def record(path, *extra):
+    ts.cli(["--trace", path, "new", "--api-id", "1", "--api-hash", HASH, "--phone", PHONE, *extra])
+
+
+def replay(path, *extra):
+    ts.cli(["replay", path, "--speed", "0", *extra])
+
+
+def test_mask_phone():
+    assert ts.mask_phone("+447700900123") == "+44••••••••23"
+    assert ts.mask_phone("12025550123") == "+1••••••••23"
+
+
+def test_values_round_trip_with_secrets_replaced():
+    sent = types.auth.SentCode(type=types.auth.SentCodeTypeSms(length=5), phone_code_hash="abcdef",
+                               next_type=types.auth.CodeTypeCall(), timeout=120)
+    data = ts.trace_value(sent)
+    assert "abcdef" not in json.dumps(data)
+    back = ts.trace_object(json.loads(json.dumps(data)))
+    assert isinstance(back, types.auth.SentCode) and back.type.length == 5 and back.timeout == 120
+    assert back.phone_code_hash != "abcdef" and len(back.phone_code_hash) == 16
+
+
+def test_srp_parameters_are_kept_and_the_answer_is_not():
+    check = types.InputCheckPasswordSRP(srp_id=1, A=b"A" * 256, M1=b"M" * 32)
+    data = ts.trace_value(check)
+    assert data["A"] == {"len": 256} and data["M1"] == {"len": 32}
+    algo = types.PasswordKdfAlgoSHA256SHA256PBKDF2HMACSHA512iter100000SHA256ModPow(
+        salt1=b"s1", salt2=b"s2", g=3, p=b"p" * 256)
+    assert ts.trace_object(ts.trace_value(algo)).p == b"p" * 256
+
+
+@pytest.mark.parametrize("error", [
+    errors.FloodWaitError(None, capture=42), errors.PhoneMigrateError(None, capture=4),
+    errors.PhoneCodeInvalidError(None), ConnectionError("reset"),
+])
+def test_errors_are_rebuilt(error):
+    back = ts.rebuild_error(json.loads(json.dumps(ts.trace_error(error))))
+    assert type(back) is type(error)
+    assert getattr(back, "seconds", None) == getattr(error, "seconds", None)
+    assert getattr(back, "new_dc", None) == getattr(error, "new_dc", None)
+
+
+def test_a_recorded_sign_in_replays_to_the_same_outcome(backend, typed, tmp_path, capsys):
+    backend.migrate_rate = 1
+    path = str(tmp_path / "auth.trace")
+    record(path)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    [(header, steps)] = ts.read_traces(path)
+    assert header["phone"] == ts.mask_phone(PHONE) and steps[-1] == {**steps[-1], "op": "end", "exit": 0}
+    ops = [s["op"] for s in steps]
+    assert ops[0] == "connect" and "migrate" in ops and "SignInRequest" in ops
+
+    capsys.readouterr()
+    replay(path)
+    assert "Same outcome as the recording (exit 0)" in capsys.readouterr().out
+
+
+def test_the_trace_holds_no_secrets(backend, typed, tmp_path):
+    backend.password_rate = 1
+    path = str(tmp_path / "auth.trace")
+    record(path)
+    text = open(path, encoding="utf-8").read()
+    codes = [code for _, code in backend.codes.values()]
+    for secret in [PHONE.lstrip("+"), HASH, backend.password, *codes]:
+        assert secret not in text
+    assert "CheckPasswordRequest" in text
+
+
+def test_a_2fa_sign_in_replays(backend, typed, tmp_path, capsys):
+    backend.password_rate = 1
+    path = str(tmp_path / "auth.trace")
+    record(path)
+    capsys.readouterr()
+    replay(path)
+    assert "Same outcome as the recording (exit 0)" in capsys.readouterr().out
+
+
+def test_a_failure_replays_to_the_same_exit(backend, typed, tmp_path, capsys):
+    backend.password_rate = 1
+    typed["password"] = "wrong"
+    path = str(tmp_path / "auth.trace")
+    with pytest.raises(SystemExit) as exit:
+        record(path)
+    assert exit.value.code == ts.EXIT_CODES["password"]
+    capsys.readouterr()
+    replay(path)
+    assert f"Same outcome as the recording (exit {ts.EXIT_CODES['password']})" in capsys.readouterr().out
+
+
+def test_traces_append_and_replay_picks_one(backend, typed, tmp_path, capsys):
+    path = str(tmp_path / "auth.trace")
+    record(path)
+    backend.password_rate, typed["password"] = 1, "wrong"
+    with pytest.raises(SystemExit):
+        record(path)
+    assert len(ts.read_traces(path)) == 2
+    capsys.readouterr()
+    replay(path, "--index", "0")
+    assert "(exit 0)" in capsys.readouterr().out
+
+
+def test_a_truncated_trace_diverges(backend, typed, tmp_path, capsys):
+    path = tmp_path / "auth.trace"
+    record(str(path))
+    lines = path.read_text().splitlines()
+    sign_in = next(i for i, line in enumerate(lines) if '"op":"SignInRequest"' in line)
+    path.write_text("\n".join(lines[:sign_in]) + "\n")
+    with pytest.raises(SystemExit) as exit:
+        replay(str(path))
+    assert exit.value.code == ts.EXIT_CODES["failed"]
+    assert "diverged" in capsys.readouterr().out
+
+
+def test_replay_refuses_what_is_not_a_trace(tmp_path, monkeypatch):
+    monkeypatch.setattr(builtins, "input", lambda prompt="": "")
+    path = tmp_path / "empty.trace"
+    path.write_text("")
+    with pytest.raises(SystemExit) as exit:
+        replay(str(path))
+    assert exit.value.code == ts.EXIT_CODES["usage"]
@@ -0,0 +1,138 @@
+import asyncio, json, time
+
+import pytest
+
+import telegram_session as ts
+
+HASH = "a" * 32
+EVERY = [f"{ts.TRANSPORTS[t]}/{f}" for t, f in ts.race_candidates()]
+
+
+def only(backend, winner, delay=0.0, others=0.3):
+    """Make `winner` (a "ConnectionTcpX/ipvN" label) the fastest transport, the rest `others` behind."""
+    backend.transport_delay = {label: others for label in EVERY}
+    backend.transport_delay[winner] = delay
+
+
+def race(stagger=0.01, **kwargs):
+    async def run():
+        client, transport, family, seconds = await ts.race_transports(1, HASH, stagger=stagger, **kwargs)
+        await client.disconnect()
+        return transport, family, seconds
+    return asyncio.run(run())
+
+
+def test_candidates_cover_every_transport_alternating_families():
+    pairs = ts.race_candidates()
+    assert len(pairs) == 2 * len(ts.TRANSPORTS) == len(set(pairs))
+    assert [f for _, f in pairs[:4]] == ["ipv4", "ipv6", "ipv4", "ipv6"]
+
+
+def test_the_fastest_transport_wins(backend):
+    only(backend, "ConnectionTcpAbridged/ipv6")
+    transport, family, seconds = race()
+    assert (transport, family) == ("abridged", "ipv6") and seconds < 0.3
+
+
+def test_a_failing_candidate_lets_the_next_start_at_once(backend):
+    backend.transport_delay = {"ConnectionTcpFull/ipv4": None}
+    assert race(candidates=[("full", "ipv4"), ("full", "ipv6")], stagger=10)[:2] == ("full", "ipv6")
+
+
+def test_the_race_fails_when_nothing_connects(backend):
+    backend.transport_delay = {label: None for label in EVERY}
+    with pytest.raises(ConnectionError):
+        race()
+
+
+def test_the_client_is_pointed_at_the_family_it_raced(backend):
+    async def run():
+        client, *_ = await ts.race_transports(1, HASH, dc=4, candidates=[("full", "ipv6")])
+        return client.session.server_address, client.kwargs["use_ipv6"]
+    assert asyncio.run(run()) == (ts.DC_ADDRESSES_V6[4][0], True)
+
+
+# ── TransportCache ───────────────────────────────────────
+def test_cache_remembers_the_winner_per_network(state_dir):
+    cache = ts.TransportCache()
+    assert cache.winner() is None and cache.client_kwargs() == {} and cache.family() == "ipv4"
+    cache.learn("intermediate", "ipv6", 0.1234)
+    again = ts.TransportCache()
+    assert again.winner() == ("intermediate", "ipv6") and again.family() == "ipv6"
+    assert again.client_kwargs()["connection"].__name__ == "ConnectionTcpIntermediate"
+    entries = json.loads((state_dir / "transports.json").read_text())
+    assert entries[ts.network_id()]["seconds"] == 0.123
+
+
+def test_cache_entries_expire():
+    cache = ts.TransportCache(ttl=60)
+    cache.learn("abridged", "ipv4", 0.1)
+    cache.entries[cache.network]["at"] = time.time() - 61
+    assert cache.winner() is None
+
+
+def test_another_network_has_its_own_winner():
+    cache = ts.TransportCache()
+    cache.learn("abridged", "ipv4", 0.1)
+    cache.network = "elsewhere"
+    assert cache.winner() is None
+
+
+# ── connect_transport ────────────────────────────────────
+def connect(cache):
+    async def run():
+        client, transport, family, _ = await ts.connect_transport(1, HASH, cache)
+        await client.disconnect()
+        return transport, family
+    return asyncio.run(run())
+
+
+def test_a_miss_races_and_learns(backend):
+    only(backend, "ConnectionTcpObfuscated/ipv4", others=5)     # well past every stagger
+    cache = ts.TransportCache()
+    assert connect(cache) == ("obfuscated", "ipv4") == cache.winner()
+
+
+def test_a_fresh_winner_is_used_alone(backend, monkeypatch):
+    cache = ts.TransportCache()
+    cache.learn("full", "ipv6", 0.1)
+    learned_at = cache.entries[cache.network]["at"]
+    only(backend, "ConnectionTcpAbridged/ipv4", others=0.05)       # faster now, but not raced
+    raced = []
+    real = ts.race_transports
+
+    async def spy(api_id, api_hash, dc=2, candidates=None, **kwargs):
+        raced.append(list(candidates))
+        return await real(api_id, api_hash, dc, candidates, **kwargs)
+    monkeypatch.setattr(ts, "race_transports", spy)
+    assert connect(cache) == ("full", "ipv6")
+    assert raced == [[("full", "ipv6")]] and cache.entries[cache.network]["at"] == learned_at
+
+
+def test_a_failing_winner_is_re_raced(backend):
+    cache = ts.TransportCache()
+    cache.learn("full", "ipv6", 0.1)
+    only(backend, "ConnectionTcpIntermediate/ipv4", others=5)
+    backend.transport_delay["ConnectionTcpFull/ipv6"] = None
+    assert connect(cache) == ("intermediate", "ipv4") == cache.winner()
+
+
+# ── Where the winner is used ─────────────────────────────
+def test_the_background_client_reports_its_transport(backend):
+    only(backend, "ConnectionTcpFull/ipv4")
+    client = ts.BackgroundClient(1, HASH)
+    client.connect()
+    try:
+        assert client.transport == "full/ipv4" and client.is_connected()
+        assert ts.metrics().notes["transport"] == "full/ipv4"
+    finally:
+        client.disconnect()
+
+
+def test_race_subcommand_learns_the_fastest(backend, capsys):
+    only(backend, "ConnectionTcpIntermediate/ipv6", others=0.05)
+    backend.transport_delay["ConnectionTcpObfuscated/ipv4"] = None
+    ts.cli(["race", "--api-id", "1", "--api-hash", HASH, "--timeout", "1"])
+    out = capsys.readouterr().out
+    assert "intermediate/ipv6 is fastest" in out and "failed" in out
+    assert ts.transports().winner() == ("intermediate", "ipv6")
@@ -0,0 +1,146 @@
+import asyncio, csv, heapq, sqlite3, time
+
+import pytest
+
+import telegram_session as ts
+from conftest import session_string
+
+HASH = "a" * 32
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ts.SessionStore(str(tmp_path / "sessions.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def pinged(monkeypatch):
+    """check_session replaced: statuses by session string (default ok), and a log of every ping."""
+    statuses, log = {}, []
+
+    async def check(string, api_id, api_hash):
+        log.append((string, api_id, api_hash))
+        return statuses.get(string, ("ok", "user_id=1"))
+    monkeypatch.setattr(ts, "check_session", check)
+    return statuses, log
+
+
+def watcher(store, tmp_path, **kwargs):
+    return ts.SessionWatcher(1, HASH, store=store, queue_path=str(tmp_path / "regenerate.csv"), **kwargs)
+
+
+def test_once_pings_each_session_with_its_own_api_id(store, tmp_path, pinged):
+    _, log = pinged
+    strings = [session_string(), session_string()]
+    store.add("+447700900001", 1, strings[0])
+    store.add("+447700900002", 2, strings[1])
+    w = watcher(store, tmp_path, rate=100)
+    asyncio.run(w.run(once=True))
+    assert set(log) == {(strings[0], 1, HASH), (strings[1], 2, HASH)}
+    assert (w.pings, w.dead, w.errors) == (2, 0, 0)
+    assert ts.metrics().phases["ping"]["count"] == 2
+
+
+def test_dead_sessions_are_revoked_and_queued(store, tmp_path, pinged):
+    statuses, _ = pinged
+    ours, theirs, alive = session_string(), session_string(), session_string()
+    statuses[ours]   = ("dead", "AuthKeyUnregisteredError: …")
+    statuses[theirs] = ("banned", "UserDeactivatedBanError: …")
+    store.add("+447700900001", 1, ours)
+    store.add("+447700900002", 2, theirs)
+    store.add("+447700900003", 1, alive)
+    w = watcher(store, tmp_path, rate=100)
+    asyncio.run(w.run(once=True))
+    assert w.dead == 2 and [r["phone"] for r in store.find() if not r["revoked_at"]] == ["+447700900003"]
+    with open(w.queue_path, newline="") as f:
+        rows = sorted(csv.DictReader(f), key=lambda r: r["phone"])
+    assert [(r["api_id"], r["api_hash"], r["phone"]) for r in rows] == [
+        ("1", HASH, "+447700900001"), ("2", "", "+447700900002")]
+    assert rows[0]["reason"].startswith("AuthKeyUnregisteredError")
+    assert [id_ for id_, *_ in store.live()] == [3]
+
+
+def test_a_network_error_is_retried_with_backoff(store, tmp_path, pinged):
+    statuses, _ = pinged
+    string = session_string()
+    statuses[string] = ("error", "ConnectionError: …")
+    store.add("+447700900001", 1, string)
+    w = watcher(store, tmp_path, interval=900, jitter=0)
+    w.sync(spread=False)
+    for n, backoff in ((1, ts.WATCH_RETRY), (2, 2 * ts.WATCH_RETRY)):
+        due_at, id_ = heapq.heappop(w.due)
+        asyncio.run(w.ping(id_, due_at))
+        assert w.failures[1] == n and w.due[0][0] == pytest.approx(time.time() + backoff, abs=1)
+    statuses[string] = ("ok", "user_id=1")
+    asyncio.run(w.ping(1, time.time()))
+    assert w.failures == {} and w.due[-1][0] == pytest.approx(time.time() + 900, abs=1)
+
+
+def test_the_most_recently_used_go_first_when_budget_is_short(store, tmp_path, pinged):
+    _, log = pinged
+    strings = [session_string() for _ in range(4)]
+    for i, string in enumerate(strings):
+        store.add(f"+44770090000{i}", 1, string)
+    store.touch([2], when=time.time() + 100)
+    store.touch([4], when=time.time() + 50)
+    w = watcher(store, tmp_path, rate=20, concurrency=1)
+    asyncio.run(w.run(once=True))
+    assert [s for s, *_ in log[:2]] == [strings[1], strings[3]]
+
+
+def test_sync_follows_the_store(store, tmp_path):
+    store.add("+447700900001", 1, session_string())
+    w = watcher(store, tmp_path, interval=100)
+    w.sync()
+    assert set(w.priority) == {1} and time.time() <= w.due[0][0] <= time.time() + 100
+    store.add("+447700900002", 1, session_string())
+    store.revoke(1)
+    w.sync()
+    assert set(w.priority) == {2}
+
+
+def test_bound_holds_only_while_the_rate_keeps_up(store, tmp_path):
+    for i in range(10):
+        store.add(f"+4477009000{i:02}", 1, session_string())
+    w = watcher(store, tmp_path, interval=10, jitter=0.2, rate=2)
+    w.sync()
+    assert w.bound() == pytest.approx(12)
+    w.rate = 1
+    assert w.bound() is None
+
+
+def test_store_get_marks_sessions_as_used(store, capsys):
+    store.add("+447700900001", 1, session_string())
+    store.add("+447700900002", 1, session_string())
+    ts.cli(["store", "--db", store.path, "get", "--phone", "+447700900002"])
+    used = dict(store.db.execute("SELECT id, used_at FROM sessions"))
+    assert used[1] is None and used[2] > time.time() - 5
+
+
+def test_an_older_store_gains_the_new_columns(tmp_path):
+    path = str(tmp_path / "old.db")
+    db = sqlite3.connect(path)
+    db.execute("""CREATE TABLE sessions (id INTEGER PRIMARY KEY, phone TEXT NOT NULL, user_id INTEGER,
+        api_id INTEGER NOT NULL, dc INTEGER NOT NULL, key_hash BLOB NOT NULL UNIQUE,
+        sealed BLOB NOT NULL, created_at REAL NOT NULL)""")
+    db.close()
+    store = ts.SessionStore(path)
+    store.add("+447700900001", 1, session_string())
+    assert [r["revoked_at"] for r in store.find()] == [None]
+    store.close()
+
+
+def test_watch_once_exits_failed_when_something_died(store, tmp_path, pinged, capsys):
+    statuses, _ = pinged
+    string = session_string()
+    statuses[string] = ("dead", "AuthKeyUnregisteredError: …")
+    store.add("+447700900001", 1, string)
+    store.close()
+    queue = str(tmp_path / "queue.csv")
+    with pytest.raises(SystemExit) as exit:
+        ts.cli(["watch", "--api-id", "1", "--api-hash", HASH, "--db", store.path, "--queue", queue,
+                "--once", "--rate", "100"])
+    assert exit.value.code == ts.EXIT_CODES["failed"]
+    assert "1 dead sessions queued" in capsys.readouterr().out